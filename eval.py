@@ -1,6 +1,7 @@
 import pandas as pd
 import asyncio
 from src.agent.workflow import run_agent_pipeline
+from src.log import setup_logging
 import time
 
 async def eval_qa():
@@ -64,4 +65,5 @@ async def eval_qa():
     pd.DataFrame(results).to_csv("data/processed/eval_results.csv", index=False)
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(eval_qa())
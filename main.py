@@ -1,17 +1,65 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from src.agent.workflow import run_agent_pipeline, run_fast_qa_pipeline
+from src.config import Config
+from src.agent.workflow import (
+    run_agent_pipeline, run_fast_qa_pipeline, stream_agent_pipeline, run_batch_qa_pipeline, speculation_stats
+)
+from src.tools.sql_store import open_sql_store, close_sql_store, get_sql_store
+from src.tools.http_client import open_http_clients, close_http_clients
+from src.tools.embedding_cache import get_embedding_cache, close_embedding_cache
+from src.tools.database import load_bm25, close_retrieval_executor, open_vector_backend, close_vector_backend
+from src.tools.bm25 import tokenize
+from src.tools.reranker import start_rerank_service, stop_rerank_service, get_rerank_service
+from src.agent.answer_cache import get_answer_cache, close_answer_cache
+from src.agent.semantic_cache import get_semantic_cache
+from src.agent.intent import get_intent_classifier
+from src.agent.router import router_stats
+from src.agent.prompt import prompt_stats
+from src.tools.api_wrapper import get_patient_client
+from src.tools.resilience import render_prometheus as render_resilience_metrics
+from src.tracing import METRICS, collect_trace, span
+from src.log import get_logger, setup_logging, shutdown_logging, RequestIdMiddleware
 import time
+import json
 import os
 
-app = FastAPI()
+logger = get_logger("api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    # Open shared resources once per worker, not once per request
+    open_vector_backend() # Qdrant or the in-process NumPy index (VECTOR_BACKEND)
+    open_sql_store()
+    await open_http_clients()
+    get_embedding_cache()
+    load_bm25() # Validates the index header now instead of on the first query
+    tokenize("อุ่นเครื่อง warm-up") # PyThaiNLP loads its dictionary on first use (~0.5s)
+    await start_rerank_service()
+    get_answer_cache()
+    get_intent_classifier() # Trains the local router (~0.2s) before the first agent query
+    logger.info("API v2.5 ready - Chat Mode & Nomic Embeddings Loaded")
+    yield
+    await stop_rerank_service()
+    close_answer_cache()
+    await close_http_clients()
+    close_embedding_cache()
+    close_retrieval_executor()
+    close_vector_backend()
+    close_sql_store()
+    shutdown_logging() # Flush queued records
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestIdMiddleware) # X-Request-ID in every log record and response
 
 class QueryRequest(BaseModel):
     question: str
+    trace: bool = False # Return per-stage spans with the answer
 
-@app.on_event("startup")
-async def startup_event():
-    print("\n\n🔥 [SYSTEM] API v2.5 - Chat Mode & Nomic Embeddings Loaded 🔥\n\n")
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
 
 @app.post("/api/ask")
 async def ask_agent(request: QueryRequest):
@@ -19,19 +67,109 @@ async def ask_agent(request: QueryRequest):
     
     try:
         # FAST MODE for 0.5s latency target
-        answer = await run_fast_qa_pipeline(request.question)
+        timings = {}
+        want_trace = Config.TRACING_ENABLED and (request.trace or Config.TRACE_RESPONSES)
+        with (collect_trace() if want_trace else nullcontext()) as spans:
+            with span("fast_qa"):
+                answer = await run_fast_qa_pipeline(request.question, timings=timings)
         # answer = await run_agent_pipeline(request.question)
         
         process_time = (time.time() - start_time) * 1000
-        print(f" [Log] Processed in {process_time:.2f}ms")
+        logger.info("Request processed", extra={"fields": {
+            "latency_ms": round(process_time, 2),
+            "answer_cache": timings.get("answer_cache"),
+            "prompt_tokens": timings.get("prompt_tokens"), # None when no synthesis ran (cache hit)
+            "prefill_ms": timings.get("prefill_ms")
+        }})
         
-        return {
+        response = {
             "answer": answer,
-            "latency_ms": process_time
+            "latency_ms": process_time,
+            "timings": timings
         }
+        if want_trace:
+            response["trace"] = spans
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/ask/stream")
+async def ask_agent_stream(request: QueryRequest, http_request: Request):
+    """
+    Free-text agent mode over Server-Sent Events.
+    Events: `meta` (intent + retrieval summary), `token` (text deltas), `done` (ttft_ms, total_ms) or `error`.
+    """
+    async def event_stream():
+        events = stream_agent_pipeline(request.question)
+        try:
+            async for event, data in events:
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling generation")
+                    break
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            await events.aclose() # Closes the Ollama stream -> upstream generation stops
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/ask/batch")
+async def ask_batch(request: BatchQueryRequest, http_request: Request):
+    """
+    Multiple-choice QA for many questions at once (evaluation, bulk scoring).
+    Streams NDJSON: one {"index", "answer", "source", "latency_ms", "context_ids"} line per question in input order,
+    then a final {"done": true, "total_ms", "timings"} line.
+    """
+    if len(request.questions) > Config.BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {Config.BATCH_MAX_QUESTIONS} questions per batch")
+
+    async def ndjson_stream():
+        start_time = time.time()
+        timings = {}
+        results = run_batch_qa_pipeline(request.questions, timings=timings)
+        try:
+            async for item in results:
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling batch")
+                    break
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            else:
+                process_time = (time.time() - start_time) * 1000
+                logger.info("Batch processed", extra={"fields": {"questions": len(request.questions), "latency_ms": round(process_time, 2)}})
+                yield json.dumps({"done": True, "total_ms": process_time, "timings": timings}) + "\n"
+        finally:
+            await results.aclose() # Cancels retrieval/synthesis still in flight
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+@app.get("/api/stats")
+async def stats():
+    """Cache and batching counters for tuning."""
+    answer_cache = get_answer_cache()
+    embedding_cache = get_embedding_cache()
+    semantic_cache = get_semantic_cache()
+    sql_store = get_sql_store()
+    return {
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "reranker": get_rerank_service().stats(),
+        "router": router_stats(),
+        "speculation": speculation_stats(),
+        "prompt": prompt_stats(),
+        "patient_api": get_patient_client().stats(),
+        "sql": sql_store.stats() if sql_store else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency histograms, circuit breakers and adaptive timeouts in Prometheus text format."""
+    body = METRICS.render_prometheus() + render_resilience_metrics()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
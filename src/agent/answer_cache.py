@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import unicodedata
+from cachetools import TTLCache
+from src.config import Config
+from src.log import get_logger
+
+logger = get_logger("answer_cache")
+
+# Process-wide singleton, see get_answer_cache()
+ANSWER_CACHE = None
+
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form used as the cache key.
+    NFKC + zero-width removal + Thai normalization (duplicate marks, เเ -> แ, Thai digits)
+    + case-folded Latin + collapsed whitespace.
+    """
+    text = unicodedata.normalize("NFKC", question)
+    text = _ZERO_WIDTH.sub("", text)
+    try:
+        from pythainlp.util import normalize, thai_digit_to_arabic_digit
+        text = thai_digit_to_arabic_digit(normalize(text))
+    except ImportError:
+        pass
+    text = text.casefold()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class IndexVersion:
+    """
+    Identifies the indexes the answers were computed against.
+    Reads the version written by ingestion into the manifest, re-reading only when the file changes,
+    so checking it on every lookup costs one stat().
+    """
+
+    def __init__(self):
+        self._mtime = None
+        self._version = None
+
+    def current(self) -> str:
+        paths = [Config.INDEX_MANIFEST_PATH, os.path.join(Config.BM25_INDEX_PATH, "header.json")]
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        if mtimes != self._mtime:
+            self._mtime = mtimes
+            try:
+                with open(Config.INDEX_MANIFEST_PATH, "r", encoding="utf-8") as f:
+                    manifest_version = json.load(f).get("version")
+            except (OSError, ValueError):
+                manifest_version = None
+            # No manifest (index built elsewhere): fall back to the file timestamps
+            self._version = manifest_version or "-".join(str(m) for m in mtimes)
+        return self._version
+
+
+class AnswerCache:
+    """
+    Answer cache in front of run_fast_qa_pipeline.
+    Memory tier: TTLCache (TTL = Config.CACHE_TTL, LRU eviction when full).
+    Optional persistent tier: SQLite at ANSWER_CACHE_PATH, shared across restarts and workers.
+    Keys: normalized question + synthesizer/embedding/reranker models + index version.
+    A new index version clears both tiers.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, path: str = None):
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.index_version = IndexVersion()
+        self._seen_version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, answer TEXT, index_version TEXT, created_at REAL)"
+            )
+        self._db_lock = asyncio.Lock() if self._db else None
+
+    def _key(self, question: str, version: str) -> str:
+        parts = [
+            normalize_question(question),
+            Config.SYNTHESIZER_MODEL,
+            Config.EMBEDDING_MODEL,
+            Config.RERANKER_MODEL,
+            version
+        ]
+        return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _check_version(self) -> str:
+        version = self.index_version.current()
+        if self._seen_version is not None and version != self._seen_version:
+            # Index rebuilt: every cached answer may be stale
+            self.memory.clear()
+            self.invalidations += 1
+            if self._db:
+                self._db.execute("DELETE FROM answers WHERE index_version != ?", (version,))
+            logger.info("Index version changed, answer cache cleared", extra={"fields": {"index_version": version}})
+        self._seen_version = version
+        return version
+
+    def _db_get(self, key: str):
+        row = self._db.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row and time.time() - row[1] < self.ttl:
+            return row[0]
+        return None
+
+    def _db_set(self, key: str, answer: str, version: str):
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (key, answer, index_version, created_at) VALUES (?, ?, ?, ?)",
+            (key, answer, version, time.time())
+        )
+
+    async def get(self, question: str):
+        key = self._key(question, self._check_version())
+        answer = self.memory.get(key)
+        if answer is None and self._db:
+            async with self._db_lock:
+                answer = await asyncio.to_thread(self._db_get, key)
+            if answer is not None:
+                self.memory[key] = answer
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    async def set(self, question: str, answer: str):
+        version = self._check_version()
+        key = self._key(question, version)
+        self.memory[key] = answer
+        if self._db:
+            async with self._db_lock:
+                await asyncio.to_thread(self._db_set, key, answer, version)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.memory),
+            "invalidations": self.invalidations,
+            "persistent": self._db is not None
+        }
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+
+def get_answer_cache():
+    """Returns the shared cache, or None when disabled."""
+    global ANSWER_CACHE
+    if not Config.ANSWER_CACHE_ENABLED:
+        return None
+    if ANSWER_CACHE is None:
+        ANSWER_CACHE = AnswerCache(
+            maxsize=Config.ANSWER_CACHE_SIZE,
+            ttl=Config.CACHE_TTL,
+            path=Config.ANSWER_CACHE_PATH or None
+        )
+    return ANSWER_CACHE
+
+
+def close_answer_cache():
+    global ANSWER_CACHE
+    if ANSWER_CACHE is not None:
+        ANSWER_CACHE.close()
+        ANSWER_CACHE = None
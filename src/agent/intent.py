@@ -0,0 +1,209 @@
+import re
+import csv
+from collections import deque
+import numpy as np
+from src.config import Config
+from src.log import get_logger
+
+logger = get_logger("intent")
+
+INTENTS = ["vector_search", "sql_query", "api_lookup", "hybrid"]
+
+# Keyword cues per intent, matched in one pass by KeywordMatcher.
+# They are classifier features, not verdicts: "เฉลี่ย" in a knowledge question must not force SQL.
+INTENT_KEYWORDS = {
+    "sql_query": [
+        "avg", "average", "count", "total", "how many", "number of", "percentage", "percent",
+        "sum of", "maximum", "minimum", "most common", "group by", "per department", "list all",
+        "กี่คน", "กี่ราย", "เฉลี่ย", "จำนวน", "ร้อยละ", "สัดส่วน", "สถิติ", "ทั้งหมด", "นับ", "รายชื่อ",
+        "มากที่สุด", "น้อยที่สุด", "แยกตาม"
+    ],
+    "api_lookup": [
+        "patient id", "patient number", "latest", "current", "real-time", "realtime", "right now",
+        "vitals", "live", "admitted", "record for", "lookup",
+        "รหัสผู้ป่วย", "ผู้ป่วยรหัส", "ผู้ป่วยหมายเลข", "คนไข้รหัส", "hn", "ล่าสุด", "สัญญาณชีพ", "ประวัติ", "สถานะ"
+    ],
+    "vector_search": [
+        "symptom", "treat", "treatment", "cause", "side effect", "dose", "prevent", "department", "guideline",
+        "อาการ", "รักษา", "สาเหตุ", "เกิดจาก", "ผลข้างเคียง", "ป้องกัน", "แผนก", "ยา", "โรค", "ควร", "อย่างไร"
+    ],
+}
+
+# "id: 123", "รหัส 123", "patient 42", "HN 5521": an identifier the patient API can resolve
+PATIENT_ID = re.compile(r"\b(id|รหัส|number|patient|hn|หมายเลข)\s*:?\s*\d+|ผู้ป่วย\s*\d+", re.IGNORECASE)
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over all keywords: one left-to-right pass over the query,
+    whatever the number of keywords (the old `any(k in query ...)` scanned once per keyword).
+    Thai has no spaces between words, so Thai keywords match anywhere; Latin keywords
+    must sit on word boundaries ("hn" should not fire inside "john").
+    """
+
+    def __init__(self, keywords: dict):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for label, words in keywords.items():
+            for word in words:
+                self._add(word.casefold(), label)
+        self._build_failure_links()
+
+    def _add(self, word: str, label: str):
+        state = 0
+        for char in word:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((label, len(word), word.isascii()))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())  # depth-1 states fail back to the root
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    @staticmethod
+    def _is_word_char(char: str) -> bool:
+        return char.isascii() and char.isalnum()
+
+    def matches(self, text: str) -> dict:
+        """{label: number of keyword hits} for the (case-folded) text."""
+        text = text.casefold()
+        hits = {}
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for label, length, latin in self._out[state]:
+                if latin:
+                    start = end - length + 1
+                    if (start > 0 and self._is_word_char(text[start - 1])) or \
+                       (end + 1 < len(text) and self._is_word_char(text[end + 1])):
+                        continue
+                hits[label] = hits.get(label, 0) + 1
+        return hits
+
+
+def _ngrams(text: str, low: int = 2, high: int = 4):
+    padded = f" {' '.join(text.casefold().split())} "
+    for n in range(low, high + 1):
+        for i in range(len(padded) - n + 1):
+            yield padded[i:i + n]
+
+
+class IntentClassifier:
+    """
+    Multinomial logistic regression over character 2-4-grams (works for Thai without
+    a tokenizer) plus keyword-automaton and patient-ID features.
+    Trained in-process from a small labeled CSV (text,intent) in well under a second.
+    """
+
+    def __init__(self, matcher: KeywordMatcher = None):
+        self.matcher = matcher or KeywordMatcher(INTENT_KEYWORDS)
+        self.labels = list(INTENTS)
+        self.vocab = {}
+        self.weights = None
+        self.bias = None
+
+    def _features(self, text: str, grow: bool = False) -> dict:
+        """Sparse feature vector {index: value}, n-grams l2-normalized."""
+        grams = {}
+        for gram in _ngrams(text):
+            grams[gram] = grams.get(gram, 0) + 1
+        norm = sum(v * v for v in grams.values()) ** 0.5 or 1.0
+        named = {f"g:{gram}": count / norm for gram, count in grams.items()}
+        for label, count in self.matcher.matches(text).items():
+            named[f"kw:{label}"] = float(min(count, 3))
+        if PATIENT_ID.search(text):
+            named["has_patient_id"] = 1.0
+
+        features = {}
+        for name, value in named.items():
+            index = self.vocab.get(name)
+            if index is None:
+                if not grow:
+                    continue
+                index = self.vocab[name] = len(self.vocab)
+            features[index] = value
+        return features
+
+    def fit(self, texts: list, intents: list, epochs: int = 300, lr: float = 0.5, l2: float = 1e-3):
+        rows = [self._features(text, grow=True) for text in texts]
+        x = np.zeros((len(rows), len(self.vocab)), dtype=np.float32)
+        for i, row in enumerate(rows):
+            for index, value in row.items():
+                x[i, index] = value
+        y = np.zeros((len(rows), len(self.labels)), dtype=np.float32)
+        for i, intent in enumerate(intents):
+            y[i, self.labels.index(intent)] = 1.0
+
+        # Full-batch gradient descent on the softmax cross-entropy (tiny data, no SGD noise needed)
+        w = np.zeros((x.shape[1], y.shape[1]), dtype=np.float32)
+        b = np.zeros(y.shape[1], dtype=np.float32)
+        for _ in range(epochs):
+            probs = _softmax(x @ w + b)
+            grad = probs - y
+            w -= lr * (x.T @ grad / len(rows) + l2 * w)
+            b -= lr * grad.mean(axis=0)
+        self.weights, self.bias = w, b
+        return self
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        features = self._features(text)
+        indices = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        return _softmax(values @ self.weights[indices] + self.bias)
+
+    def predict(self, text: str):
+        """(intent, confidence)."""
+        probs = self.predict_proba(text)
+        best = int(np.argmax(probs))
+        return self.labels[best], float(probs[best])
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+
+def load_labeled_queries(path: str = None):
+    """(texts, intents) from the training CSV; unknown intents are skipped."""
+    texts, intents = [], []
+    with open(path or Config.INTENT_TRAINING_PATH, "r", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            if row.get("intent") in INTENTS and row.get("text"):
+                texts.append(row["text"])
+                intents.append(row["intent"])
+    return texts, intents
+
+
+# Process-wide singleton, trained on first use (see get_intent_classifier())
+INTENT_CLASSIFIER = None
+
+
+def get_intent_classifier():
+    """Returns the trained classifier, or False when the training data is missing."""
+    global INTENT_CLASSIFIER
+    if INTENT_CLASSIFIER is None:
+        try:
+            texts, intents = load_labeled_queries()
+            INTENT_CLASSIFIER = IntentClassifier().fit(texts, intents)
+            logger.info("Intent classifier trained", extra={"fields": {"examples": len(texts), "features": len(INTENT_CLASSIFIER.vocab)}})
+        except OSError as e:
+            logger.warning("Intent training data not found, every query goes to the LLM router", extra={"fields": {"error": str(e)}})
+            INTENT_CLASSIFIER = False
+    return INTENT_CLASSIFIER
@@ -0,0 +1,336 @@
+import re
+import json
+import math
+import threading
+import statistics
+from collections import deque
+from src.config import Config
+from src.pipelines.chunking import count_tokens, iter_segments
+from src.tracing import record
+from src.log import get_logger
+
+logger = get_logger("prompt")
+
+# Everything before the first variable byte is identical for every request, so Ollama can
+# reuse the KV cache of that prefix instead of prefilling it again. Never format request
+# data (language, dates, IDs) into these strings: put it in the last user message.
+CHOICE_SYSTEM = "You are a specialized medical assistant. Select the single correct option (ก, ข, ค, or ง) based strictly on the context."
+# Few-shot to break the 1B model's "C" bias
+CHOICE_EXAMPLES = [
+    {"role": "user", "content": "Context: Patient has fever.\n\nQuestion: What is the symptom?\nAnswer:"},
+    {"role": "assistant", "content": "ก"}
+]
+AGENT_SYSTEM = "You are a helpful Thai-English medical assistant. Answer based ONLY on context."
+
+_THAI = re.compile(r"[\u0E01-\u0E2E]")  # Thai consonants
+_SPACES = re.compile(r"\s+")
+
+# Prefill counters reported by Ollama (see observe_prompt_eval)
+PROMPT_STATS = {
+    "requests": 0,
+    "prompt_tokens": 0,        # prompt_eval_count: tokens Ollama actually evaluated
+    "prefill_ms": 0.0,         # prompt_eval_duration
+    "context_tokens_in": 0,    # context synthesizer tokens before budgeting ...
+    "context_tokens_out": 0,   # ... and after
+    "duplicates_dropped": 0,
+    "calibration_samples": 0,  # responses the token ratio was learned from
+    "calibration_cold": 0      # of the current window, whole-prompt evaluations left out
+}
+_STATS_LOCK = threading.Lock()
+# (tail ratio, cold threshold) of recent responses, see _calibrate
+_RATIOS = deque(maxlen=Config.PROMPT_CALIBRATION_WINDOW)
+_RATIO = None  # median of _RATIOS once PROMPT_CALIBRATION_SAMPLES are in
+
+_TOKENIZER = None  # HF tokenizer of the synthesizer, or False to calibrate the estimate
+
+
+def _load_tokenizer():
+    """The synthesizer's own tokenizer when PROMPT_TOKENIZER is set and `tokenizers` can load it."""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        _TOKENIZER = False
+        if Config.PROMPT_TOKENIZER:
+            try:
+                from tokenizers import Tokenizer
+                _TOKENIZER = Tokenizer.from_pretrained(Config.PROMPT_TOKENIZER)
+            except Exception as e:  # ImportError, or no network/cache for the files
+                logger.warning("Synthesizer tokenizer unavailable, calibrating the estimate", extra={"fields": {
+                    "tokenizer": Config.PROMPT_TOKENIZER, "error": str(e)
+                }})
+    return _TOKENIZER
+
+
+def token_ratio() -> float:
+    """
+    Synthesizer tokens per count_tokens() token (the embedding model's WordPiece estimate):
+    the median over the last PROMPT_CALIBRATION_WINDOW responses once
+    PROMPT_CALIBRATION_SAMPLES are in, PROMPT_TOKEN_RATIO until then.
+    """
+    return Config.PROMPT_TOKEN_RATIO if _RATIO is None else _RATIO
+
+
+def _calibrate(prompt_tokens: int, prefix_estimate: int, tail_estimate: int):
+    """
+    Adds one sample (called under _STATS_LOCK). Ollama counts only what it had to evaluate:
+    the variable tail while the fixed prefix is in its prompt cache (the steady state), the
+    whole prompt when it is not (model reloaded, another slot, evicted). So the ratio is
+    taken against the tail, and samples above the window's median by more than half the
+    prefix are treated as cold evaluations and left out; being a window, early or stale
+    samples age out instead of biasing the ratio for the life of the process.
+    """
+    global _RATIO
+    _RATIOS.append((prompt_tokens / tail_estimate, 1 + prefix_estimate / (2 * tail_estimate)))
+    PROMPT_STATS["calibration_samples"] += 1
+    if len(_RATIOS) < Config.PROMPT_CALIBRATION_SAMPLES:
+        return
+    median = statistics.median(ratio for ratio, _ in _RATIOS)
+    warm = [ratio for ratio, cold_above in _RATIOS if ratio < median * cold_above]
+    PROMPT_STATS["calibration_cold"] = len(_RATIOS) - len(warm)
+    _RATIO = statistics.median(warm) if warm else median
+
+
+def synthesizer_tokens(text: str, estimate: int = None) -> int:
+    """SYNTHESIZER_MODEL tokens in `text`; `estimate` = count_tokens(text) when already known."""
+    tokenizer = _load_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return math.ceil((count_tokens(text) if estimate is None else estimate) * token_ratio())
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    """Character n-grams: language-agnostic overlap that needs no Thai word segmentation."""
+    text = _SPACES.sub(" ", text.lower()).strip()
+    return {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+
+
+def _overlap(a: set, b: set) -> float:
+    """Containment of the smaller set: catches a passage repeated inside a longer one."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def dedupe_passages(passages: list, threshold: float = None) -> list:
+    """Keeps passages in rank order, dropping any that mostly repeats a higher-ranked one."""
+    threshold = Config.PROMPT_DEDUP_THRESHOLD if threshold is None else threshold
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage)
+        if any(_overlap(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def budget_passages(question: str, passages: list, budget: int) -> tuple:
+    """
+    Fits reranked passages into `budget` synthesizer tokens.
+    Near-duplicates are dropped, then sentences are picked by character-trigram overlap
+    with the question (ties go to the higher-ranked passage) until the budget is spent.
+    Each passage keeps its picked sentences in their original order; passages left with
+    none are omitted. Returns (passages, stats).
+    """
+    unique = dedupe_passages([p for p in passages if p and p.strip()])
+    if budget <= 0:
+        return [], {"passages": len(passages), "duplicates": 0, "tokens_in": 0, "tokens_out": 0}
+    question_shingles = _shingles(question)
+    candidates, seen = [], set()
+    # iter_segments splits on the estimate, so its cap is the budget in estimate units
+    split_at = max(1, int(budget / token_ratio()))
+    for rank, passage in enumerate(unique):
+        for _, offset, sentence, estimate in iter_segments([(rank, passage)], split_at):
+            key = _SPACES.sub(" ", sentence).strip()
+            if not key or key in seen:
+                continue  # The chunker's sentence overlap repeats boundaries across chunks
+            seen.add(key)
+            shingles = _shingles(key)
+            relevance = len(shingles & question_shingles) / (len(shingles) ** 0.5)
+            candidates.append((relevance, rank, offset, key, synthesizer_tokens(key, estimate)))
+
+    tokens_in = sum(c[4] for c in candidates)
+    picked, spent = [], 0
+    for candidate in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        if spent + candidate[4] > budget:
+            continue  # A shorter, less relevant sentence may still fit
+        picked.append(candidate)
+        spent += candidate[4]
+
+    trimmed = []
+    for rank in range(len(unique)):
+        sentences = sorted((c for c in picked if c[1] == rank), key=lambda c: c[2])
+        if sentences:
+            trimmed.append(" ".join(c[3] for c in sentences))
+    stats = {
+        "passages": len(passages),
+        "duplicates": len([p for p in passages if p and p.strip()]) - len(unique),
+        "tokens_in": tokens_in,
+        "tokens_out": spent
+    }
+    return trimmed, stats
+
+
+def _compact(value) -> str:
+    """One-line JSON without padding or \\u escapes (Thai stays 1 char instead of 6)."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _format_patients(result: dict) -> list:
+    lines = []
+    for patient_id, data in result.items():
+        if not isinstance(data, dict) or "error" in data:
+            lines.append(f"{patient_id}: unavailable")
+            continue
+        fields = {k: v for k, v in data.items() if v not in (None, "", [], {})}
+        lines.append(f"{patient_id}: {_compact(fields)}")
+    return lines
+
+
+def _format_table(result: dict) -> list:
+    """Columnar SQL result as a pipe table: the header once instead of a key per cell."""
+    columns = result.get("columns", [])
+    if not columns:
+        return [f"no rows ({result['error']})" if result.get("error") else "no rows"]
+    lines = [" | ".join(columns)]
+    for row in zip(*(result["data"][column] for column in columns)):
+        lines.append(" | ".join("" if value is None else str(value) for value in row))
+    if result.get("truncated"):
+        lines.append(f"(first {result['row_count']} rows)")
+    return lines
+
+
+def _fit_lines(lines: list, budget: int) -> tuple:
+    """Leading lines that fit in `budget` synthesizer tokens; returns (lines, tokens)."""
+    kept, spent = [], 0
+    for line in lines:
+        tokens = synthesizer_tokens(line) + 1
+        if spent + tokens > budget:
+            kept.append("...")
+            break
+        kept.append(line)
+        spent += tokens
+    return kept, spent
+
+
+def format_tool_results(question: str, tools: list, results: list, budget: int = None) -> tuple:
+    """
+    Agent context from raw tool outputs, within `budget` synthesizer tokens.
+    Structured results (patient records, SQL rows) come first, compact and exact;
+    retrieved passages are budgeted into whatever is left. Returns (text, stats).
+    """
+    budget = budget or Config.PROMPT_AGENT_CONTEXT_SYNTHESIZER_TOKENS
+    sections, passages, spent, tokens_in = [], [], 0, 0
+    for tool, result in zip(tools, results):
+        if isinstance(result, Exception):
+            sections.append(f"[{tool}] unavailable")
+            continue
+        if tool == "vector_search":
+            passages.extend(hit["payload"].get("content", "") for hit in result)
+            continue
+        if tool == "patient_api":
+            lines = _format_patients(result)
+        elif tool == "sql":
+            lines = _format_table(result)
+        else:
+            lines = [_compact(result)]
+        tokens_in += sum(synthesizer_tokens(line) + 1 for line in lines)
+        lines, tokens = _fit_lines(lines, budget - spent)
+        spent += tokens
+        sections.append(f"[{tool}]\n" + "\n".join(lines))
+
+    stats = {"passages": 0, "duplicates": 0, "tokens_in": tokens_in, "tokens_out": spent}
+    if passages:
+        trimmed, passage_stats = budget_passages(question, passages, max(0, budget - spent))
+        sections.append("[documents]\n" + "\n".join(f"- {p}" for p in trimmed))
+        stats = {
+            **passage_stats,
+            "tokens_in": tokens_in + passage_stats["tokens_in"],
+            "tokens_out": spent + passage_stats["tokens_out"]
+        }
+    return "\n\n".join(sections), stats
+
+
+def choice_messages(question: str, passages: list, budget: int = None) -> tuple:
+    """Multiple-choice synthesis messages: fixed system + few-shot prefix, then the budgeted context."""
+    trimmed, stats = budget_passages(question, passages, budget or Config.PROMPT_CONTEXT_SYNTHESIZER_TOKENS)
+    context = "\n".join(trimmed)
+    messages = [
+        {"role": "system", "content": CHOICE_SYSTEM},
+        *CHOICE_EXAMPLES,
+        {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}\nAnswer:"}
+    ]
+    stats["prefix_estimate"] = sum(count_tokens(m["content"]) for m in messages[:-1])
+    stats["prompt_estimate"] = count_tokens(messages[-1]["content"])
+    return messages, stats
+
+
+def agent_messages(question: str, tools: list, results: list, budget: int = None) -> tuple:
+    """
+    Free-text agent messages. The answer-language hint goes after the question,
+    not into the system prompt, so Thai and English requests share the cached prefix.
+    """
+    context, stats = format_tool_results(question, tools, results, budget)
+    language = "\nAnswer in Thai." if "Thai" in question or _THAI.search(question) else ""
+    messages = [
+        {"role": "system", "content": AGENT_SYSTEM},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}{language}"}
+    ]
+    stats["prefix_estimate"] = sum(count_tokens(m["content"]) for m in messages[:-1])
+    stats["prompt_estimate"] = count_tokens(messages[-1]["content"])
+    return messages, stats
+
+
+def chat_payload(messages: list, stream: bool = False, **options) -> dict:
+    """
+    /api/chat body for the synthesizer. keep_alive is the same on every call (changing it,
+    or letting the model unload, throws the prompt cache away).
+    """
+    return {
+        "model": Config.SYNTHESIZER_MODEL,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": Config.OLLAMA_KEEP_ALIVE,
+        "options": {"temperature": 0.1, **options}
+    }
+
+
+def observe_prompt_eval(response: dict, context_stats: dict = None, timings: dict = None) -> dict:
+    """
+    Books Ollama's prefill counters from a final (done) response: prompt tokens and
+    prefill time go to PROMPT_STATS, the synthesis_prefill histogram and `timings`.
+    prompt_eval_count also calibrates token_ratio() (see _calibrate).
+    """
+    prompt_tokens = response.get("prompt_eval_count")
+    prefill_ms = response.get("prompt_eval_duration", 0) / 1e6  # reported in nanoseconds
+    report = {"prompt_tokens": prompt_tokens, "prefill_ms": prefill_ms}
+    if context_stats:
+        report["context_tokens"] = context_stats["tokens_out"]
+    with _STATS_LOCK:
+        PROMPT_STATS["requests"] += 1
+        PROMPT_STATS["prompt_tokens"] += prompt_tokens or 0
+        PROMPT_STATS["prefill_ms"] += prefill_ms
+        if context_stats:
+            PROMPT_STATS["context_tokens_in"] += context_stats["tokens_in"]
+            PROMPT_STATS["context_tokens_out"] += context_stats["tokens_out"]
+            PROMPT_STATS["duplicates_dropped"] += context_stats["duplicates"]
+            if prompt_tokens and context_stats.get("prompt_estimate"):
+                _calibrate(prompt_tokens, context_stats.get("prefix_estimate", 0), context_stats["prompt_estimate"])
+    record("synthesis_prefill", prefill_ms / 1000)
+    logger.debug("Prompt evaluated", extra={"fields": report})
+    if timings is not None:
+        timings.update(report)
+    return report
+
+
+def prompt_stats() -> dict:
+    requests = PROMPT_STATS["requests"]
+    return {
+        **PROMPT_STATS,
+        "avg_prompt_tokens": PROMPT_STATS["prompt_tokens"] / requests if requests else 0.0,
+        "avg_prefill_ms": PROMPT_STATS["prefill_ms"] / requests if requests else 0.0,
+        "context_budget": Config.PROMPT_CONTEXT_SYNTHESIZER_TOKENS,
+        "agent_context_budget": Config.PROMPT_AGENT_CONTEXT_SYNTHESIZER_TOKENS,
+        "token_ratio": None if _load_tokenizer() else token_ratio(),
+        "tokenizer": Config.PROMPT_TOKENIZER if _load_tokenizer() else None,
+        "keep_alive": Config.OLLAMA_KEEP_ALIVE
+    }
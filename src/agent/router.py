@@ -1,39 +1,86 @@
-import re
-import httpx
-import json
+from collections import namedtuple
+from cachetools import TTLCache
 from src.config import Config
+from src.tools.http_client import get_http_client
+from src.tracing import traced
+from src.log import get_logger
+from src.agent.intent import get_intent_classifier
+from src.agent.answer_cache import normalize_question
 
+logger = get_logger("router")
+
+RoutingDecision = namedtuple("RoutingDecision", ["intent", "confidence", "source"])
+
+# Routing decisions by normalized query (the LLM's included: those are the expensive ones)
+ROUTING_CACHE = TTLCache(maxsize=Config.INTENT_CACHE_SIZE, ttl=Config.CACHE_TTL)
+ROUTER_STATS = {"cache": 0, "local": 0, "llm": 0, "fallback": 0}
+
+@traced("classify_intent")
 async def classify_intent(query: str):
     """
     Decides WHICH tool to use.
-    Priority 1: Regex (0ms) - for IDs or known keywords.
-    Priority 2: Tiny LLM (Typhoon 1B) - for complex questions.
+    Priority 1: Routing cache.
+    Priority 2: Local classifier (~0.1ms) - keyword automaton + char n-gram model, see intent.py.
+    Priority 3: Tiny LLM (Typhoon 1B) - only when the local confidence is below INTENT_CONFIDENCE_THRESHOLD.
     """
-    
-    # 1. Regex Heuristics (Instant)
-    if re.search(r'\b(id|รหัส|number)\s*:?\s*\d+', query, re.IGNORECASE):
-        return "api_lookup"
-    
-    if any(keyword in query for keyword in ["avg", "average", "count", "total", "กี่คน", "เฉลี่ย"]):
-        return "sql_query"
-
-    # 2. Fallback to Typhoon 1B Router (Fast) via Ollama/Local API
+    return (await route_query(query)).intent
+
+async def route_query(query: str) -> RoutingDecision:
+    """classify_intent with the confidence and the deciding stage ("cache", "local", "llm", "fallback")."""
+    key = normalize_question(query)
+    cached = ROUTING_CACHE.get(key)
+    if cached is not None:
+        ROUTER_STATS["cache"] += 1
+        return cached._replace(source="cache")
+
+    decision = await _route(query)
+    ROUTER_STATS[decision.source] += 1
+    if decision.source != "fallback": # LLM errors are retried next time
+        ROUTING_CACHE[key] = decision
+    return decision
+
+async def _route(query: str) -> RoutingDecision:
+    local = None
+    classifier = get_intent_classifier()
+    if classifier:
+        intent, confidence = classifier.predict(query)
+        local = RoutingDecision(intent, confidence, "local")
+        if confidence >= Config.INTENT_CONFIDENCE_THRESHOLD:
+            return local
+
+    intent = await _ask_llm(query)
+    if intent is not None:
+        return RoutingDecision(intent, None, "llm")
+    return RoutingDecision("hybrid", local.confidence if local else None, "fallback") # Default safe fallback
+
+async def _ask_llm(query: str):
+    """Typhoon 1B router via Ollama; None when it fails or times out."""
     try:
         payload = {
             "model": Config.ROUTER_MODEL,
             "prompt": f"Classify query: '{query}'. Options: [1] Vector Search (Knowledge) [2] SQL (Stats/Table) [3] API (Realtime) [4] Hybrid. Reply ONLY with digit.",
-            "stream": False
+            "stream": False,
+            "keep_alive": Config.OLLAMA_KEEP_ALIVE # Same as synthesis: the shared 1B model stays loaded
         }
-        
-        async with httpx.AsyncClient(timeout=1.0) as client:
-            response = await client.post(f"{Config.OLLAMA_BASE_URL}/api/generate", json=payload)
-            if response.status_code == 200:
-                result = response.json().get('response', '').strip()
-                if '1' in result: return "vector_search"
-                if '2' in result: return "sql_query"
-                if '3' in result: return "api_lookup"
-            
+
+        client = get_http_client("ollama")
+        response = await client.post("/api/generate", json=payload, timeout=Config.ROUTER_TIMEOUT)
+        if response.status_code == 200:
+            result = response.json().get('response', '').strip()
+            if '1' in result: return "vector_search"
+            if '2' in result: return "sql_query"
+            if '3' in result: return "api_lookup"
+            return "hybrid"
+
     except Exception as e:
-        print(f" [Router Error] {e}")
-    
-    return "hybrid" # Default safe fallback
+        logger.warning("Router LLM failed, falling back to hybrid", extra={"fields": {"error": str(e)}})
+    return None
+
+def router_stats() -> dict:
+    total = sum(ROUTER_STATS.values())
+    return {
+        **ROUTER_STATS,
+        "llm_rate": (ROUTER_STATS["llm"] + ROUTER_STATS["fallback"]) / total if total else 0.0,
+        "cache_size": len(ROUTING_CACHE),
+        "threshold": Config.INTENT_CONFIDENCE_THRESHOLD
+    }
@@ -0,0 +1,174 @@
+import re
+import time
+import asyncio
+import threading
+import numpy as np
+from src.config import Config
+from src.agent.answer_cache import IndexVersion, normalize_question
+
+# Process-wide singleton, see get_semantic_cache()
+SEMANTIC_CACHE = None
+
+# Start of the multiple-choice options ("ก." / "ก)")
+_CHOICES = re.compile(r"(?:^|\s)ก\s*[.)]")
+
+
+def choices_signature(question: str) -> str:
+    """
+    Normalized option list of a multiple-choice question.
+    Two questions with the same stem but different options embed almost identically,
+    so a semantic hit also requires the options to match exactly.
+    """
+    normalized = normalize_question(question)
+    match = _CHOICES.search(normalized)
+    return normalized[match.start():].strip() if match else ""
+
+
+class SemanticCache:
+    """
+    Near-duplicate question cache keyed on the query embedding.
+    Entries are unit vectors in the leading rows of a (rows x dim) matrix that grows by
+    doubling up to `capacity`, so memory follows the number of entries. A lookup is one
+    matrix-vector product over the filled rows plus argpartition (exact cosine, no ANN
+    index to maintain); alookup/astore run it off the event loop.
+    Each entry keeps the answer and the chunk IDs of the reranked context it was
+    synthesized from, so a hit can still say which passages back it.
+    Least-recently-used entries are evicted when full; entries expire after CACHE_TTL
+    and are dropped when the index version changes.
+    """
+
+    _INITIAL_ROWS = 64
+
+    def __init__(self, capacity: int, threshold: float, ttl: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index_version = IndexVersion()
+        self._seen_version = None
+        self._matrix = None  # float32 [rows, dim], allocated on first insert
+        self._size = 0  # rows in use (live or freed by expiry), always a prefix of the matrix
+        self._entries = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.float64)  # 0 = free slot
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.hit_similarity_sum = 0.0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _clear(self):
+        self._entries = [None] * self.capacity
+        self._last_used[:] = 0
+        self._size = 0
+
+    def _check_version(self):
+        version = self.index_version.current()
+        if self._seen_version is not None and version != self._seen_version:
+            self._clear()
+        self._seen_version = version
+
+    def lookup(self, question: str, vector):
+        """Returns the cached entry {question, answer, context_ids, similarity} or None. Blocking, see alookup."""
+        if vector is None:
+            return None
+        with self._lock:
+            self._check_version()
+            self.lookups += 1
+            if self._matrix is None or len(vector) != self._matrix.shape[1] or not self._size:
+                return None
+            now = time.time()
+            scores = self._matrix[:self._size] @ self._unit(vector)
+            scores[self._last_used[:self._size] == 0] = -1.0
+            signature = choices_signature(question)
+            # Best candidates first; a few are enough to skip entries with other options
+            k = min(8, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            for slot in top[np.argsort(-scores[top])]:
+                similarity = float(scores[slot])
+                if similarity < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if now - entry["created_at"] > self.ttl:
+                    self._entries[slot] = None
+                    self._last_used[slot] = 0
+                    continue
+                if entry["signature"] != signature:
+                    continue
+                self._last_used[slot] = now
+                self.hits += 1
+                self.hit_similarity_sum += similarity
+                return {**entry, "similarity": similarity}
+            return None
+
+    async def alookup(self, question: str, vector):
+        return await asyncio.to_thread(self.lookup, question, vector)
+
+    def _slot(self, dim: int) -> int:
+        """A free row: a hole left by expiry, the next unused row, or the LRU entry."""
+        if self._matrix is None or dim != self._matrix.shape[1]:
+            self._matrix = np.zeros((min(self._INITIAL_ROWS, self.capacity), dim), dtype=np.float32)
+            self._clear()
+        free = np.flatnonzero(self._last_used[:self._size] == 0)
+        if len(free):
+            return int(free[0])
+        if self._size < self.capacity:
+            if self._size == len(self._matrix):
+                grown = np.zeros((min(2 * self._size, self.capacity), dim), dtype=np.float32)
+                grown[:self._size] = self._matrix
+                self._matrix = grown
+            self._size += 1
+            return self._size - 1
+        self.evictions += 1
+        return int(np.argmin(self._last_used))
+
+    def store(self, question: str, vector, answer: str, context_ids: list = ()):
+        if vector is None:
+            return
+        with self._lock:
+            self._check_version()
+            unit = self._unit(vector)
+            slot = self._slot(len(unit))
+            now = time.time()
+            self._matrix[slot] = unit
+            self._entries[slot] = {
+                "question": question,
+                "signature": choices_signature(question),
+                "answer": answer,
+                "context_ids": list(context_ids),
+                "created_at": now
+            }
+            self._last_used[slot] = now
+
+    async def astore(self, question: str, vector, answer: str, context_ids: list = ()):
+        await asyncio.to_thread(self.store, question, vector, answer, context_ids)
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "avg_hit_similarity": self.hit_similarity_sum / self.hits if self.hits else 0.0,
+            "size": int((self._last_used > 0).sum()),
+            "rows_allocated": 0 if self._matrix is None else len(self._matrix),
+            "evictions": self.evictions,
+            "threshold": self.threshold
+        }
+
+
+def get_semantic_cache():
+    """Returns the shared cache, or None when disabled."""
+    global SEMANTIC_CACHE
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    if SEMANTIC_CACHE is None:
+        SEMANTIC_CACHE = SemanticCache(
+            capacity=Config.SEMANTIC_CACHE_SIZE,
+            threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+            ttl=Config.CACHE_TTL
+        )
+    return SEMANTIC_CACHE
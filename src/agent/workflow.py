@@ -1,134 +1,437 @@
+import json
+import time
 import asyncio
-import httpx
-from src.tools.api_wrapper import fetch_patient_live_data
-from src.tools.database import query_vector_db, query_sql_db, hybrid_search, rerank_results
+from src.tools.api_wrapper import fetch_patients_live_data, extract_patient_ids
+from src.tools.database import (
+    query_vector_db, query_sql_db, hybrid_search, rerank_results, embed_query,
+    hybrid_search_batch, rerank_results_batch
+)
+from src.tools.embeddings import embed_batch, EmbeddingError
+from src.tools.http_client import get_http_client
 from src.agent.router import classify_intent
+from src.agent.answer_cache import get_answer_cache
+from src.agent.semantic_cache import get_semantic_cache
+from src.agent.prompt import choice_messages, agent_messages, chat_payload, observe_prompt_eval
 from src.config import Config
+from src.tracing import span, record
+from src.log import get_logger, log_content
 
-async def run_fast_qa_pipeline(query: str):
+logger = get_logger("workflow")
+
+VALID_CHOICES = ["ก", "ข", "ค", "ง"]
+
+# Speculative vector search in the agent pipeline, see gather_agent_context()
+SPECULATION_STATS = {
+    "launched": 0,
+    "used": 0,
+    "discarded": 0,
+    "saved_ms": 0.0,   # speculative run time that overlapped routing (off the critical path)
+    "wasted_ms": 0.0   # run time of discarded speculative searches
+}
+
+async def run_fast_qa_pipeline(query: str, timings: dict = None):
     """
     Optimized pipeline for sub-0.5s latency multiple-choice QA.
     Bypasses router and parallel fetch. Assumes Vector Search is the only need.
+    Repeated questions are answered from the answer cache (exact, normalized text),
+    reworded ones from the semantic cache (query embedding similarity).
+    Pass `timings` (a dict) to receive per-branch retrieval latencies and, when retrieval ran
+    or the semantic cache answered, the chunk IDs of the reranked context (context_ids).
     """
+    timings = {} if timings is None else timings
+    cache = get_answer_cache()
+    if cache is not None:
+        cached = await cache.get(query)
+        if cached is not None:
+            timings["answer_cache"] = "hit"
+            return cached
+        timings["answer_cache"] = "miss"
+
+    # The embedding is needed for retrieval anyway. Hybrid search starts right away
+    # (BM25 runs during the embedding round-trip, the vector branch waits for it);
+    # the semantic cache is checked as soon as the embedding lands, and a
+    # near-duplicate cancels retrieval, reranking and synthesis.
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is None:
+        return await _answer_and_cache(query, timings, cache, None, None)
+
+    embedding = asyncio.create_task(embed_query(query))
+    retrieval = asyncio.create_task(hybrid_search(query, limit=10, timings=timings, vector=embedding))
+    try:
+        vector = await embedding
+        hit = await semantic_cache.alookup(query, vector)
+    except BaseException:
+        retrieval.cancel()
+        raise
+    if hit is not None:
+        retrieval.cancel() # A BM25 job already on a worker thread finishes there, unobserved
+        timings["semantic_cache"] = "hit"
+        timings["semantic_similarity"] = hit["similarity"]
+        timings["context_ids"] = hit["context_ids"]
+        return hit["answer"]
+    timings["semantic_cache"] = "miss"
+    return await _answer_and_cache(query, timings, cache, semantic_cache, vector, retrieval)
+
+async def _answer_and_cache(query: str, timings: dict, cache, semantic_cache, vector, retrieval=None):
+    answer = await _run_fast_qa_uncached(query, timings, retrieval)
+    # Only clean choices are cached; errors and off-format replies get retried
+    if answer in VALID_CHOICES:
+        if cache is not None:
+            await cache.set(query, answer)
+        if semantic_cache is not None:
+            await semantic_cache.astore(query, vector, answer, timings.get("context_ids", ()))
+    return answer
+
+async def _run_fast_qa_uncached(query: str, timings: dict, retrieval: asyncio.Task = None):
+    """Retrieval -> rerank -> synthesis. `retrieval` is an already started hybrid_search task."""
     try:
         # Step 1: Retrieval (FAST - Hybrid + Rerank)
-        # 1. Hybrid Search (Vector + BM25) -> Top 10
-        context_chunks = await hybrid_search(query, limit=10)
+        # 1. Hybrid Search (Vector + BM25 concurrently) -> Top 10
+        if retrieval is None:
+            retrieval = hybrid_search(query, limit=10, timings=timings)
+        context_chunks = await retrieval
         
         # 2. Reranking (Cross-Encoder) -> Top 3
         context_chunks = await rerank_results(query, context_chunks, top_k=3)
+        timings["context_ids"] = _context_ids(context_chunks)
 
         # context_chunks is a list of dicts: {'score': float, 'payload': {'content': str, ...}}
-        context_text = "\n".join([chunk.get('payload', {}).get('content', '') for chunk in context_chunks])
+        context = [chunk.get('payload', {}).get('content', '') for chunk in context_chunks]
     
-        # Debug: Print context to see what the model sees
-        print(f"\n[Debug] Question: {query}")
-        print(f"[Debug] Context Snippet: {context_text[:200]}...")
+        # Debug: what the model sees (sampled, see LOG_CONTENT_SAMPLE_RATE)
+        log_content(logger, "Fast QA context", question=query, context="\n".join(context))
 
         # Step 2: Synthesis (FAST)
-        # Using /api/chat for better instruction following with 1B model
-        # Few-shot prompting to break "C" bias
-        system_instruction = "You are a specialized medical assistant. Select the single correct option (ก, ข, ค, or ง) based strictly on the context."
-        
-        example_user = "Context: Patient has fever.\n\nQuestion: What is the symptom?\nAnswer:"
-        example_assistant = "ก"
-        
-        user_content = f"Context: {context_text}\n\nQuestion: {query}\nAnswer:"
-
-        payload = {
-            "model": Config.SYNTHESIZER_MODEL, # 1B Model
-            "messages": [
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": example_user},
-                {"role": "assistant", "content": example_assistant},
-                {"role": "user", "content": user_content}
-            ],
-            "stream": False,
-            "options": {
-                "temperature": 0.1, # Slight temp to allow breaking bias
-                "num_predict": 2 # We only need 1 letter
-            }
-        }
-        
-        # Increase timeout to avoid cold-start dropouts
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(f"{Config.OLLAMA_BASE_URL}/api/chat", json=payload)
-            if response.status_code == 200:
-                answer = response.json()['message']['content'].strip()
-                print(f"[Debug] Raw Answer: {answer}")
-                
-                # Post-processing to ensure only ก/ข/ค/ง
-                valid_answers = ["ก", "ข", "ค", "ง"]
-                for ans in valid_answers:
-                    if ans in answer:
-                        return ans
-                return answer # Fallback if it didn't listen
-            else:
-                return f"Error: Model returned {response.status_code}"
+        return await synthesize_choice(query, context, timings)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Fast QA pipeline failed")
         return f"Error: {str(e)}"
 
-async def run_agent_pipeline(query: str):
+def _context_ids(chunks: list) -> list:
+    """Point IDs of the reranked passages (stored with semantic cache entries)."""
+    return [chunk.get('payload', {}).get('id') for chunk in chunks]
+
+async def synthesize_choice(query: str, context: list, timings: dict = None):
     """
-    Main execution pipeline.
-    Strategy: Route -> Parallel Fetch -> Synthesize
+    Asks the synthesizer for the single choice letter given the reranked passages.
+    The passages are trimmed to PROMPT_CONTEXT_SYNTHESIZER_TOKENS after a fixed system + few-shot
+    prefix (see prompt.py); prompt tokens and prefill time land in `timings`.
     """
+    # Using /api/chat for better instruction following with 1B model
+    messages, context_stats = choice_messages(query, context)
+    payload = chat_payload(
+        messages,
+        temperature=0.1, # Slight temp to allow breaking bias
+        num_predict=2 # We only need 1 letter
+    )
     
+    # Generous timeout to avoid cold-start dropouts
+    client = get_http_client("ollama")
+    with span("synthesis"):
+        response = await client.post("/api/chat", json=payload, timeout=Config.SYNTHESIS_TIMEOUT)
+    if response.status_code == 200:
+        body = response.json()
+        observe_prompt_eval(body, context_stats, timings)
+        answer = body['message']['content'].strip()
+        log_content(logger, "Synthesizer raw answer", answer=answer)
+        
+        # Post-processing to ensure only ก/ข/ค/ง
+        for ans in VALID_CHOICES:
+            if ans in answer:
+                return ans
+        return answer # Fallback if it didn't listen
+    else:
+        return f"Error: Model returned {response.status_code}"
+
+async def run_batch_qa_pipeline(queries: list, timings: dict = None):
+    """
+    Batch variant of run_fast_qa_pipeline for evaluation and bulk scoring.
+    Retrieval work is shared across the batch: one embedding call, one Qdrant batch query,
+    one BM25 scoring pass, one CrossEncoder call. Synthesis runs concurrently, at most
+    BATCH_SYNTHESIS_CONCURRENCY requests at a time.
+    Async generator: yields {"index", "answer", "source", "latency_ms", "context_ids"} strictly in input order,
+    each as soon as it (and everything before it) is ready. latency_ms is measured from the
+    start of the batch. Pass `timings` (a dict) to receive the shared stage latencies.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in queries]
+    worker = asyncio.create_task(_answer_batch(queries, futures, start, timings))
+    try:
+        for i, future in enumerate(futures):
+            yield {"index": i, **(await future)}
+        await worker # Finishes filling `timings`
+    finally:
+        # Consumer went away (client disconnect): stop pending retrieval and synthesis
+        if not worker.done():
+            worker.cancel()
+
+def _resolve(future, start: float, answer: str, source: str, context_ids: list = None):
+    if not future.done():
+        future.set_result({
+            "answer": answer,
+            "source": source,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "context_ids": context_ids # None for answer cache hits and failures
+        })
+
+async def _answer_batch(queries: list, futures: list, start: float, timings: dict):
+    try:
+        # 1. Exact answer cache
+        cache = get_answer_cache()
+        pending = list(range(len(queries)))
+        if cache is not None:
+            hits = [await cache.get(queries[i]) for i in pending]
+            for i, cached in zip(pending, hits):
+                if cached is not None:
+                    _resolve(futures[i], start, cached, "answer_cache")
+            pending = [i for i, cached in zip(pending, hits) if cached is None]
+        if not pending:
+            return
+
+        # 2. All query embeddings in one call, then the semantic cache
+        stage = time.perf_counter()
+        try:
+            vectors = await embed_batch([queries[i] for i in pending], prefix="search_query: ", retries=0)
+        except EmbeddingError as e:
+            logger.warning("Batch query embedding failed", extra={"fields": {"error": str(e)}})
+            vectors = [None] * len(pending)
+        timings["embed_ms"] = (time.perf_counter() - stage) * 1000
+        vector_of = dict(zip(pending, vectors))
+
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            remaining = []
+            hits = await asyncio.gather(*(semantic_cache.alookup(queries[i], vector_of[i]) for i in pending))
+            for i, hit in zip(pending, hits):
+                if hit is not None:
+                    _resolve(futures[i], start, hit["answer"], "semantic_cache", hit["context_ids"])
+                else:
+                    remaining.append(i)
+            pending = remaining
+        if not pending:
+            return
+
+        # 3. Shared retrieval: batched hybrid search, then one rerank call for every pair
+        batch_queries = [queries[i] for i in pending]
+        chunk_lists = await hybrid_search_batch(batch_queries, [vector_of[i] for i in pending], limit=10, timings=timings)
+        stage = time.perf_counter()
+        chunk_lists = await rerank_results_batch(batch_queries, chunk_lists, top_k=3)
+        timings["rerank_ms"] = (time.perf_counter() - stage) * 1000
+
+        # 4. Concurrent synthesis, bounded so the batch cannot monopolize Ollama
+        semaphore = asyncio.Semaphore(Config.BATCH_SYNTHESIS_CONCURRENCY)
+
+        async def synthesize(i: int, chunks: list):
+            context = [chunk.get('payload', {}).get('content', '') for chunk in chunks]
+            context_ids = _context_ids(chunks)
+            async with semaphore:
+                try:
+                    answer = await synthesize_choice(queries[i], context)
+                except Exception as e:
+                    answer = f"Error: {str(e)}"
+            if answer in VALID_CHOICES:
+                if cache is not None:
+                    await cache.set(queries[i], answer)
+                if semantic_cache is not None:
+                    await semantic_cache.astore(queries[i], vector_of[i], answer, context_ids)
+            _resolve(futures[i], start, answer, "pipeline", context_ids)
+
+        stage = time.perf_counter()
+        await asyncio.gather(*(synthesize(i, chunks) for i, chunks in zip(pending, chunk_lists)))
+        timings["synthesis_ms"] = (time.perf_counter() - stage) * 1000
+    except Exception as e:
+        logger.exception("Batch QA pipeline failed")
+        for future in futures:
+            _resolve(future, start, f"Error: {str(e)}", "pipeline")
+
+async def _timed(stamps: dict, fn, *args):
+    """Awaits fn(*args), recording when it actually started and finished."""
+    stamps["start"] = time.perf_counter()
+    try:
+        return await fn(*args)
+    finally:
+        stamps["end"] = time.perf_counter()
+
+def _settle_speculation(task, stamps: dict, routed_at: float, used: bool):
+    """Books saved/wasted time once the speculative search is used (and done) or discarded."""
+    start = stamps.get("start")
+    if used:
+        SPECULATION_STATS["used"] += 1
+        if start is not None and start < routed_at:
+            SPECULATION_STATS["saved_ms"] += (min(routed_at, stamps.get("end", routed_at)) - start) * 1000
+        return
+    SPECULATION_STATS["discarded"] += 1
+    if not task.done():
+        task.cancel() # Not started yet (local routing never yields) = no work wasted
+    if start is not None:
+        SPECULATION_STATS["wasted_ms"] += (stamps.get("end", routed_at) - start) * 1000
+
+def speculation_stats() -> dict:
+    launched = SPECULATION_STATS["launched"]
+    return {
+        **SPECULATION_STATS,
+        "use_rate": SPECULATION_STATS["used"] / launched if launched else 0.0,
+        "avg_saved_ms": SPECULATION_STATS["saved_ms"] / SPECULATION_STATS["used"] if SPECULATION_STATS["used"] else 0.0,
+        "avg_wasted_ms": SPECULATION_STATS["wasted_ms"] / SPECULATION_STATS["discarded"] if SPECULATION_STATS["discarded"] else 0.0,
+        "enabled": Config.SPECULATIVE_ROUTING
+    }
+
+async def gather_agent_context(query: str):
+    """
+    Steps 1-2 of the agent pipeline: route, then run the selected tools in parallel.
+    With SPECULATIVE_ROUTING, vector search (cheap, needed by most intents) starts
+    alongside the router instead of after it, and is cancelled if the intent doesn't need it.
+    Returns (intent, tool names, tool results).
+    """
+    speculative, stamps = None, {}
+    if Config.SPECULATIVE_ROUTING:
+        speculative = asyncio.create_task(_timed(stamps, query_vector_db, query))
+        SPECULATION_STATS["launched"] += 1
+
     # Step 1: Route (Intent Classification)
-    intent = await classify_intent(query)
-    print(f" [Router] Intent: {intent}")
+    try:
+        intent = await classify_intent(query)
+    except BaseException:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    routed_at = time.perf_counter()
+    logger.debug("Intent classified", extra={"fields": {"intent": intent}})
+    needs_vector = intent in ["vector_search", "hybrid"]
+    if speculative is not None and not needs_vector:
+        _settle_speculation(speculative, stamps, routed_at, used=False)
 
     # Step 2: Parallel Execution (Asyncio Gather)
     tasks = []
+    tools = []
     
     if intent in ["api_lookup", "hybrid"]:
-        # Extract ID (simplified logic)
-        words = query.split()
-        pid = "123" # Default
-        for w in words:
-            if w.isdigit():
-                pid = w
-                break
-        tasks.append(fetch_patient_live_data(pid))
+        patient_ids = extract_patient_ids(query)
+        if patient_ids:
+            tasks.append(fetch_patients_live_data(patient_ids))
+            tools.append("patient_api")
+        else:
+            logger.debug("No patient ID in query, skipping the patient API")
         
-    if intent in ["vector_search", "hybrid"]:
-        tasks.append(query_vector_db(query))
+    if needs_vector:
+        tasks.append(speculative if speculative is not None else query_vector_db(query))
+        tools.append("vector_search")
         
     if intent in ["sql_query", "hybrid"]:
         # Logic to generate SQL would go here. For now, we run a safe example query if intent is SQL-heavy
         # In a real app, we'd use an LLM to generate the SQL
         tasks.append(query_sql_db("SELECT * FROM patients LIMIT 5")) 
+        tools.append("sql")
 
     # Wait for all tools to finish
     results = await asyncio.gather(*tasks, return_exceptions=True)
+    if speculative is not None and needs_vector:
+        _settle_speculation(speculative, stamps, routed_at, used=True)
+    return intent, tools, results
+
+def build_agent_payload(query: str, tools: list, results: list, stream: bool = False):
+    """
+    Step 3 request body: tool results formatted compactly within PROMPT_AGENT_CONTEXT_SYNTHESIZER_TOKENS.
+    Returns (payload, context stats for observe_prompt_eval).
+    """
+    messages, context_stats = agent_messages(query, tools, results)
+    return chat_payload(messages, stream=stream), context_stats
+
+def describe_tool_results(tools: list, results: list):
+    """Small, JSON-safe summary of what retrieval produced (sent before the answer streams)."""
+    summary = []
+    for tool, result in zip(tools, results):
+        if isinstance(result, Exception):
+            summary.append({"tool": tool, "error": str(result)})
+        elif tool == "patient_api":
+            summary.append({
+                "tool": tool,
+                "patients": {pid: "error" not in data for pid, data in result.items()}
+            })
+        elif tool == "sql":
+            summary.append({"tool": tool, "rows": result["row_count"], "truncated": result["truncated"]})
+        elif tool == "vector_search":
+            summary.append({
+                "tool": tool,
+                "hits": [{"source": r["payload"].get("source"), "score": r["score"]} for r in result]
+            })
+        elif isinstance(result, list):
+            summary.append({"tool": tool, "rows": len(result)})
+        else:
+            summary.append({"tool": tool, "ok": not (isinstance(result, dict) and "error" in result)})
+    return summary
+
+async def run_agent_pipeline(query: str):
+    """
+    Main execution pipeline.
+    Strategy: Route -> Parallel Fetch -> Synthesize
+    """
+    intent, tools, results = await gather_agent_context(query)
     
     # Step 3: Final Synthesis
-    # Pack all results into context
-    final_context = f"Retrieved Data: {str(results)}"
-    
-    system_prompt = "You are a helpful Thai-English medical assistant. Answer based ONLY on context."
-    if "Thai" in query or any(char in query for char in "กขฃคฅฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ"):
-        system_prompt += " Answer in Thai."
-    
     try:
-        payload = {
-            "model": Config.SYNTHESIZER_MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Context: {final_context}\n\nQuestion: {query}"}
-            ],
-            "stream": False,
-            "options": {"temperature": 0.1}
-        }
+        payload, context_stats = build_agent_payload(query, tools, results)
         
-        async with httpx.AsyncClient(timeout=10.0) as client: # Longer timeout for generation
-            response = await client.post(f"{Config.OLLAMA_BASE_URL}/api/chat", json=payload)
-            if response.status_code == 200:
-                return response.json()['message']['content']
-            else:
-                return f"Error from model: {response.text}"
+        client = get_http_client("ollama")
+        with span("synthesis"):
+            response = await client.post("/api/chat", json=payload, timeout=Config.SYNTHESIS_TIMEOUT) # Longer timeout for generation
+        if response.status_code == 200:
+            body = response.json()
+            observe_prompt_eval(body, context_stats)
+            return body['message']['content']
+        else:
+            return f"Error from model: {response.text}"
                 
     except Exception as e:
         return f"Error generating response: {str(e)}"
+
+async def stream_agent_pipeline(query: str):
+    """
+    Streaming variant of run_agent_pipeline.
+    Yields (event, data) tuples: one "meta" (intent + retrieval summary), many "token",
+    then "done" with server-side time-to-first-token and total latency (or "error").
+    If the consumer stops iterating (client disconnect), the upstream stream is closed,
+    which makes Ollama abort the generation.
+    """
+    start = time.perf_counter()
+    intent, tools, results = await gather_agent_context(query)
+    retrieval_ms = (time.perf_counter() - start) * 1000
+    yield "meta", {"intent": intent, "tools": describe_tool_results(tools, results), "retrieval_ms": retrieval_ms}
+
+    ttft_ms = None
+    prompt_eval = {}
+    synthesis_start = time.perf_counter()
+    try:
+        payload, context_stats = build_agent_payload(query, tools, results, stream=True)
+        client = get_http_client("ollama")
+        # The timeout applies between chunks, not to the whole generation
+        async with client.stream("POST", "/api/chat", json=payload, timeout=Config.SYNTHESIS_TIMEOUT) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                yield "error", {"message": f"Error from model: {body.decode(errors='replace')}"}
+                return
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                text = chunk.get("message", {}).get("content", "")
+                if text:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - start) * 1000
+                        record("synthesis_ttft", time.perf_counter() - synthesis_start)
+                    yield "token", {"text": text}
+                if chunk.get("done"):
+                    prompt_eval = observe_prompt_eval(chunk, context_stats) # Counters come with the last chunk
+                    break
+    except Exception as e:
+        record("synthesis_stream", time.perf_counter() - synthesis_start, error=True)
+        yield "error", {"message": f"Error generating response: {str(e)}"}
+        return
+
+    # Spans can't wrap a generator across yields, the stream is recorded by hand
+    record("synthesis_stream", time.perf_counter() - synthesis_start)
+    total_ms = (time.perf_counter() - start) * 1000
+    logger.info("Stream finished", extra={"fields": {"ttft_ms": ttft_ms, "total_ms": total_ms, **prompt_eval}})
+    yield "done", {"ttft_ms": ttft_ms, "total_ms": total_ms, "retrieval_ms": retrieval_ms, **prompt_eval}
@@ -17,12 +17,158 @@ class Config:
     # Database Paths
     VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "./data/vector_store")
     SQL_DB_PATH = os.getenv("SQL_DB_PATH", "./data/processed/medical_data.duckdb")
+    # Opened read-only once per process, one cursor per SQL worker thread (see src/tools/sql_store.py)
+    SQL_WORKERS = int(os.getenv("SQL_WORKERS", 4))
+    SQL_STATEMENT_CACHE_SIZE = int(os.getenv("SQL_STATEMENT_CACHE_SIZE", 64))  # parsed statements per thread
+    SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", 200))  # rows returned per query, the rest is cut off
+    # Written by the ingestion pipeline: per-PDF mtime/size + chunk IDs, and the index version
+    INDEX_MANIFEST_PATH = os.getenv("INDEX_MANIFEST_PATH", "./data/index_manifest.json")
+    # BM25 side of hybrid search (CSR postings, memory-mapped at load, see src/tools/bm25.py)
+    BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index")
+
+    # Hybrid Retrieval (vector and BM25 branches run concurrently)
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 4))  # threads for tokenization + BM25 scoring
+    VECTOR_BRANCH_TIMEOUT = float(os.getenv("VECTOR_BRANCH_TIMEOUT", 2.0))
+    BM25_BRANCH_TIMEOUT = float(os.getenv("BM25_BRANCH_TIMEOUT", 1.0))
+
+    # Reranking (CrossEncoder service with cross-request micro-batching)
+    RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-TinyBERT-L-2-v2")
+    RERANK_MAX_BATCH_PAIRS = int(os.getenv("RERANK_MAX_BATCH_PAIRS", 128))
+    RERANK_MAX_WAIT_MS = float(os.getenv("RERANK_MAX_WAIT_MS", 5.0))  # how long the first request waits for company
+    # Serve vector search from an in-RAM copy of the collection (releases the file lock after load)
+    VECTOR_DB_IN_MEMORY = os.getenv("VECTOR_DB_IN_MEMORY", "false").lower() == "true"
+    # Qdrant server (e.g. http://localhost:6333); empty = embedded store at VECTOR_DB_PATH.
+    # Embedded mode is a brute-force scan: HNSW and quantization below only apply to a server.
+    QDRANT_URL = os.getenv("QDRANT_URL", "")
+    QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
+
+    # Vector compression (see src/tools/quantization.py, tests/quantization_benchmark.py)
+    VECTOR_DIM = int(os.getenv("VECTOR_DIM", 0))  # Matryoshka truncation (e.g. 512), 0 = full model dimension
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # none, scalar (int8, 4x smaller), binary (32x)
+    QUANTIZATION_RESCORE = os.getenv("QUANTIZATION_RESCORE", "true").lower() == "true"  # re-rank with originals
+    QUANTIZATION_OVERSAMPLING = float(os.getenv("QUANTIZATION_OVERSAMPLING", 2.0))  # candidates = limit x this
+    QUANTIZATION_ALWAYS_RAM = os.getenv("QUANTIZATION_ALWAYS_RAM", "true").lower() == "true"
+    VECTORS_ON_DISK = os.getenv("VECTORS_ON_DISK", "true").lower() == "true"  # originals, when quantized
+    HNSW_M = int(os.getenv("HNSW_M", 16))
+    HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", 100))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 128))
+
+    # Vector search backend: "qdrant", or "numpy" = in-process exact search over a memory-mapped
+    # matrix exported by the ingestion (see src/tools/numpy_store.py, tests/vector_backend_benchmark.py)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+    NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", "./data/vector_index")
+    # float32 scores with a single sgemv; float16 halves RAM and disk but widens every row per
+    # query (BLAS has no float16 kernels), so single queries get slower: only for big corpora
+    NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")
+    NUMPY_IVF_LISTS = int(os.getenv("NUMPY_IVF_LISTS", 0))  # k-means partitions, 0 = exact scan over every row
+    NUMPY_IVF_NPROBE = int(os.getenv("NUMPY_IVF_NPROBE", 8))  # partitions scanned per query
     
     # Caching
     CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))  # 1 hour
+    # Answer cache in front of run_fast_qa_pipeline (TTL = CACHE_TTL)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 10000))
+    ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")  # e.g. ./data/processed/answer_cache.sqlite, empty = memory only
+    # Semantic cache: reuse answers of reworded questions (cosine on the query embedding)
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 1024))  # rows are allocated as entries arrive
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
     
     # API Settings
     OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     # BAD_API_ENDPOINT should be a real endpoint if available, or handled gracefully
     BAD_API_ENDPOINT = os.getenv("BAD_API_ENDPOINT", "http://localhost:8080/api/v1") 
     TYPHOON_API_KEY = os.getenv("TYPHOON_API_KEY", "EMPTY")
+
+    # HTTP Connection Pools (one keep-alive pool per upstream, see src/tools/http_client.py)
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 2.0))
+    HTTP_DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", 10.0))
+    # Ollama speaks plain HTTP/1.1; HTTP/2 is negotiated over TLS when the patient API offers it
+    OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "false").lower() == "true"
+    PATIENT_API_HTTP2 = os.getenv("PATIENT_API_HTTP2", "true").lower() == "true"
+
+    # Per-call timeouts (seconds)
+    ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", 1.0))
+    EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", 10.0))
+    SYNTHESIS_TIMEOUT = float(os.getenv("SYNTHESIS_TIMEOUT", 10.0))
+    PATIENT_API_TIMEOUT = float(os.getenv("PATIENT_API_TIMEOUT", 2.0))
+
+    # Patient API client (coalesced, batched, stale-while-revalidate; see src/tools/api_wrapper.py)
+    PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", 1000))
+    PATIENT_CACHE_TTL = int(os.getenv("PATIENT_CACHE_TTL", 300))  # fresh for 5 minutes
+    PATIENT_STALE_TTL = int(os.getenv("PATIENT_STALE_TTL", 3600))  # then served stale while refreshing
+    PATIENT_API_BATCH = os.getenv("PATIENT_API_BATCH", "auto").lower()  # auto (probe), true, false
+    PATIENT_API_BATCH_PATH = os.getenv("PATIENT_API_BATCH_PATH", "/patients/batch")  # POST {"ids": [...]}
+    PATIENT_API_MAX_CONCURRENCY = int(os.getenv("PATIENT_API_MAX_CONCURRENCY", 8))  # upstream calls in flight
+
+    # Patient API resilience (see src/tools/resilience.py); PATIENT_API_TIMEOUT is the timeout ceiling
+    PATIENT_API_TIMEOUT_MIN = float(os.getenv("PATIENT_API_TIMEOUT_MIN", 0.1))
+    PATIENT_API_TIMEOUT_PERCENTILE = float(os.getenv("PATIENT_API_TIMEOUT_PERCENTILE", 0.99))
+    PATIENT_API_TIMEOUT_MULTIPLIER = float(os.getenv("PATIENT_API_TIMEOUT_MULTIPLIER", 2.0))  # timeout = 2 x p99
+    PATIENT_API_HEDGE = os.getenv("PATIENT_API_HEDGE", "true").lower() == "true"  # duplicate slow GETs
+    PATIENT_API_HEDGE_PERCENTILE = float(os.getenv("PATIENT_API_HEDGE_PERCENTILE", 0.95))  # ... after p95
+    PATIENT_BREAKER_FAILURE_RATE = float(os.getenv("PATIENT_BREAKER_FAILURE_RATE", 0.5))
+    PATIENT_BREAKER_MIN_CALLS = int(os.getenv("PATIENT_BREAKER_MIN_CALLS", 5))
+    PATIENT_BREAKER_WINDOW = int(os.getenv("PATIENT_BREAKER_WINDOW", 20))  # last N calls
+    PATIENT_BREAKER_COOLDOWN = float(os.getenv("PATIENT_BREAKER_COOLDOWN", 10.0))  # seconds open before a probe
+
+    # Intent routing: local classifier first, LLM router only below the confidence threshold
+    INTENT_TRAINING_PATH = os.getenv("INTENT_TRAINING_PATH", "./data/intent/labeled_queries.csv")  # text,intent
+    INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", 0.7))
+    INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", 10000))
+    # Start vector search while the router decides; discarded if the intent doesn't need it
+    SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "true").lower() == "true"
+
+    # Prompt assembly (see src/agent/prompt.py): budgeted context after a fixed, cacheable prefix
+    # Budgets are in SYNTHESIZER_MODEL tokens (what prompt_eval_count reports)
+    PROMPT_CONTEXT_SYNTHESIZER_TOKENS = int(os.getenv("PROMPT_CONTEXT_SYNTHESIZER_TOKENS", 384))  # multiple-choice passages
+    PROMPT_AGENT_CONTEXT_SYNTHESIZER_TOKENS = int(os.getenv("PROMPT_AGENT_CONTEXT_SYNTHESIZER_TOKENS", 1024))  # all agent tool output
+    # HF tokenizer for exact counts (e.g. scb10x/llama3.2-typhoon2-1b-instruct, needs `tokenizers`);
+    # empty = the chunker's estimate scaled by a ratio learned from prompt_eval_count
+    PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "")
+    PROMPT_TOKEN_RATIO = float(os.getenv("PROMPT_TOKEN_RATIO", 1.0))  # synthesizer tokens per estimated token, until calibrated
+    PROMPT_CALIBRATION_SAMPLES = int(os.getenv("PROMPT_CALIBRATION_SAMPLES", 8))  # responses before the learned ratio is used
+    PROMPT_CALIBRATION_WINDOW = int(os.getenv("PROMPT_CALIBRATION_WINDOW", 64))  # recent responses the ratio is the median of
+    PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", 0.8))  # trigram containment
+    # Sent unchanged with every Ollama call: keeps the model (and its prompt cache) loaded
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+    # Batch QA (/api/ask/batch): shared retrieval, bounded concurrent synthesis
+    BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 256))
+    BATCH_SYNTHESIS_CONCURRENCY = int(os.getenv("BATCH_SYNTHESIS_CONCURRENCY", 4))
+
+    # Tracing: per-stage latency histograms on /metrics (see src/tracing.py)
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_RESPONSES = os.getenv("TRACE_RESPONSES", "false").lower() == "true"  # attach spans to every /api/ask response
+
+    # Logging: JSON lines written by a background thread (see src/log.py)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped
+    # Questions, passages and raw answers are logged (at DEBUG) for this fraction of requests only
+    LOG_CONTENT_SAMPLE_RATE = float(os.getenv("LOG_CONTENT_SAMPLE_RATE", 0.01))
+    LOG_CONTENT_MAX_CHARS = int(os.getenv("LOG_CONTENT_MAX_CHARS", 200))
+
+    # Embeddings & Offline Ingestion
+    EMBEDDING_RETRIES = int(os.getenv("EMBEDDING_RETRIES", 3))
+    EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", 0.5))
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 32))  # chunks per /api/embed call
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 4))  # embedding batches in flight
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))  # embedded batches waiting for upsert
+    INGEST_EMBEDDING_TIMEOUT = float(os.getenv("INGEST_EMBEDDING_TIMEOUT", 300.0))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))  # processes extracting + chunking PDFs
+    # Chunking (see src/pipelines/chunking.py): sizes in embedding-model tokens, cuts on sentence/word boundaries
+    # Thai is ~0.7 estimated tokens per character (one per consonant), so 768 keeps Thai chunks at
+    # about the old 1000-character windows (~1,050 chars); 512 made a third more chunks than they did
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 768))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 96))  # whole trailing sentences carried over
+    # HF tokenizer for exact counts (e.g. nomic-ai/nomic-embed-text-v1.5, needs `tokenizers`); empty = estimate
+    CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "")
+    # Embedding cache: in-memory LRU in front of a float16 memory-mapped ring on disk
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./data/embedding_cache")
+    EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", 50000))  # rows on disk
+    EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 2048))
@@ -0,0 +1,197 @@
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from src.config import Config
+
+# Correlation ID of the request being served ("-" outside requests: startup, scripts)
+REQUEST_ID = contextvars.ContextVar("request_id", default="-")
+# Whether this request's debug content (questions, passages, raw answers) is logged
+_SAMPLED = contextvars.ContextVar("log_sampled", default=None)
+
+ROOT_LOGGER = "healthcare_ai"
+_LISTENER = None
+_OUTPUT = None  # stdout handler; attached directly once the listener is stopped
+_SETUP_LOCK = threading.Lock()
+_TRACEBACK = logging.Formatter()
+
+
+def _request_id(record: logging.LogRecord) -> str:
+    """Captured by the queue handler; read here when the record was written directly."""
+    return getattr(record, "request_id", None) or REQUEST_ID.get()
+
+
+def _exc_text(record: logging.LogRecord) -> str:
+    if record.exc_info and not record.exc_text:
+        record.exc_text = _TRACEBACK.formatException(record.exc_info)
+    return record.exc_text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, msg + structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": _request_id(record),
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if _exc_text(record):
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable variant for local development (LOG_FORMAT=text)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} [{_request_id(record)}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if _exc_text(record):
+            line += "\n" + record.exc_text
+        return line
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Enqueues records for the listener thread, so the event loop never waits on stdout.
+    The correlation ID is captured here, in the caller's context, before the hand-off.
+    The queue is bounded: under a log storm records are dropped instead of growing memory.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        record.request_id = REQUEST_ID.get()
+        # Render message and traceback now; args may not be safe to format on another thread later
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACK.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _ContextQueueHandler.dropped += 1
+
+
+def setup_logging():
+    """
+    Attaches the queue handler + listener thread to the app's logger tree (idempotent).
+    Called by the FastAPI lifespan and by script entry points, never on import: until
+    then the app's records propagate to whatever logging the host process configured.
+    """
+    global _LISTENER, _OUTPUT
+    with _SETUP_LOCK:
+        if _LISTENER is not None:
+            return
+        _OUTPUT = logging.StreamHandler(sys.stdout)
+        _OUTPUT.setFormatter(TextFormatter() if Config.LOG_FORMAT == "text" else JsonFormatter())
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(Config.LOG_LEVEL)
+        root.handlers = [_ContextQueueHandler(log_queue)]
+        root.propagate = False
+
+        _LISTENER = QueueListener(log_queue, _OUTPUT)
+        _LISTENER.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Flushes queued records and stops the listener thread. Records logged afterwards
+    (later shutdown steps, atexit hooks) are written synchronously instead of queued.
+    """
+    global _LISTENER
+    with _SETUP_LOCK:
+        if _LISTENER is not None:
+            logging.getLogger(ROOT_LOGGER).handlers = [_OUTPUT]  # Swap first: nothing lands in a dead queue
+            _LISTENER.stop()
+            _LISTENER = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the app's tree; output is configured separately by setup_logging()."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def content_sampled() -> bool:
+    """
+    True if debug content should be logged for the current request.
+    Decided once per request (so a sampled request logs all its lines), at LOG_CONTENT_SAMPLE_RATE.
+    """
+    sampled = _SAMPLED.get()
+    if sampled is None:  # Outside a request (scripts): sample per record
+        return random.random() < Config.LOG_CONTENT_SAMPLE_RATE
+    return sampled
+
+
+def log_content(logger: logging.Logger, msg: str, **fields):
+    """
+    DEBUG record carrying request content (questions, passages, answers).
+    Skipped without formatting unless DEBUG is enabled and the request is sampled;
+    text fields are truncated to LOG_CONTENT_MAX_CHARS.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) or not content_sampled():
+        return
+    limit = Config.LOG_CONTENT_MAX_CHARS
+    fields = {k: (v[:limit] if isinstance(v, str) else v) for k, v in fields.items()}
+    logger.debug(msg, extra={"fields": fields})
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware: takes X-Request-ID from the client (or generates one), binds it to
+    REQUEST_ID for everything the request runs (tasks and executor jobs inherit it),
+    and echoes it in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or new_request_id()
+        id_token = REQUEST_ID.set(request_id)
+        sampled_token = _SAMPLED.set(random.random() < Config.LOG_CONTENT_SAMPLE_RATE)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _SAMPLED.reset(sampled_token)
+            REQUEST_ID.reset(id_token)
@@ -0,0 +1,172 @@
+import re
+import os
+import uuid
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.config import Config
+
+# Bump when chunk boundaries change: the ingestion manifest forces a re-read of every PDF
+CHUNKER_VERSION = 3
+
+# Chunks may only end where a segment ends: after Latin sentence punctuation, at a line
+# break, or at the space Thai writes between sentences/clauses
+_SEGMENT = re.compile(r".+?(?:[.!?](?=\s)|\n|(?<=[\u0E00-\u0E7F]) (?=[\u0E00-\u0E7F])|$)\s*", re.DOTALL)
+
+# Token estimate for a WordPiece vocabulary like nomic-embed-text's (bert-base-uncased):
+# accents are stripped, so Thai vowel/tone marks vanish and each remaining Thai letter is one piece
+_THAI_LETTER = re.compile(r"[\u0E01-\u0E30\u0E32\u0E33\u0E40-\u0E46\u0E4F-\u0E5B]")
+_LATIN_WORD = re.compile(r"[A-Za-z]+")
+_DIGITS = re.compile(r"\d+")
+_SYMBOL = re.compile(r"[^\sA-Za-z\d\u0E00-\u0E7F]")
+
+_TOKENIZER = None  # per process: HF tokenizer, or False for the estimate
+
+
+def chunk_point_id(source: str, content: str) -> str:
+    """
+    Stable point ID derived from the chunk content (Qdrant accepts UUID strings).
+    Unlike hash(), it survives interpreter restarts, so unchanged chunks keep their IDs.
+    """
+    digest = hashlib.sha256(f"{source}\x00{content}".encode("utf-8")).hexdigest()
+    return str(uuid.UUID(digest[:32]))
+
+
+def _load_tokenizer():
+    """The embedding model's own tokenizer when `tokenizers` and the files are available."""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        _TOKENIZER = False
+        if Config.CHUNK_TOKENIZER:
+            try:
+                from tokenizers import Tokenizer
+                _TOKENIZER = Tokenizer.from_pretrained(Config.CHUNK_TOKENIZER)
+            except Exception as e:  # ImportError, or no network/cache for the files
+                print(f" [Warning] Tokenizer {Config.CHUNK_TOKENIZER} unavailable ({e}), estimating tokens.")
+    return _TOKENIZER
+
+
+def count_tokens(text: str) -> int:
+    """Embedding-model tokens in `text` (exact with CHUNK_TOKENIZER, else a close estimate)."""
+    tokenizer = _load_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return (
+        len(_THAI_LETTER.findall(text))
+        + sum(1 + len(word) // 6 for word in _LATIN_WORD.findall(text))
+        + sum(1 + len(number) // 3 for number in _DIGITS.findall(text))
+        + len(_SYMBOL.findall(text))
+    )
+
+
+def iter_pdf_pages(pdf_file: str):
+    """(page number, text) one page at a time: the document is never held as one string."""
+    import fitz
+    with fitz.open(pdf_file) as doc:
+        for page in doc:
+            yield page.number + 1, page.get_text()
+
+
+def _split_long(text: str, max_tokens: int):
+    """A segment over budget (e.g. a Thai run without spaces), cut at PyThaiNLP word boundaries."""
+    from pythainlp.tokenize import word_tokenize
+    piece, piece_tokens = [], 0
+    for word in word_tokenize(text, engine="newmm", keep_whitespace=True):
+        tokens = count_tokens(word)
+        if piece and piece_tokens + tokens > max_tokens:
+            yield "".join(piece), piece_tokens
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += tokens
+    if piece:
+        yield "".join(piece), piece_tokens
+
+
+def iter_segments(pages, max_tokens: int):
+    """(page, offset, text, tokens) sentence-level units, none above max_tokens."""
+    for page, text in pages:
+        for match in _SEGMENT.finditer(text):
+            segment = match.group()
+            if not segment.strip():
+                continue
+            tokens = count_tokens(segment)
+            if tokens <= max_tokens:
+                yield page, match.start(), segment, tokens
+                continue
+            offset = match.start()
+            for piece, piece_tokens in _split_long(segment, max_tokens):
+                yield page, offset, piece, piece_tokens
+                offset += len(piece)
+
+
+def chunk_segments(segments, max_tokens: int, overlap_tokens: int):
+    """
+    Packs consecutive segments into chunks of at most max_tokens. The next chunk starts
+    with the trailing segments of the previous one, up to overlap_tokens, so the overlap
+    is whole sentences instead of a cut-off character window.
+    """
+    window, window_tokens = [], 0
+    for segment in segments:
+        tokens = segment[3]
+        if window and window_tokens + tokens > max_tokens:
+            yield window, window_tokens
+            carried, carried_tokens = [], 0
+            for previous in reversed(window):
+                if carried_tokens + previous[3] > overlap_tokens or \
+                   carried_tokens + previous[3] + tokens > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[3]
+            window, window_tokens = carried, carried_tokens
+        window.append(segment)
+        window_tokens += tokens
+    if window:
+        yield window, window_tokens
+
+
+def chunk_pages(pages, max_tokens: int = None, overlap_tokens: int = None):
+    """Chunk dicts ({content, page, page_end, offset, tokens}) from (page, text) pairs."""
+    max_tokens = max_tokens or Config.CHUNK_MAX_TOKENS
+    overlap_tokens = Config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    for window, tokens in chunk_segments(iter_segments(pages, max_tokens), max_tokens, overlap_tokens):
+        content = "".join(segment[2] for segment in window).strip()
+        if content:
+            yield {
+                "content": content,
+                "page": window[0][0],
+                "page_end": window[-1][0],
+                "offset": window[0][1],  # character offset of the chunk start within `page`
+                "tokens": tokens
+            }
+
+
+def extract_pdf_chunks(pdf_file: str):
+    """Reads one PDF page by page and splits it into chunks with content-hash IDs."""
+    source = os.path.basename(pdf_file)
+    documents = []
+    seen = set()
+    for i, chunk in enumerate(chunk_pages(iter_pdf_pages(pdf_file))):
+        point_id = chunk_point_id(source, chunk["content"])
+        if point_id in seen:
+            continue # Repeated boilerplate (headers/footers) would collide on the same ID
+        seen.add(point_id)
+        documents.append({**chunk, "source": source, "chunk": i, "id": point_id})
+    return documents
+
+
+def extract_pdfs(pdf_files: list, workers: int = None):
+    """
+    {pdf path: chunks}, PDFs extracted and chunked in parallel worker processes
+    (PyMuPDF parsing and PyThaiNLP segmentation are CPU-bound and hold the GIL).
+    """
+    workers = min(workers or Config.INGEST_WORKERS, len(pdf_files))
+    if workers <= 1:
+        return {pdf_file: extract_pdf_chunks(pdf_file) for pdf_file in pdf_files}
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract_pdf_chunks, pdf_file): pdf_file for pdf_file in pdf_files}
+        for future in as_completed(futures):
+            pdf_file = futures[future]
+            results[pdf_file] = future.result()
+            print(f"   - Read {pdf_file} ({len(results[pdf_file])} chunks)")
+    return {pdf_file: results[pdf_file] for pdf_file in pdf_files}
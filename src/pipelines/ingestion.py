@@ -1,38 +1,112 @@
 import os
 import glob
-import httpx
+import json
+import uuid
+import asyncio
+import shutil
+import argparse
 from src.config import Config
+from src.log import setup_logging
+from src.tools.embeddings import embed_batch, EmbeddingError
+from src.tools.http_client import close_http_clients
+from src.tools.embedding_cache import close_embedding_cache
+from src.tools.bm25 import BM25Index, tokenize
+from src.pipelines.chunking import CHUNKER_VERSION, extract_pdfs
+from src.tools.quantization import TRUNCATION, vector_dim, truncate_vectors, vectors_config, quantization_config, hnsw_config
+from src.tools.vector_store import connect_qdrant
+from src.tools.numpy_store import NumpyVectorIndex, NumpyVectorStore
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 
 import time
 
-# Use Ollama for embeddings to avoid heavy local dependencies
-def get_embedding(text: str):
+COLLECTION_NAME = "medical_docs"
+
+def load_manifest():
+    """Per-source mtime/size and chunk IDs from the last indexing run."""
     try:
-        url = f"{Config.OLLAMA_BASE_URL}/api/embeddings"
-        payload = {
-            "model": Config.EMBEDDING_MODEL,
-            # Note: Instruct models might need a specific prompt or might not support /api/embeddings well if not optimized
-            # But normally Ollama handles it.
-            # If 8b fails, we can try 1b or hardcode a model name if known.
-            # Using 1b might be faster.
-            "prompt": text
-        }
-        # Verify if model supports embeddings. If not, we might need to use a specific embedding model if user has one.
-        # Given the list: scb10x/llama3.1-typhoon2-8b-instruct
-        # We will try it.
-        start_ts = time.time()
-        # print(f"DEBUG: Requesting embedding for text len {len(text)}...")
-        with httpx.Client(timeout=300.0) as client:
-            response = client.post(url, json=payload)
-            response.raise_for_status()
-            vector = response.json().get("embedding")
-            # print(f"DEBUG: Success in {time.time() - start_ts:.2f}s")
-            return vector
-    except Exception as e:
-        print(f" [Embedding Error] {e} (Duration: {time.time() - start_ts:.2f}s if applicable)")
-        return [0.0] * 384 # Fallback dummy if failed, to allow pipeline to continue (though results will be bad)
+        with open(Config.INDEX_MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"version": None, "dim": None, "chunker": None, "sources": {}}
+
+def save_manifest(manifest: dict):
+    tmp_path = f"{Config.INDEX_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, Config.INDEX_MANIFEST_PATH) # Atomic swap, readers never see a half-written file
+
+async def embed_and_upsert(qdrant_client: QdrantClient, documents: list, collection_name: str = "medical_docs"):
+    """
+    Producer/consumer indexing.
+    Producers embed batches of chunks (bounded concurrency against Ollama),
+    a single consumer upserts finished batches while the next ones are still embedding.
+    """
+    batch_size = Config.INGEST_BATCH_SIZE
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    queue = asyncio.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+    semaphore = asyncio.Semaphore(Config.INGEST_CONCURRENCY)
+    stats = {"embedded": 0, "upserted": 0, "failed": 0, "failed_ids": []}
+    start_ts = time.time()
+
+    async def produce(batch):
+        async with semaphore:
+            try:
+                vectors = await embed_batch(
+                    [doc['content'] for doc in batch],
+                    timeout=Config.INGEST_EMBEDDING_TIMEOUT
+                )
+            except EmbeddingError as e:
+                # Skip the batch rather than index garbage; a re-run picks it up again
+                print(f" [Embedding Error] {e} ({len(batch)} chunks skipped)")
+                stats["failed"] += len(batch)
+                stats["failed_ids"].extend(doc['id'] for doc in batch)
+                return
+        stats["embedded"] += len(batch)
+        vectors = truncate_vectors(vectors).tolist() # Matryoshka VECTOR_DIM, a no-op by default
+        await queue.put([
+            models.PointStruct(id=doc['id'], vector=vector, payload=doc)
+            for doc, vector in zip(batch, vectors)
+        ])
+
+    async def consume():
+        while True:
+            points = await queue.get()
+            if points is None:
+                break
+            # Local Qdrant is synchronous, keep it off the loop so producers keep going
+            await asyncio.to_thread(qdrant_client.upsert, collection_name=collection_name, points=points)
+            stats["upserted"] += len(points)
+            elapsed = time.time() - start_ts
+            print(f"   - Indexed {stats['upserted']}/{len(documents)} chunks ({stats['upserted'] / elapsed:.1f} chunks/sec)")
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.gather(*(produce(batch) for batch in batches))
+    await queue.put(None)
+    await consumer
+
+    elapsed = time.time() - start_ts
+    stats["seconds"] = elapsed
+    stats["chunks_per_sec"] = stats["upserted"] / elapsed if elapsed > 0 else 0.0
+    print(f" [Offline] Embedded {stats['upserted']} chunks in {elapsed:.1f}s "
+          f"({stats['chunks_per_sec']:.1f} chunks/sec, {stats['failed']} failed)")
+    return stats
+
+async def detect_embedding_dim():
+    try:
+        return len((await embed_batch(["test"]))[0])
+    except EmbeddingError as e:
+        print(f" [Embedding Error] {e}")
+        return None
+    finally:
+        await close_http_clients()
+
+async def run_indexing(qdrant_client: QdrantClient, documents: list):
+    try:
+        return await embed_and_upsert(qdrant_client, documents)
+    finally:
+        await close_http_clients()
+        close_embedding_cache()
 
 def process_images_offline():
     """
@@ -47,137 +121,258 @@ def process_images_offline():
         print(f"   - Processing {os.path.basename(img_path)}")
         # Real logic would go here
 
-def chunk_mixed_documents():
+def ensure_collection(qdrant_client: QdrantClient, dim: int, recreate: bool = False) -> bool:
+    """
+    Creates the collection if needed. Returns True when it starts out empty.
+    Quantization and HNSW settings are (re)applied to an existing collection as well:
+    changing VECTOR_QUANTIZATION only rebuilds the compressed copy, nothing is re-embedded.
+    """
+    exists = qdrant_client.collection_exists(COLLECTION_NAME)
+    if exists and recreate:
+        qdrant_client.delete_collection(COLLECTION_NAME)
+        exists = False
+    if not exists:
+        qdrant_client.create_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config=vectors_config(dim),
+            hnsw_config=hnsw_config(),
+            quantization_config=quantization_config()
+        )
+    elif Config.QDRANT_URL:
+        qdrant_client.update_collection(
+            collection_name=COLLECTION_NAME,
+            hnsw_config=hnsw_config(),
+            quantization_config=quantization_config() or models.Disabled.DISABLED
+        )
+    return not exists
+
+def chunk_mixed_documents(full_rebuild: bool = False):
     """
-    Handles PDF text splitting and vector indexing.
+    Incremental PDF indexing.
+    Only new or modified PDFs (by mtime/size) are re-read; within them only chunks whose
+    content hash is new get embedded. Points of removed chunks/files are deleted.
     """
     print(" [Offline] Chunking Documents...")
     
-    # Ensure collection exists
-    # LLama embeddings are typically 4096 dim for 8B?
-    # We need to know the dimension.
-    # Let's do a test call to get dim or assume 4096. 
-    # For safety, we'll try to fetch one embedding first to set size.
-    test_embed = get_embedding("test")
-    if not test_embed:
+    # Fetch one embedding first to learn the dimension
+    model_dim = asyncio.run(detect_embedding_dim())
+    if not model_dim:
         print(" [Error] Could not get embeddings from Ollama. Aborting indexing.")
         return
-        
-    dim = len(test_embed)
-    print(f" [Offline] Detected embedding dimension: {dim}")
 
-    print(f" [Offline] Detected embedding dimension: {dim}")
-    
-    # Initialize client locally to avoid global file lock
-    qdrant_client = QdrantClient(path=Config.VECTOR_DB_PATH)
+    dim = vector_dim(model_dim)
+    print(f" [Offline] Detected embedding dimension: {model_dim}, storing {dim} "
+          f"(quantization: {Config.VECTOR_QUANTIZATION})")
 
-    collection_name = "medical_docs"
-    # qdrant_client.recreate_collection is deprecated in some versions, but create_collection works.
-    # Check if exists first
-    try:
-        qdrant_client.get_collection(collection_name)
-        qdrant_client.delete_collection(collection_name)
-    except Exception:
-        pass # Collection doesn't exist
-    
-    qdrant_client.create_collection(
-        collection_name=collection_name,
-        vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE)
-    )
+    manifest = load_manifest()
+    truncation = TRUNCATION if dim < model_dim else None
+    if manifest.get("dim") != dim or manifest.get("truncation") != truncation:
+        # No manifest yet (or a new embedding model / truncation): IDs and vectors can't be reused
+        full_rebuild = True
+    if manifest.get("chunker") != CHUNKER_VERSION:
+        # Chunk boundaries changed: every PDF must be re-read (its old chunk IDs are deleted below)
+        for entry in manifest["sources"].values():
+            entry["mtime"] = None
+    if full_rebuild:
+        manifest = {"version": None, "dim": dim, "truncation": truncation, "chunker": CHUNKER_VERSION, "sources": {}}
+
+    # Initialize client locally to avoid global file lock
+    qdrant_client = connect_qdrant()
+    if ensure_collection(qdrant_client, dim, recreate=full_rebuild):
+        manifest["sources"] = {}
 
-    pdf_paths = glob.glob(os.path.join("data/raw/*.pdf"))
-    
-    documents = []
-    
-    # Start with simple text chunking (no PDF lib installed yet? pymupdf was in requirements...)
-    # I'll check if fitz/pymupdf is available. If not, skip PDF content or use text files if any.
-    # User moved data/*.pdf to data/raw/
-    
-    # Attempt to import pymupdf
     try:
-        import fitz
-        for pdf_file in pdf_paths:
-            print(f"   - Reading {pdf_file}...")
-            doc = fitz.open(pdf_file)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            
-            # Optimized chunking: 1000 chars with 200 overlap
-            chunk_size = 1000
-            overlap = 200
-            chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size - overlap)]
-            for i, chunk in enumerate(chunks):
-                documents.append({
-                    "content": chunk,
-                    "source": os.path.basename(pdf_file),
-                    "id": f"{os.path.basename(pdf_file)}_{i}"
-                })
+        import fitz  # noqa: F401
+        has_pdf_reader = True
     except ImportError:
-            print(" [Warning] PyMuPDF not found. Skipping PDF content.")
+        print(" [Warning] PyMuPDF not found. Skipping PDF content.")
+        has_pdf_reader = False
 
-    except ImportError:
-            print(" [Warning] PyMuPDF not found. Skipping PDF content.")
-
-    counter = 0
-
-    # Indexing
-    if documents:
-        print(f"   - Indexing {len(documents)} chunks...")
-        points = []
-        for doc in documents:
-            vector = get_embedding(doc['content'])
-            if vector and len(vector) == dim:
-                points.append(models.PointStruct(
-                    id=abs(hash(doc['id'])),
-                    vector=vector,
-                    payload=doc
-                ))
-            
-            # Batch upsert to avoid huge request?
-            if len(points) >= 10:
-                qdrant_client.upsert(collection_name="medical_docs", points=points)
-                points = []
-
-            print(f"   - Indexed {counter} chunks out of {len(documents)}")
-            counter += 1
-        
-        if points:
-            qdrant_client.upsert(collection_name="medical_docs", points=points)
-    
+    pdf_paths = {os.path.basename(p): p for p in sorted(glob.glob(os.path.join("data/raw/*.pdf")))}
+
+    stale = {}
+    for source, pdf_file in pdf_paths.items():
+        stat = os.stat(pdf_file)
+        entry = manifest["sources"].get(source)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            continue # Unchanged since last run
+        if has_pdf_reader:
+            stale[source] = (pdf_file, stat)
+
+    if stale:
+        print(f"   - Reading {len(stale)} PDFs...")
+    extracted = extract_pdfs([pdf_file for pdf_file, _ in stale.values()])
+
+    new_documents = []
+    kept_documents = [] # Same text (same ID and vector), but page/offset/chunk may have moved
+    delete_ids = []
+    changed_sources = {}
+    for source, (pdf_file, stat) in stale.items():
+        entry = manifest["sources"].get(source)
+        documents = extracted[pdf_file]
+        old_ids = set(entry["chunk_ids"]) if entry else set()
+        chunk_ids = [doc["id"] for doc in documents]
+        new_documents.extend(doc for doc in documents if doc["id"] not in old_ids)
+        kept_documents.extend(doc for doc in documents if doc["id"] in old_ids)
+        delete_ids.extend(old_ids - set(chunk_ids))
+        changed_sources[source] = {"mtime": stat.st_mtime, "size": stat.st_size, "chunk_ids": chunk_ids}
+
+    removed_sources = [source for source in manifest["sources"] if source not in pdf_paths]
+    for source in removed_sources:
+        delete_ids.extend(manifest["sources"][source]["chunk_ids"])
+
+    if not changed_sources and not removed_sources and not full_rebuild:
+        print(" [Offline] Index is up to date. Nothing to do.")
+        if Config.VECTOR_BACKEND == "numpy" and not os.path.isdir(os.path.join(Config.NUMPY_INDEX_PATH, COLLECTION_NAME)):
+            export_numpy_index(qdrant_client)
+        qdrant_client.close()
+        return
+
+    print(f" [Offline] {len(changed_sources)} changed, {len(removed_sources)} removed sources: "
+          f"{len(new_documents)} chunks to embed, {len(kept_documents)} to re-label, {len(delete_ids)} to delete.")
+
+    if delete_ids:
+        qdrant_client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=models.PointIdsList(points=delete_ids)
+        )
+
+    if kept_documents:
+        refresh_payloads(qdrant_client, kept_documents)
+
+    failed_ids = set()
+    if new_documents:
+        print(f"   - Indexing {len(new_documents)} chunks...")
+        stats = asyncio.run(run_indexing(qdrant_client, new_documents))
+        failed_ids = set(stats["failed_ids"])
+
+    for source, entry in changed_sources.items():
+        if failed_ids.intersection(entry["chunk_ids"]):
+            # Leave the failed chunks out and force a re-read next run so they get retried
+            entry["chunk_ids"] = [cid for cid in entry["chunk_ids"] if cid not in failed_ids]
+            entry["mtime"] = None
+        manifest["sources"][source] = entry
+    for source in removed_sources:
+        del manifest["sources"][source]
+
+    manifest["dim"] = dim
+    manifest["truncation"] = truncation
+    manifest["chunker"] = CHUNKER_VERSION
+    manifest["version"] = uuid.uuid4().hex # Consumers key caches on this
+    save_manifest(manifest)
     print(" [Offline] Vector Indexing Complete.")
 
-    # 4. Build BM25 Index (Hybrid Search)
+    # 4. Update BM25 Index (Hybrid Search) to match the vector side
+    live_ids = [cid for entry in manifest["sources"].values() for cid in entry["chunk_ids"]]
+    update_bm25_index(qdrant_client, live_ids, new_documents, kept_documents)
+    if Config.VECTOR_BACKEND == "numpy":
+        export_numpy_index(qdrant_client)
+    qdrant_client.close()
+
+def refresh_payloads(qdrant_client: QdrantClient, documents: list, batch_size: int = 512):
+    """
+    Rewrites the payload of kept chunks from their new extraction. Their vectors are
+    still valid (the ID hashes the text), but page/page_end/offset/chunk follow the
+    chunk's position, which shifts when earlier pages change: citations would be stale.
+    """
+    for start in range(0, len(documents), batch_size):
+        qdrant_client.batch_update_points(COLLECTION_NAME, [
+            models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(payload=doc, points=[doc["id"]]))
+            for doc in documents[start:start + batch_size]
+        ])
+
+def export_numpy_index(qdrant_client: QdrantClient, batch_size: int = 512):
+    """
+    Snapshots the collection (vectors + payloads) into the in-process NumPy index.
+    Qdrant stays the system of record for incremental updates; the matrix is rebuilt
+    from it in one pass, which is cheap next to embedding.
+    """
+    print(" [Offline] Exporting vectors to the NumPy index...")
+    ids, vectors, payloads, offset = [], [], [], None
+    while True:
+        records, offset = qdrant_client.scroll(
+            COLLECTION_NAME, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        for record in records:
+            ids.append(str(record.id))
+            vectors.append(record.vector)
+            payloads.append(record.payload)
+        if offset is None:
+            break
+    store = NumpyVectorStore()
+    if not ids:
+        shutil.rmtree(os.path.join(store.path, COLLECTION_NAME), ignore_errors=True)
+        print(" [Offline] No vectors left, NumPy index removed.")
+        return
+    index = NumpyVectorIndex.build(
+        ids, vectors, payloads, dtype=Config.NUMPY_INDEX_DTYPE, ivf_lists=Config.NUMPY_IVF_LISTS
+    )
+    store.write(COLLECTION_NAME, index)
+    print(f" [Offline] NumPy index saved to {os.path.join(store.path, COLLECTION_NAME)} "
+          f"({len(index)} x {index.dim} {index.vectors.dtype}, {Config.NUMPY_IVF_LISTS or 'no'} IVF lists)")
+
+def update_bm25_index(qdrant_client: QdrantClient, live_ids: list, new_documents: list, kept_documents: list = ()):
+    """
+    Rebuilds BM25 over the live chunk set, re-tokenizing only chunks it hasn't seen.
+    Term counts of kept chunks are read back from the previous index's postings,
+    so the cost is dominated by the new chunks; their document entries come from
+    `kept_documents` (the fresh metadata) when they were re-extracted.
+    """
     print(" [Offline] Building BM25 Index for Hybrid Search...")
     try:
-        from rank_bm25 import BM25Okapi
-        import pickle
-        from pythainlp.tokenize import word_tokenize
-        
-        # Tokenize all documents
-        tokenized_corpus = []
-        print(f"   - Tokenizing {len(documents)} docs with PyThaiNLP...")
-        for doc in documents:
-            # Tokenize and keep list of strings
-            tokens = word_tokenize(doc['content'], engine="newmm")
-            tokenized_corpus.append(tokens)
-            
-        bm25 = BM25Okapi(tokenized_corpus)
-        
-        # Save BM25 + Documents mapping (we need the docs to map back from BM25 scores)
-        bm25_data = {
-            "bm25": bm25,
-            "documents": documents
-        }
-        
-        with open("data/bm25_data.pkl", "wb") as f:
-            pickle.dump(bm25_data, f)
-            
-        print(" [Offline] BM25 Index Saved to data/bm25_data.pkl")
+        from collections import Counter
+
+        # Previous run: id -> (document, term counts)
+        previous = {}
+        try:
+            old_index = BM25Index.load(Config.BM25_INDEX_PATH)
+            previous = {doc["id"]: (doc, counts) for doc, counts in zip(old_index.documents, old_index.term_counts())}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        known = {doc["id"]: doc for doc in (*kept_documents, *new_documents)}
+        missing = [cid for cid in live_ids if cid not in previous and cid not in known]
+        if missing:
+            # Chunks without an entry in the previous index: recover their text from Qdrant payloads
+            for record in qdrant_client.retrieve(COLLECTION_NAME, ids=missing, with_payload=True):
+                known[str(record.id)] = record.payload
+
+        documents = []
+        term_counts = []
+        tokenized = 0
+        for cid in live_ids:
+            if cid in previous:
+                doc, counts = previous[cid]
+                doc = known.get(cid, doc) # Re-extracted: same text (same counts), fresh metadata
+            elif cid in known:
+                doc = known[cid]
+                counts = Counter(tokenize(doc['content']))
+                tokenized += 1
+            else:
+                continue
+            documents.append(doc)
+            term_counts.append(counts)
+        print(f"   - Tokenized {tokenized} new docs with PyThaiNLP ({len(documents)} total)")
+
+        if not term_counts:
+            shutil.rmtree(Config.BM25_INDEX_PATH, ignore_errors=True)
+            print(" [Offline] No documents left, BM25 index removed.")
+            return
+
+        # Postings + documents mapping (we need the docs to map back from BM25 scores)
+        BM25Index.build(term_counts, documents).save(Config.BM25_INDEX_PATH)
+        print(f" [Offline] BM25 Index Saved to {Config.BM25_INDEX_PATH}")
         
     except Exception as e:
         print(f" [Error] Failed to build BM25: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline document ingestion")
+    parser.add_argument("--full", action="store_true", help="Drop the collection and re-embed everything")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    setup_logging()
     process_images_offline()
-    chunk_mixed_documents()
+    chunk_mixed_documents(full_rebuild=args.full)
@@ -1,34 +1,286 @@
+import re
+import time
 import httpx
 import asyncio
 from cachetools import TTLCache
 from src.config import Config
+from src.tools.http_client import get_http_client
+from src.tools.resilience import CircuitBreaker, AdaptiveTimeout, CircuitOpenError, call_upstream
+from src.tracing import traced
+from src.log import get_logger
 
-# In-memory cache: Stores results for 5 minutes (300s)
-api_cache = TTLCache(maxsize=1000, ttl=300)
+logger = get_logger("patient_api")
 
-async def fetch_patient_live_data(patient_id: str):
+# Process-wide singleton, see get_patient_client()
+PATIENT_CLIENT = None
+
+# An ID introduced by a label: "id: 123", "รหัส 123", "patient 42", "HN 5521", "ผู้ป่วย 321", "หมายเลข 77"
+_LABELED_ID = re.compile(
+    r"(?:\b(?:patient\s*(?:id|number|no\.?)?|id|number|hn)|รหัส(?:ผู้ป่วย)?|หมายเลข|ผู้ป่วย|คนไข้)\s*[:#]?\s*(\d+)",
+    re.IGNORECASE
+)
+_BARE_NUMBER = re.compile(r"(?<![\w.])(\d+)(?![\w.])")
+
+
+def extract_patient_ids(query: str) -> list:
+    """
+    Every patient ID mentioned in the query, in order, without duplicates.
+    Labeled IDs win; only when there are none do bare numbers count (the old
+    first-digit-token rule), so "patient 456 has a fever of 39" yields ["456"].
+    """
+    ids = _LABELED_ID.findall(query) or _BARE_NUMBER.findall(query)
+    return list(dict.fromkeys(ids))
+
+
+class PatientClient:
     """
-    Wraps the external API.
-    1. Checks Cache first (Speed).
-    2. Calls API if miss.
-    3. Handles timeouts/errors gracefully.
+    Patient API client built to protect the slow upstream under bursts.
+    - Coalescing: concurrent requests for the same ID share one upstream call.
+    - Batching: misses of one call go out as a single batch request when the API has
+      a batch endpoint, otherwise as single GETs capped at PATIENT_API_MAX_CONCURRENCY.
+    - Stale-while-revalidate: entries are fresh for PATIENT_CACHE_TTL; until
+      PATIENT_STALE_TTL they are still served at once while a background refresh runs.
+    - Resilience: upstream calls go through a circuit breaker with adaptive timeouts,
+      single GETs are hedged; while the breaker is open cached data is all we serve.
     """
-    if patient_id in api_cache:
-        print(f" [Cache Hit] Returning data for {patient_id}")
-        return api_cache[patient_id]
 
-    try:
-        async with httpx.AsyncClient(timeout=2.0) as client:
-            response = await client.get(f"{Config.BAD_API_ENDPOINT}/patients/{patient_id}")
+    def __init__(self):
+        # id -> (data, fetched_at); evicted only once stale data is no longer servable
+        self.cache = TTLCache(maxsize=Config.PATIENT_CACHE_SIZE, ttl=Config.PATIENT_STALE_TTL)
+        self.fresh_ttl = Config.PATIENT_CACHE_TTL
+        self.batch_supported = {"auto": None, "true": True}.get(Config.PATIENT_API_BATCH, False)
+        self._inflight = {}  # id -> Future of the upstream call fetching it
+        self._refreshing = set()
+        self._tasks = set()  # upstream calls in flight (strong refs, see _load)
+        self._semaphore = None  # (semaphore, loop): asyncio primitives are bound to one loop
+        self.breaker = CircuitBreaker(
+            "patient_api",
+            failure_rate=Config.PATIENT_BREAKER_FAILURE_RATE,
+            min_calls=Config.PATIENT_BREAKER_MIN_CALLS,
+            window=Config.PATIENT_BREAKER_WINDOW,
+            cooldown=Config.PATIENT_BREAKER_COOLDOWN
+        )
+        # Batch latency grows with the batch, so it gets its own timeout
+        self.get_timeout, self.batch_timeout = (
+            AdaptiveTimeout(
+                name,
+                ceiling=Config.PATIENT_API_TIMEOUT,
+                floor=Config.PATIENT_API_TIMEOUT_MIN,
+                percentile=Config.PATIENT_API_TIMEOUT_PERCENTILE,
+                multiplier=Config.PATIENT_API_TIMEOUT_MULTIPLIER,
+                hedge_percentile=Config.PATIENT_API_HEDGE_PERCENTILE
+            )
+            for name in ("patient_api_get", "patient_api_batch")
+        )
+        self.stats_counters = {
+            "fresh_hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0,
+            "upstream_gets": 0, "upstream_batches": 0, "errors": 0, "short_circuited": 0
+        }
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[1] is not loop:
+            self._semaphore = (asyncio.Semaphore(Config.PATIENT_API_MAX_CONCURRENCY), loop)
+        return self._semaphore[0]
+
+    async def get_many(self, patient_ids: list) -> dict:
+        """{id: patient data or {"error": ...}} for every requested ID."""
+        now = time.time()
+        results, missing = {}, []
+        for pid in dict.fromkeys(patient_ids):
+            entry = self.cache.get(pid)
+            if entry is None:
+                missing.append(pid)
+                continue
+            data, fetched_at = entry
+            results[pid] = data
+            if now - fetched_at < self.fresh_ttl:
+                self.stats_counters["fresh_hits"] += 1
+            else:
+                self.stats_counters["stale_hits"] += 1
+                self._revalidate(pid)
+        if missing:
+            self.stats_counters["misses"] += len(missing)
+            results.update(await self._load(missing))
+        return {pid: results[pid] for pid in dict.fromkeys(patient_ids)}
+
+    async def get(self, patient_id: str):
+        return (await self.get_many([patient_id]))[patient_id]
+
+    def _revalidate(self, patient_id: str):
+        if patient_id in self._refreshing or patient_id in self._inflight:
+            return
+        self._refreshing.add(patient_id)
+
+        async def refresh():
+            try:
+                await self._load([patient_id])
+            finally:
+                self._refreshing.discard(patient_id)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, patient_ids: list) -> dict:
+        """Fetches the IDs, joining calls already in flight instead of duplicating them."""
+        loop = asyncio.get_running_loop()
+        waiting, owned = {}, []
+        for pid in patient_ids:
+            future = self._inflight.get(pid)
+            if future is not None:
+                self.stats_counters["coalesced"] += 1
+            else:
+                future = self._inflight[pid] = loop.create_future()
+                owned.append(pid)
+            waiting[pid] = future
+
+        if owned:
+            # The upstream call runs as its own task: one caller giving up (client
+            # disconnect) must not cancel it for the others waiting on the same IDs
+            task = loop.create_task(self._fetch_and_resolve(owned))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return {pid: await asyncio.shield(future) for pid, future in waiting.items()}
+
+    async def _fetch_and_resolve(self, patient_ids: list):
+        fetched = {}
+        try:
+            fetched = await self._fetch_upstream(patient_ids)
+        except Exception as e:
+            logger.exception("Patient API call crashed", extra={"fields": {"patient_ids": patient_ids}})
+            fetched = {pid: {"error": "System error", "details": str(e)} for pid in patient_ids}
+        finally:
+            self._resolve(patient_ids, fetched)
+
+    def _resolve(self, patient_ids: list, fetched: dict):
+        now = time.time()
+        for pid in patient_ids:
+            data = fetched.get(pid) or {"error": "Data unavailable", "details": "missing from response"}
+            if "error" in data:
+                self.stats_counters["errors"] += 1
+                stale = self.cache.get(pid)
+                if stale is not None:
+                    data = stale[0] # Revalidation failed: keep serving what we have
+            else:
+                self.cache[pid] = (data, now)
+            future = self._inflight.pop(pid, None)
+            if future is not None and not future.done():
+                future.set_result(data)
+
+    async def _fetch_upstream(self, patient_ids: list) -> dict:
+        if len(patient_ids) > 1 and self.batch_supported is not False:
+            batch = await self._fetch_batch(patient_ids)
+            if batch is not None:
+                return batch
+        results = await asyncio.gather(*(self._fetch_one(pid) for pid in patient_ids))
+        return dict(zip(patient_ids, results))
+
+    async def _fetch_batch(self, patient_ids: list):
+        """One request for many IDs; None when the API has no batch endpoint (remembered)."""
+        client = get_http_client("patient_api")
+
+        async def attempt(timeout: float):
+            self.stats_counters["upstream_batches"] += 1
+            return await client.post(Config.PATIENT_API_BATCH_PATH, json={"ids": patient_ids}, timeout=timeout)
+
+        try:
+            async with self._limit():
+                response = await call_upstream(self.breaker, self.batch_timeout, attempt, is_failure=_batch_server_error)
+            if response.status_code in _NO_BATCH_ENDPOINT:
+                if self.batch_supported is None:
+                    logger.info("Patient API has no batch endpoint, using bounded single GETs")
+                self.batch_supported = False
+                return None
             response.raise_for_status()
-            data = response.json()
-            
-            api_cache[patient_id] = data
-            return data
-        
-    except httpx.HTTPError as e:
-        print(f" [API Error] {e}")
-        return {"error": "Data unavailable", "details": str(e)}
-    except Exception as e:
-        print(f" [System Error] {e}")
-        return {"error": "System error", "details": str(e)}
+            body = response.json()
+            self.batch_supported = True
+        except CircuitOpenError as e:
+            self.stats_counters["short_circuited"] += len(patient_ids)
+            return {pid: {"error": "Data unavailable", "details": str(e)} for pid in patient_ids}
+        except (httpx.HTTPError, TimeoutError) as e:
+            logger.warning("Patient API batch request failed", extra={"fields": {"patient_ids": patient_ids, "error": _describe(e)}})
+            return {pid: {"error": "Data unavailable", "details": _describe(e)} for pid in patient_ids}
+
+        # Accept {"patients": [...]}, a bare list of records, or an {id: record} map
+        records = body.get("patients", body) if isinstance(body, dict) else body
+        if isinstance(records, dict):
+            return {str(pid): data for pid, data in records.items()}
+        return {str(r.get("patient_id", r.get("id"))): r for r in records if isinstance(r, dict)}
+
+    async def _fetch_one(self, patient_id: str):
+        client = get_http_client("patient_api")
+
+        async def attempt(timeout: float):
+            self.stats_counters["upstream_gets"] += 1
+            return await client.get(f"/patients/{patient_id}", timeout=timeout)
+
+        try:
+            async with self._limit():
+                # A GET is idempotent, so a slow one may be duplicated (hedged) once
+                response = await call_upstream(self.breaker, self.get_timeout, attempt,
+                                               hedge=Config.PATIENT_API_HEDGE, is_failure=_server_error,
+                                               limit=self._limit())
+            response.raise_for_status()
+            return response.json()
+        except CircuitOpenError as e:
+            self.stats_counters["short_circuited"] += 1
+            return {"error": "Data unavailable", "details": str(e)}
+        except (httpx.HTTPError, TimeoutError) as e:
+            logger.warning("Patient API request failed", extra={"fields": {"patient_id": patient_id, "error": _describe(e)}})
+            return {"error": "Data unavailable", "details": _describe(e)}
+        except Exception as e:
+            logger.exception("Patient API call crashed", extra={"fields": {"patient_id": patient_id}})
+            return {"error": "System error", "details": str(e)}
+
+    def stats(self) -> dict:
+        return {
+            **self.stats_counters,
+            "cached": len(self.cache),
+            "in_flight": len(self._inflight),
+            "batch_endpoint": self.batch_supported,
+            "breaker": self.breaker.stats(),
+            "timeouts": {"get": self.get_timeout.stats(), "batch": self.batch_timeout.stats()}
+        }
+
+
+def _describe(error: Exception) -> str:
+    """str() of a TimeoutError is empty: keep the exception type in logs and error details."""
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+# Answers to the batch POST that mean "no batch route here", not "upstream unhealthy"
+_NO_BATCH_ENDPOINT = (404, 405, 501)
+
+
+def _server_error(response: httpx.Response) -> bool:
+    """5xx counts against the breaker; 4xx (unknown patient, no batch route) is a healthy answer."""
+    return response.status_code >= 500
+
+
+def _batch_server_error(response: httpx.Response) -> bool:
+    """_server_error, except a 501 Not Implemented from the batch probe."""
+    return _server_error(response) and response.status_code not in _NO_BATCH_ENDPOINT
+
+
+def get_patient_client() -> PatientClient:
+    global PATIENT_CLIENT
+    if PATIENT_CLIENT is None:
+        PATIENT_CLIENT = PatientClient()
+    return PATIENT_CLIENT
+
+
+@traced("fetch_patient_live_data")
+async def fetch_patient_live_data(patient_id: str):
+    """
+    Wraps the external API for one patient.
+    Served from cache (fresh or stale-while-revalidate), coalesced with concurrent lookups,
+    errors come back as {"error": ...} instead of raising.
+    """
+    return await get_patient_client().get(str(patient_id))
+
+
+@traced("fetch_patient_live_data")
+async def fetch_patients_live_data(patient_ids: list):
+    """{id: data} for several patients, misses fetched in one batch / bounded fan-out."""
+    return await get_patient_client().get_many([str(pid) for pid in patient_ids])
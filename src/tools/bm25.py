@@ -0,0 +1,330 @@
+import os
+import json
+import bisect
+import shutil
+from collections import Counter
+import numpy as np
+
+# On-disk format identity. Bump ENGINE_VERSION when scoring/postings layout changes,
+# TOKENIZER["version"] when tokenize() changes: both make existing indexes unreadable.
+FORMAT_NAME = "healthcare-ai-bm25"
+FORMAT_VERSION = 2
+ENGINE_VERSION = 1
+TOKENIZER = {"name": "pythainlp-newmm", "version": 1}
+
+
+class IncompatibleIndexError(ValueError):
+    """The on-disk index was written by a different format, engine or tokenizer."""
+
+
+def tokenize(text: str) -> list:
+    """Tokenizer shared by indexing and querying (they must agree)."""
+    from pythainlp.tokenize import word_tokenize
+    return word_tokenize(text, engine="newmm")
+
+
+class _BlobSequence:
+    """
+    Read-only sequence over a memory-mapped blob + offsets array.
+    Nothing is decoded until an item is accessed, so opening is O(1) in the corpus size
+    and worker processes share the pages through the OS cache.
+    """
+
+    def __init__(self, blob, offsets, decode):
+        self.blob = blob
+        self.offsets = offsets
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.decode(bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _decode_term(raw: bytes) -> str:
+    return raw.decode("utf-8")
+
+
+def _decode_document(raw: bytes) -> dict:
+    return json.loads(raw)
+
+
+def _write_blob(path_prefix: str, items: list, encode):
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    with open(f"{path_prefix}.bin", "wb") as f:
+        for i, item in enumerate(items):
+            raw = encode(item)
+            f.write(raw)
+            offsets[i + 1] = offsets[i] + len(raw)
+    np.save(f"{path_prefix}_offsets.npy", offsets)
+
+
+def _open_blob(path_prefix: str, decode):
+    offsets = np.load(f"{path_prefix}_offsets.npy", mmap_mode="r")
+    if os.path.getsize(f"{path_prefix}.bin") == 0:
+        blob = b"" # np.memmap refuses empty files
+    else:
+        blob = np.memmap(f"{path_prefix}.bin", dtype=np.uint8, mode="r")
+    return _BlobSequence(blob, offsets, decode)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a CSR term -> document matrix.
+    The BM25 weight of every posting is precomputed at build time, so scoring a query
+    only touches the posting lists of its terms, and top-k is an argpartition.
+    Scores match rank_bm25.BM25Okapi (same idf and epsilon floor).
+
+    Terms are kept sorted: a lookup is a binary search, no vocabulary dict to build at load.
+    """
+
+    def __init__(self, terms, indptr, indices, tfs, weights, df, doc_len, documents, params: dict):
+        self.terms = terms            # sorted terms, row i of the CSR matrix is terms[i]
+        self.indptr = indptr          # int64[n_terms + 1]
+        self.indices = indices        # int32[n_postings], doc index of every posting
+        self.tfs = tfs                # int32[n_postings], raw term frequency (for incremental rebuilds)
+        self.weights = weights        # float32[n_postings], precomputed BM25 contribution
+        self.df = df                  # int32[n_terms], document frequency
+        self.doc_len = doc_len        # int32[n_docs], tokens per document
+        self.documents = documents    # payloads, list at build time, lazy _BlobSequence once loaded
+        self.params = params
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def __len__(self):
+        return self.n_docs
+
+    @classmethod
+    def build(cls, term_counts: list, documents: list, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """Builds the index from one Counter(term -> tf) per document."""
+        terms = sorted(set().union(*term_counts)) if term_counts else []
+        vocab = {term: i for i, term in enumerate(terms)}
+        rows, cols, tfs = [], [], []
+        for doc_idx, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                rows.append(vocab[term])
+                cols.append(doc_idx)
+                tfs.append(tf)
+
+        n_docs = len(term_counts)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.int32)
+
+        # COO -> CSR (sorted by term, then doc)
+        order = np.lexsort((cols, rows))
+        rows, cols, tfs = rows[order], cols[order], tfs[order]
+        df = np.bincount(rows, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        doc_len = np.bincount(cols, weights=tfs, minlength=n_docs)
+        avgdl = doc_len.mean() if n_docs else 0.0
+
+        idf = np.log((n_docs - df + 0.5) / (df + 0.5))
+        # Same floor as BM25Okapi: very common terms get epsilon * average idf instead of a negative idf
+        average_idf = idf.mean() if len(idf) else 0.0
+        idf[idf < 0] = epsilon * average_idf
+
+        tf = tfs.astype(np.float64)
+        norm = k1 * (1 - b + b * doc_len[cols] / avgdl) if avgdl else k1
+        weights = (idf[rows] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+        params = {"k1": k1, "b": b, "epsilon": epsilon}
+        return cls(terms, indptr, cols, tfs, weights, df.astype(np.int32), doc_len.astype(np.int32), documents, params)
+
+    @classmethod
+    def from_tokens(cls, tokenized_corpus: list, documents: list, **params):
+        return cls.build([Counter(tokens) for tokens in tokenized_corpus], documents, **params)
+
+    def _term_row(self, term: str):
+        row = bisect.bisect_left(self.terms, term)
+        if row < len(self.terms) and self.terms[row] == term:
+            return row
+        return None
+
+    def term_counts(self) -> list:
+        """Per-document Counter(term -> tf) recovered from the postings (no need to re-tokenize)."""
+        counts = [Counter() for _ in range(self.n_docs)]
+        for row, term in enumerate(self.terms):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            for doc_idx, tf in zip(self.indices[start:end].tolist(), self.tfs[start:end].tolist()):
+                counts[doc_idx][term] = tf
+        return counts
+
+    def _postings(self, tokens: list):
+        """Doc indices and weighted contributions of every posting touched by the query."""
+        doc_parts, weight_parts = [], []
+        for term, count in Counter(tokens).items():
+            row = self._term_row(term)
+            if row is None:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            doc_parts.append(self.indices[start:end])
+            # Repeated query terms count once per occurrence, like BM25Okapi
+            weight_parts.append(self.weights[start:end] * count)
+        if not doc_parts:
+            return None, None
+        return np.concatenate(doc_parts), np.concatenate(weight_parts)
+
+    def get_scores(self, tokens: list) -> np.ndarray:
+        """Dense scores for every document (drop-in for BM25Okapi.get_scores)."""
+        docs, weights = self._postings(tokens)
+        if docs is None:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        return np.bincount(docs, weights=weights, minlength=self.n_docs)
+
+    def top_k(self, tokens: list, k: int = 20):
+        """
+        Returns [(doc_index, score)] best first.
+        Only documents that share a term with the query are scored, so the cost
+        follows the posting-list sizes rather than the corpus size.
+        """
+        docs, weights = self._postings(tokens)
+        if docs is None:
+            return []
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def top_k_batch(self, token_lists: list, k: int = 20):
+        """
+        top_k for many queries in one sparse (queries x terms) @ (terms x docs) product.
+        Scores are accumulated over (query, doc) pairs that share a term, never a dense
+        queries x corpus matrix. Returns one [(doc_index, score)] list per query.
+        """
+        query_parts, doc_parts, weight_parts = [], [], []
+        for q, tokens in enumerate(token_lists):
+            docs, weights = self._postings(tokens)
+            if docs is None:
+                continue
+            query_parts.append(np.full(len(docs), q, dtype=np.int64))
+            doc_parts.append(docs)
+            weight_parts.append(weights)
+        results = [[] for _ in token_lists]
+        if not doc_parts:
+            return results
+
+        pair_keys = np.concatenate(query_parts) * self.n_docs + np.concatenate(doc_parts)
+        pairs, inverse = np.unique(pair_keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weight_parts))
+        query_of, doc_of = np.divmod(pairs, self.n_docs)
+
+        # Sort by query, then score descending; keep the first k of every query
+        order = np.lexsort((-scores, query_of))
+        query_of, doc_of, scores = query_of[order], doc_of[order], scores[order]
+        starts = np.searchsorted(query_of, np.arange(len(token_lists)))
+        ends = np.searchsorted(query_of, np.arange(len(token_lists)), side="right")
+        for q in range(len(token_lists)):
+            stop = min(ends[q], starts[q] + k)
+            results[q] = [
+                (int(d), float(s)) for d, s in zip(doc_of[starts[q]:stop], scores[starts[q]:stop]) if s > 0
+            ]
+        return results
+
+    # --- persistence -----------------------------------------------------
+    # Layout of an index directory:
+    #   header.json                  format/engine/tokenizer versions, sizes, BM25 params
+    #   indptr/indices/tfs/weights   CSR postings (.npy, memory-mapped)
+    #   df/doc_len                   term and document stats (.npy, memory-mapped)
+    #   terms.bin + terms_offsets    sorted vocabulary, utf-8 blob
+    #   docs.bin + docs_offsets      one JSON payload per document, read lazily by offset
+    def save(self, directory: str):
+        """Writes the index to a fresh directory and swaps it in, readers never see a partial index."""
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        arrays = {
+            "indptr": self.indptr, "indices": self.indices, "tfs": self.tfs,
+            "weights": self.weights, "df": self.df, "doc_len": self.doc_len
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(array))
+        _write_blob(os.path.join(tmp_dir, "terms"), list(self.terms), lambda term: term.encode("utf-8"))
+        _write_blob(
+            os.path.join(tmp_dir, "docs"), list(self.documents),
+            lambda doc: json.dumps(doc, ensure_ascii=False).encode("utf-8")
+        )
+        header = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "engine_version": ENGINE_VERSION,
+            "tokenizer": TOKENIZER,
+            "n_docs": self.n_docs,
+            "n_terms": len(self.terms),
+            "n_postings": len(self.indices),
+            "params": self.params
+        }
+        # Header last: a directory without one is never a valid index
+        with open(os.path.join(tmp_dir, "header.json"), "w") as f:
+            json.dump(header, f, indent=1)
+
+        old_dir = f"{directory}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @staticmethod
+    def read_header(directory: str) -> dict:
+        """Validates the header and raises IncompatibleIndexError before any array is touched."""
+        try:
+            with open(os.path.join(directory, "header.json"), "r") as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            if os.path.isdir(directory):
+                raise IncompatibleIndexError(f"{directory} has no header.json (pre-versioned index)")
+            raise
+        expected = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "engine_version": ENGINE_VERSION,
+            "tokenizer": TOKENIZER
+        }
+        for field, value in expected.items():
+            if header.get(field) != value:
+                raise IncompatibleIndexError(
+                    f"{directory}: {field}={header.get(field)!r}, this build expects {value!r}"
+                )
+        return header
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Everything is memory-mapped: opening costs the same for 1k or 1M documents,
+        and several uvicorn workers share one copy of the pages.
+        """
+        header = cls.read_header(directory)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("indptr", "indices", "tfs", "weights", "df", "doc_len")
+        }
+        terms = _open_blob(os.path.join(directory, "terms"), _decode_term)
+        documents = _open_blob(os.path.join(directory, "docs"), _decode_document)
+
+        sizes = {
+            "n_docs": (len(arrays["doc_len"]), len(documents)),
+            "n_terms": (len(arrays["df"]), len(terms), len(arrays["indptr"]) - 1),
+            "n_postings": (len(arrays["indices"]), len(arrays["tfs"]), len(arrays["weights"]))
+        }
+        for field, actual in sizes.items():
+            if any(size != header[field] for size in actual):
+                raise IncompatibleIndexError(f"{directory}: {field} mismatch {actual} vs header {header[field]}")
+
+        return cls(terms=terms, documents=documents, params=header["params"], **arrays)
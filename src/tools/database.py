@@ -1,122 +1,179 @@
-import duckdb
 import os
-import pickle
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from src.config import Config
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
+from src.tools.bm25 import BM25Index, IncompatibleIndexError, tokenize
+from src.tools.vector_store import open_vector_store, get_vector_store, close_vector_store
+from src.tools.numpy_store import open_numpy_store, get_numpy_store, close_numpy_store
+from src.tools.sql_store import get_sql_store
+from src.tools.embeddings import embed_batch, EmbeddingError
+from src.tools.reranker import get_rerank_service
+from src.tracing import span, traced, bind_context
+from src.log import get_logger
+
+logger = get_logger("retrieval")
 
 # Global caches for singletons
 BM25_DATA = None
-CROSS_ENCODER_MODEL = None
-
-def get_sql_connection():
-    return duckdb.connect(Config.SQL_DB_PATH)
+RETRIEVAL_EXECUTOR = None
 
-async def query_sql_db(query: str):
-    """Executes a read-only SQL query against DuckDB."""
+@traced("query_sql_db")
+async def query_sql_db(query: str, params: list = None, max_rows: int = None):
+    """
+    Executes a read-only SQL query against DuckDB (shared read-only connection, see sql_store.py).
+    Pass values as `params` ($1 / ? placeholders) rather than formatting them into the SQL.
+    Columnar result: {"columns", "data": {column: [values]}, "row_count", "truncated"}.
+    """
     try:
-        conn = get_sql_connection()
-        results = conn.execute(query).fetchall()
-        columns = [desc[0] for desc in conn.description]
-        conn.close()
-        return [dict(zip(columns, row)) for row in results]
+        store = get_sql_store()
+        if not store:
+            return _empty_sql_result("SQL database unavailable")
+        return await store.aquery(query, params, max_rows)
     except Exception as e:
-        print(f" [SQL Error] {e}")
-        return []
+        logger.warning("SQL query failed", extra={"fields": {"error": str(e)}})
+        return _empty_sql_result(str(e))
+
+def _empty_sql_result(error: str):
+    return {"columns": [], "data": {}, "row_count": 0, "truncated": False, "error": error}
+
+# Vector search backends: same search/asearch/asearch_batch surface, hits with .id/.score/.payload
+VECTOR_BACKENDS = {
+    "qdrant": (open_vector_store, get_vector_store, close_vector_store),
+    "numpy": (open_numpy_store, get_numpy_store, close_numpy_store),
+}
+
+def _vector_backend(name: str = None):
+    name = name or Config.VECTOR_BACKEND
+    if name not in VECTOR_BACKENDS:
+        raise ValueError(f"VECTOR_BACKEND must be one of {tuple(VECTOR_BACKENDS)}, got {name!r}")
+    return VECTOR_BACKENDS[name]
+
+def open_vector_backend():
+    """Opens the configured vector backend (called at app startup)."""
+    return _vector_backend()[0]()
+
+def get_vector_backend():
+    """The configured vector backend, opened lazily for scripts that skip the app lifespan."""
+    return _vector_backend()[1]()
+
+def close_vector_backend():
+    _vector_backend()[2]()
 
 def load_bm25():
-    """Lazy load BM25 index"""
+    """Lazy load BM25 index (memory-mapped, shared between workers via the page cache)"""
     global BM25_DATA
     if BM25_DATA is None:
         try:
-            with open("data/bm25_data.pkl", "rb") as f:
-                BM25_DATA = pickle.load(f)
-            print(" [System] BM25 Index loaded.")
+            BM25_DATA = BM25Index.load(Config.BM25_INDEX_PATH)
+            logger.info("BM25 index loaded", extra={"fields": {"docs": len(BM25_DATA)}})
+        except IncompatibleIndexError as e:
+            logger.error("BM25 index rejected, rebuild with `python -m src.pipelines.ingestion --full`", extra={"fields": {"error": str(e)}})
+            BM25_DATA = False
         except Exception:
-            print(" [System] BM25 not found. Hybrid search will be partial.")
-            BM25_DATA = {}
+            logger.warning("BM25 index not found, hybrid search will be partial")
+            BM25_DATA = False # Don't retry on every query
     return BM25_DATA
 
-def load_reranker():
-    """Lazy load Cross-Encoder"""
-    global CROSS_ENCODER_MODEL
-    if CROSS_ENCODER_MODEL is None:
-        try:
-            from sentence_transformers import CrossEncoder
-            # TinyBERT is super fast (10-20ms per doc)
-            CROSS_ENCODER_MODEL = CrossEncoder('cross-encoder/ms-marco-TinyBERT-L-2-v2') 
-            print(" [System] CrossEncoder loaded.")
-        except Exception as e:
-            print(f" [System] Failed to load CrossEncoder: {e}")
-    return CROSS_ENCODER_MODEL
+@traced("embed_query")
+async def embed_query(query_text: str):
+    """Query embedding (nomic `search_query:` prefix), or None if Ollama failed."""
+    try:
+        # Cached: repeated questions skip the Ollama round-trip entirely
+        return (await embed_batch([query_text], prefix="search_query: ", retries=0))[0]
+    except EmbeddingError as e:
+        logger.warning("Query embedding failed", extra={"fields": {"error": str(e)}})
+        return None
 
-async def query_vector_db(query_text: str, collection_name: str = "medical_docs", limit: int = 10):
-    """Standard Vector Search"""
+@traced("query_vector_db")
+async def query_vector_db(query_text: str, collection_name: str = "medical_docs", limit: int = 10, vector: list = None):
+    """
+    Standard Vector Search. Pass `vector` when the query embedding is already known,
+    or an embed_query task to wait for one that is still in flight.
+    """
     try:
-        from src.config import Config
-        import httpx
-        
-        vector = []
-        try:
-            url = f"{Config.OLLAMA_BASE_URL}/api/embeddings"
-            payload = {
-                "model": Config.EMBEDDING_MODEL, 
-                "prompt": f"search_query: {query_text}"
-            }
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(url, json=payload)
-                if response.status_code == 200:
-                    vector = response.json().get("embedding")
-        except Exception as e:
-            print(f" [Embedding Error] {e}")
+        if vector is None:
+            vector = await embed_query(query_text)
+        elif isinstance(vector, asyncio.Future):
+            vector = await asyncio.shield(vector) # Shared: the caller awaits it too
         
         if not vector: return []
 
-        client = QdrantClient(path=Config.VECTOR_DB_PATH)
-        search_result = client.query_points(
-            collection_name=collection_name,
-            query=vector,
-            limit=limit
-        ).points
+        with span("vector_search"):
+            search_result = await get_vector_backend().asearch(vector, collection_name=collection_name, limit=limit)
 
         return [{"score": hit.score, "payload": hit.payload, "id": hit.id} for hit in search_result]
     except Exception as e:
-        print(f" [Vector DB Error] {e}")
+        logger.warning("Vector search failed", extra={"fields": {"error": str(e)}})
         return []
 
-async def hybrid_search(query_text: str, limit: int = 5):
-    """
-    Combines Vector Search + BM25 using Reciprocal Rank Fusion (RRF).
-    """
-    # 1. Get Vector Results
-    vector_results = await query_vector_db(query_text, limit=20) # Get more for fusion
-    
-    # 2. Get BM25 Results
+def get_retrieval_executor():
+    """Worker pool for CPU-bound retrieval (PyThaiNLP tokenization + BM25 scoring)."""
+    global RETRIEVAL_EXECUTOR
+    if RETRIEVAL_EXECUTOR is None:
+        RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=Config.RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    return RETRIEVAL_EXECUTOR
+
+def close_retrieval_executor():
+    global RETRIEVAL_EXECUTOR
+    if RETRIEVAL_EXECUTOR is not None:
+        RETRIEVAL_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        RETRIEVAL_EXECUTOR = None
+
+def bm25_search(query_text: str, limit: int = 20):
+    """Keyword branch of hybrid search. Blocking: run it in the retrieval executor."""
     bm25_data = load_bm25()
     bm25_results = []
     
-    if bm25_data and "bm25" in bm25_data:
+    if bm25_data:
         try:
-            from pythainlp.tokenize import word_tokenize
-            tokenized_query = word_tokenize(query_text, engine="newmm")
-            bm25 = bm25_data["bm25"]
-            docs = bm25_data["documents"]
-            
-            scores = bm25.get_scores(tokenized_query)
-            # Get top N indices
-            top_n = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:20]
-            
-            for i in top_n:
-                if scores[i] > 0:
-                    bm25_results.append({
-                        "score": scores[i],
-                        "payload": docs[i],
-                        "id": i # Use index as faux ID for local docs
-                    })
+            with span("bm25_tokenize"):
+                tokenized_query = tokenize(query_text)
+            # Only the query terms' posting lists are scored; top-k via argpartition
+            with span("bm25_score"):
+                hits = bm25_data.top_k(tokenized_query, k=limit)
+            for i, score in hits:
+                bm25_results.append({
+                    "score": score,
+                    "payload": bm25_data.documents[i],
+                    "id": i # Use index as faux ID for local docs
+                })
         except Exception as e:
-            print(f" [BM25 Error] {e}")
+            logger.warning("BM25 search failed", extra={"fields": {"error": str(e)}})
+    return bm25_results
 
-    # 3. RRF Fusion
+def bm25_search_batch(query_texts: list, limit: int = 20):
+    """bm25_search for many queries: tokenize all, then score them in one BM25Index.top_k_batch call."""
+    bm25_data = load_bm25()
+    if not bm25_data:
+        return [[] for _ in query_texts]
+    try:
+        hits = bm25_data.top_k_batch([tokenize(q) for q in query_texts], k=limit)
+        return [
+            [{"score": score, "payload": bm25_data.documents[i], "id": i} for i, score in query_hits]
+            for query_hits in hits
+        ]
+    except Exception as e:
+        logger.warning("BM25 search failed", extra={"fields": {"error": str(e)}})
+        return [[] for _ in query_texts]
+
+async def query_vector_db_batch(vectors: list, collection_name: str = "medical_docs", limit: int = 10):
+    """query_vector_db for many precomputed embeddings in one backend batch call. None vectors get no hits."""
+    present = [i for i, vector in enumerate(vectors) if vector]
+    results = [[] for _ in vectors]
+    if not present:
+        return results
+    try:
+        with span("vector_search_batch"):
+            batches = await get_vector_backend().asearch_batch([vectors[i] for i in present], collection_name=collection_name, limit=limit)
+        for i, hits in zip(present, batches):
+            results[i] = [{"score": hit.score, "payload": hit.payload, "id": hit.id} for hit in hits]
+    except Exception as e:
+        logger.warning("Vector search failed", extra={"fields": {"error": str(e)}})
+    return results
+
+def _rrf_fuse(vector_results: list, bm25_results: list, limit: int):
+    """Reciprocal Rank Fusion of the two branches."""
     # Map doc content hash to score
     fusion_scores = {}
     k = 60
@@ -145,25 +202,112 @@ async def hybrid_search(query_text: str, limit: int = 5):
     final_results = sorted(fusion_scores.values(), key=lambda x: x['score'], reverse=True)
     return final_results[:limit]
 
+async def _run_branch(name: str, awaitable, timeout: float, timings: dict):
+    """Awaits one retrieval branch; on timeout the branch contributes nothing instead of failing the search."""
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Hybrid search branch timed out, using the other branch only", extra={"fields": {"branch": name, "timeout_s": timeout}})
+        timings.setdefault("degraded", []).append(name)
+        return []
+    finally:
+        timings[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+
+@traced("hybrid_search")
+async def hybrid_search(query_text: str, limit: int = 5, timings: dict = None, vector: list = None):
+    """
+    Combines Vector Search + BM25 using Reciprocal Rank Fusion (RRF).
+    Both branches run concurrently, so retrieval costs max(vector, bm25) instead of the sum.
+    Pass `timings` (a dict) to receive per-branch latencies in ms,
+    and `vector` to reuse an already computed (or in-flight, as a task) query embedding.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    # 1. Vector (embedding I/O + ANN) and 2. BM25 (CPU, off the event loop) at the same time
+    vector_results, bm25_results = await asyncio.gather(
+        _run_branch("vector", query_vector_db(query_text, limit=20, vector=vector), Config.VECTOR_BRANCH_TIMEOUT, timings), # Get more for fusion
+        _run_branch("bm25", loop.run_in_executor(get_retrieval_executor(), bind_context(bm25_search), query_text, 20), Config.BM25_BRANCH_TIMEOUT, timings)
+    )
+
+    # 3. RRF Fusion
+    final_results = _rrf_fuse(vector_results, bm25_results, limit)
+    timings["hybrid_ms"] = (time.perf_counter() - start) * 1000
+    return final_results
+
+@traced("hybrid_search_batch")
+async def hybrid_search_batch(query_texts: list, vectors: list, limit: int = 5, timings: dict = None):
+    """
+    hybrid_search for a batch of queries with precomputed embeddings.
+    One Qdrant batch request and one BM25 batch scoring run concurrently; each branch
+    gets its single-query timeout scaled by the batch size.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    scale = max(1, len(query_texts))
+
+    vector_results, bm25_results = await asyncio.gather(
+        _run_branch("vector", query_vector_db_batch(vectors, limit=20), Config.VECTOR_BRANCH_TIMEOUT * scale, timings),
+        _run_branch("bm25", loop.run_in_executor(get_retrieval_executor(), bind_context(bm25_search_batch), query_texts, 20), Config.BM25_BRANCH_TIMEOUT * scale, timings)
+    )
+    # A timed-out branch returns [] for the whole batch
+    vector_results = vector_results or [[] for _ in query_texts]
+    bm25_results = bm25_results or [[] for _ in query_texts]
+
+    final_results = [_rrf_fuse(v, b, limit) for v, b in zip(vector_results, bm25_results)]
+    timings["hybrid_ms"] = (time.perf_counter() - start) * 1000
+    return final_results
+
+@traced("rerank_results")
 async def rerank_results(query: str, chunks: list, top_k: int = 3):
     """
     Re-ranks chunks using CrossEncoder.
+    Scoring goes through the rerank service: off the event loop, micro-batched with concurrent requests.
     """
-    reranker = load_reranker()
-    if not reranker or not chunks:
+    service = get_rerank_service()
+    if not service.available:
+        await service.start() # No-op once the lifespan started it; lazy path for scripts (eval.py)
+    if not service.available or not chunks:
         return chunks[:top_k]
         
     try:
         pairs = [[query, chunk['payload']['content']] for chunk in chunks]
-        scores = reranker.predict(pairs)
+        scores = await service.score(pairs)
         
         # Attach new scores
         for i, chunk in enumerate(chunks):
-            chunk["rerank_score"] = float(scores[i])
+            chunk["rerank_score"] = scores[i]
             
         # Resort
         reranked = sorted(chunks, key=lambda x: x["rerank_score"], reverse=True)
         return reranked[:top_k]
     except Exception as e:
-        print(f" [Rerank Error] {e}")
+        logger.warning("Reranking failed, keeping fusion order", extra={"fields": {"error": str(e)}})
         return chunks[:top_k]
+
+@traced("rerank_results_batch")
+async def rerank_results_batch(queries: list, chunk_lists: list, top_k: int = 3):
+    """rerank_results for a batch: every (query, chunk) pair goes to the CrossEncoder in a single call."""
+    service = get_rerank_service()
+    if not service.available:
+        await service.start()
+    if not service.available:
+        return [chunks[:top_k] for chunks in chunk_lists]
+
+    try:
+        pairs = [[query, chunk['payload']['content']] for query, chunks in zip(queries, chunk_lists) for chunk in chunks]
+        scores = await service.score(pairs)
+
+        reranked, offset = [], 0
+        for chunks in chunk_lists:
+            for chunk, score in zip(chunks, scores[offset:offset + len(chunks)]):
+                chunk["rerank_score"] = score
+            offset += len(chunks)
+            reranked.append(sorted(chunks, key=lambda x: x["rerank_score"], reverse=True)[:top_k])
+        return reranked
+    except Exception as e:
+        logger.warning("Reranking failed, keeping fusion order", extra={"fields": {"error": str(e)}})
+        return [chunks[:top_k] for chunks in chunk_lists]
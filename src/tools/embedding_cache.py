@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from cachetools import LRUCache
+from src.config import Config
+
+try:
+    import fcntl  # Serializes disk writes between uvicorn workers (POSIX only)
+except ImportError:
+    fcntl = None
+
+# Process-wide singleton, see get_embedding_cache()
+EMBEDDING_CACHE = None
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache shared by ingestion and query time.
+    Tier 1: in-memory LRU of float32 vectors.
+    Tier 2: fixed-capacity ring of float16 rows in a memory-mapped file, one directory per model.
+            When the ring is full the oldest slot is overwritten (size-bounded, no compaction).
+    Keys are sha1(model, prompt prefix, text).
+    """
+
+    def __init__(self, directory: str, model: str, capacity: int, memory_items: int):
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self.directory = os.path.join(directory, safe_model)
+        self.model = model
+        self.capacity = capacity
+        self.memory = LRUCache(maxsize=memory_items)
+        self.hits = 0
+        self.misses = 0
+        self._memory_lock = threading.Lock()  # LRU only: held for dict operations, never for I/O
+        self._lock = threading.Lock()         # disk tier: memmaps, slot index, replay
+        # Disk tier is opened on first write when the dimension is known
+        self.dim = None
+        self._vectors = None
+        self._keys = None
+        self._cursor = None
+        self._slots = {}       # digest -> slot, for the rows indexed so far
+        self._slot_keys = {}   # slot -> digest, to drop a key when its slot is recycled
+        self._indexed = 0      # ring cursor up to which rows are indexed
+        self._load()
+
+    def key(self, text: str, prefix: str = "") -> bytes:
+        # Hex rather than raw digest: fixed-width "S" arrays strip trailing NUL bytes
+        return hashlib.sha1(f"{self.model}\x00{prefix}\x00{text}".encode("utf-8")).hexdigest().encode("ascii")
+
+    # --- disk tier -------------------------------------------------------
+    # Every worker maps the same files. Writers serialize on write.lock; the shared cursor
+    # is the log of what was written, so a reader indexes other workers' rows by catching
+    # up from its own cursor (see _sync) instead of rescanning every key.
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path("meta.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self):
+        """Maps an existing disk tier; meta.json is written last, so its files are complete."""
+        meta = self._read_meta()
+        if meta is None or meta.get("capacity") != self.capacity:
+            return # Missing or resized: the first write (re)creates it
+        self._map(meta["dim"])
+
+    def _map(self, dim: int):
+        self.dim = dim
+        self._vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r+", shape=(self.capacity, dim))
+        self._keys = np.memmap(self._path("keys.bin"), dtype="S40", mode="r+", shape=(self.capacity,))
+        self._cursor = np.memmap(self._path("cursor.i64"), dtype=np.int64, mode="r+", shape=(1,))
+        self._slots, self._slot_keys, self._indexed = {}, {}, 0
+        self._sync()
+
+    def _create(self, dim: int):
+        """
+        Called under write.lock. Files are created with O_CREAT and no O_TRUNC, so a worker
+        racing on the same directory can never truncate rows another one already wrote;
+        they are only reset when the existing tier has another shape.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        meta = self._read_meta()
+        reset = meta is not None and (meta.get("capacity"), meta.get("dim")) != (self.capacity, dim)
+        if meta is None or reset:
+            for name, nbytes in (("vectors.f16", self.capacity * dim * 2),
+                                 ("keys.bin", self.capacity * 40),
+                                 ("cursor.i64", 8)):
+                fd = os.open(self._path(name), os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if reset:
+                        os.ftruncate(fd, 0)
+                    os.ftruncate(fd, nbytes)
+                finally:
+                    os.close(fd)
+            tmp_path = self._path(f"meta.json.{os.getpid()}")
+            with open(tmp_path, "w") as f:
+                json.dump({"model": self.model, "dim": dim, "capacity": self.capacity}, f)
+            os.replace(tmp_path, self._path("meta.json"))
+        self._map(dim)
+
+    def _sync(self):
+        """Indexes the rows written (by any worker) since the last call."""
+        cursor = int(self._cursor[0])
+        if cursor == self._indexed:
+            return
+        start = max(self._indexed, cursor - self.capacity)
+        if cursor < self._indexed or cursor - self._indexed >= self.capacity:
+            self._slots, self._slot_keys = {}, {}  # Whole ring rewritten (or reset): reindex
+            start = max(0, cursor - self.capacity)
+        for position in range(start, cursor):
+            slot = position % self.capacity
+            old = self._slot_keys.pop(slot, None)
+            if old is not None and self._slots.get(old) == slot:
+                del self._slots[old]
+            digest = bytes(self._keys[slot])
+            if digest:
+                self._slots[digest] = slot
+                self._slot_keys[slot] = digest
+        self._indexed = cursor
+
+    def _read_disk(self, digest: bytes):
+        slot = self._slots.get(digest)
+        if slot is None:
+            self._sync()  # Another worker may have embedded it since
+            slot = self._slots.get(digest)
+            if slot is None:
+                return None
+        vector = np.array(self._vectors[slot], dtype=np.float32)
+        # Another worker may have recycled the slot since we indexed it
+        if self._keys[slot] != digest:
+            self._slots.pop(digest, None)
+            return None
+        return vector
+
+    def _write_disk(self, items: list):
+        """Blocking (flock + page writes): called from put_many, off the event loop."""
+        lock_file = None
+        if fcntl:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_file = open(self._path("write.lock"), "a")
+        try:
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Outside self._lock: other threads don't wait on it
+            with self._lock:
+                if self._vectors is None:
+                    self._create(len(items[0][1]))
+                if len(items[0][1]) != self.dim:
+                    return # Model changed shape under the same name; keep it memory-only
+                self._sync()
+                cursor = int(self._cursor[0])
+                for digest, vector in items:
+                    if digest in self._slots:
+                        continue
+                    slot = cursor % self.capacity
+                    self._keys[slot] = b"" # Invalidate before the vector changes under readers
+                    self._vectors[slot] = vector
+                    self._keys[slot] = digest
+                    cursor += 1
+                self._cursor[0] = cursor
+                self._sync()
+        finally:
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    # --- public API ------------------------------------------------------
+    def get_memory(self, texts: list, prefix: str = ""):
+        """
+        In-memory tier only: one vector or None per text. Never touches the disk or the
+        disk lock, so it is safe on the event loop; misses are counted by get_many.
+        """
+        results = []
+        with self._memory_lock:
+            for text in texts:
+                vector = self.memory.get(self.key(text, prefix))
+                if vector is not None:
+                    self.hits += 1
+                results.append(None if vector is None else vector.tolist())
+        return results
+
+    def get_many(self, texts: list, prefix: str = ""):
+        """
+        Returns one vector (list of floats) or None per text. Blocking (memmap reads, and
+        replaying rows other workers wrote): the async callers run it in a worker thread.
+        """
+        results, found = [], {}
+        with self._memory_lock:
+            digests = [self.key(text, prefix) for text in texts]
+            vectors = [self.memory.get(digest) for digest in digests]
+        if any(vector is None for vector in vectors):
+            with self._lock:
+                if self._vectors is None:
+                    self._load()  # Another worker may have created the disk tier
+                if self._vectors is not None:
+                    for digest, vector in zip(digests, vectors):
+                        if vector is None and digest not in found:
+                            found[digest] = self._read_disk(digest)
+        with self._memory_lock:
+            for digest, vector in zip(digests, vectors):
+                if vector is None:
+                    vector = found.get(digest)
+                    if vector is not None:
+                        self.memory[digest] = vector
+                if vector is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(vector.tolist())
+        return results
+
+    def put_many(self, texts: list, vectors: list, prefix: str = ""):
+        """Blocking: the async callers run it through asyncio.to_thread."""
+        if not texts:
+            return
+        items = []
+        with self._memory_lock:
+            for text, vector in zip(texts, vectors):
+                digest = self.key(text, prefix)
+                vector = np.asarray(vector, dtype=np.float32)
+                self.memory[digest] = vector
+                items.append((digest, vector))
+        self._write_disk(items)
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._keys.flush()
+                self._cursor.flush()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self.memory),
+            "disk_items": len(self._slots)
+        }
+
+
+def get_embedding_cache():
+    """Returns the shared cache, or None when disabled."""
+    global EMBEDDING_CACHE
+    if not Config.EMBEDDING_CACHE_ENABLED:
+        return None
+    if EMBEDDING_CACHE is None:
+        EMBEDDING_CACHE = EmbeddingCache(
+            directory=Config.EMBEDDING_CACHE_DIR,
+            model=Config.EMBEDDING_MODEL,
+            capacity=Config.EMBEDDING_CACHE_CAPACITY,
+            memory_items=Config.EMBEDDING_CACHE_MEMORY_ITEMS
+        )
+    return EMBEDDING_CACHE
+
+
+def close_embedding_cache():
+    global EMBEDDING_CACHE
+    if EMBEDDING_CACHE is not None:
+        EMBEDDING_CACHE.flush()
+        EMBEDDING_CACHE = None
@@ -0,0 +1,67 @@
+import asyncio
+import httpx
+from src.config import Config
+from src.tools.http_client import get_http_client
+from src.tools.embedding_cache import get_embedding_cache
+
+
+class EmbeddingError(Exception):
+    """Raised when Ollama could not embed a batch after all retries."""
+
+
+async def embed_batch(texts: list, prefix: str = "", timeout: float = None, retries: int = None):
+    """
+    Embeds a list of texts, serving repeats from the embedding cache.
+    Misses go to Ollama in ONE call (/api/embed accepts a list of inputs).
+    """
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        return await _request_embeddings(texts, prefix, timeout, retries)
+
+    vectors = cache.get_memory(texts, prefix)
+    if any(vector is None for vector in vectors):
+        # The disk tier may wait on another thread's write or replay: never on the loop
+        looked_up = iter(await asyncio.to_thread(
+            cache.get_many, [text for text, vector in zip(texts, vectors) if vector is None], prefix
+        ))
+        vectors = [next(looked_up) if vector is None else vector for vector in vectors]
+    # dict.fromkeys dedupes while keeping order, repeated texts are embedded once
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        fresh = await _request_embeddings(missing, prefix, timeout, retries)
+        await asyncio.to_thread(cache.put_many, missing, fresh, prefix)  # flock + memmap writes
+        fresh_by_text = dict(zip(missing, fresh))
+        vectors = [fresh_by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+    return vectors
+
+
+async def _request_embeddings(texts: list, prefix: str, timeout: float = None, retries: int = None):
+    """
+    Retries with exponential backoff instead of returning dummy vectors,
+    a zero vector would silently poison the collection.
+    """
+    timeout = timeout or Config.EMBEDDING_TIMEOUT
+    retries = Config.EMBEDDING_RETRIES if retries is None else retries
+    payload = {
+        "model": Config.EMBEDDING_MODEL,
+        "input": [f"{prefix}{text}" for text in texts]
+    }
+
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            client = get_http_client("ollama")
+            response = await client.post("/api/embed", json=payload, timeout=timeout)
+            response.raise_for_status()
+            vectors = response.json().get("embeddings") or []
+            if len(vectors) != len(texts):
+                raise EmbeddingError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+            return vectors
+        except (httpx.HTTPError, EmbeddingError, ValueError) as e:
+            last_error = e
+            if attempt < retries:
+                await asyncio.sleep(Config.EMBEDDING_RETRY_BACKOFF * (2 ** attempt))
+
+    raise EmbeddingError(f"Embedding failed after {retries + 1} attempts: {last_error}")
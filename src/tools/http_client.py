@@ -0,0 +1,78 @@
+import asyncio
+import httpx
+from src.config import Config
+from src.log import get_logger, REQUEST_ID
+
+logger = get_logger("http_client")
+
+# One keep-alive pool per upstream, created lazily and closed in the app lifespan
+# name -> (client, event loop it was created on)
+HTTP_POOLS = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx needs the optional h2 package for HTTP/2)
+        return True
+    except ImportError:
+        return False
+
+
+def _upstreams():
+    """Base URL and HTTP/2 preference for every upstream we talk to."""
+    return {
+        "ollama": (Config.OLLAMA_BASE_URL, Config.OLLAMA_HTTP2),
+        "patient_api": (Config.BAD_API_ENDPOINT, Config.PATIENT_API_HTTP2),
+    }
+
+
+async def _forward_request_id(request: httpx.Request):
+    """Propagates the correlation ID so upstream logs can be joined with ours."""
+    request_id = REQUEST_ID.get()
+    if request_id != "-":
+        request.headers["X-Request-ID"] = request_id
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    base_url, http2 = _upstreams()[name]
+    if http2 and not _http2_available():
+        logger.warning("h2 not installed, pool falls back to HTTP/1.1", extra={"fields": {"upstream": name}})
+        http2 = False
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(Config.HTTP_DEFAULT_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [_forward_request_id]}
+    )
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """
+    Returns the shared client for an upstream ("ollama" or "patient_api").
+    Call sites pass their own per-request `timeout=`; the pool default is only a backstop.
+    """
+    loop = asyncio.get_running_loop()
+    entry = HTTP_POOLS.get(name)
+    if entry is None or entry[1] is not loop or entry[0].is_closed:
+        # Connections are bound to the loop that opened them (scripts may call asyncio.run twice)
+        entry = (_build_client(name), loop)
+        HTTP_POOLS[name] = entry
+    return entry[0]
+
+
+async def open_http_clients():
+    """Warms every pool at startup so the first request doesn't pay for client creation."""
+    for name in _upstreams():
+        get_http_client(name)
+
+
+async def close_http_clients():
+    for name, (client, loop) in list(HTTP_POOLS.items()):
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
+        HTTP_POOLS.pop(name, None)
@@ -0,0 +1,249 @@
+import os
+import json
+import shutil
+import asyncio
+from collections import namedtuple
+import numpy as np
+from src.config import Config
+from src.tools.bm25 import IncompatibleIndexError, _write_blob, _open_blob
+from src.tools.quantization import truncate_vector
+from src.log import get_logger
+
+logger = get_logger("numpy_store")
+
+FORMAT_NAME = "healthcare-ai-vectors"
+FORMAT_VERSION = 1
+
+# Same fields as a Qdrant ScoredPoint, so callers don't care which backend answered
+Hit = namedtuple("Hit", ["id", "score", "payload"])
+
+# Rows widened per block when scoring float16 rows (BLAS has no float16 kernels); keeps the
+# float32 copy cache-sized instead of materializing the whole matrix
+_BLOCK_ROWS = 8192
+
+
+def _decode_json(raw: bytes):
+    return json.loads(raw)
+
+
+def _encode_json(item) -> bytes:
+    return json.dumps(item, ensure_ascii=False).encode("utf-8")
+
+
+class NumpyVectorIndex:
+    """
+    Normalized embeddings in one memory-mapped (n, d) matrix; ids and payloads in blobs
+    read lazily by offset (same layout as the BM25 documents).
+    Exact mode: cosine = one matrix product over all rows, top-k via argpartition.
+    IVF mode: rows are stored grouped by k-means list, a query scores the centroids and
+    then only the contiguous row ranges of its `nprobe` closest lists.
+    """
+
+    def __init__(self, vectors, ids, payloads, centroids=None, list_indptr=None):
+        self.vectors = vectors
+        self.ids = ids
+        self.payloads = payloads
+        self.centroids = centroids
+        self.list_indptr = list_indptr
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, ids: list, vectors, payloads: list, dtype: str = "float32", ivf_lists: int = 0,
+              iterations: int = 10, seed: int = 0):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        centroids = list_indptr = None
+        if ivf_lists and len(matrix) > ivf_lists:
+            centroids, assignment = _spherical_kmeans(matrix, ivf_lists, iterations, seed)
+            order = np.argsort(assignment, kind="stable")
+            matrix = matrix[order]
+            ids = [ids[i] for i in order]
+            payloads = [payloads[i] for i in order]
+            list_indptr = np.zeros(ivf_lists + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignment, minlength=ivf_lists), out=list_indptr[1:])
+        return cls(matrix.astype(dtype), list(ids), list(payloads), centroids, list_indptr)
+
+    def _scores(self, queries: np.ndarray, start: int = 0, stop: int = None) -> np.ndarray:
+        """(rows, queries) cosine scores for rows[start:stop]."""
+        rows = self.vectors[start:stop]
+        if rows.dtype == np.float32:
+            return rows @ queries.T  # a single sgemm/sgemv
+        # float16 (NUMPY_INDEX_DTYPE) trades latency for RAM: each block is widened before the product
+        blocks = [
+            rows[i:i + _BLOCK_ROWS].astype(np.float32) @ queries.T
+            for i in range(0, rows.shape[0], _BLOCK_ROWS)
+        ]
+        return np.concatenate(blocks) if blocks else np.zeros((0, len(queries)), dtype=np.float32)
+
+    def _hits(self, rows: np.ndarray, scores: np.ndarray, limit: int) -> list:
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [Hit(self.ids[int(rows[i])], float(scores[i]), self.payloads[int(rows[i])]) for i in top]
+
+    def search_batch(self, vectors: list, limit: int = 10, nprobe: int = None) -> list:
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if self.centroids is None:
+            scores = self._scores(queries)  # every query in the same matrix product
+            rows = np.arange(len(self))
+            return [self._hits(rows, scores[:, q], limit) for q in range(len(queries))]
+        return [self._search_ivf(query, limit, nprobe or Config.NUMPY_IVF_NPROBE) for query in queries]
+
+    def search(self, vector: list, limit: int = 10, nprobe: int = None) -> list:
+        return self.search_batch([vector], limit, nprobe)[0]
+
+    def _search_ivf(self, query: np.ndarray, limit: int, nprobe: int) -> list:
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([
+            np.arange(self.list_indptr[l], self.list_indptr[l + 1]) for l in probed
+        ])
+        scores = np.concatenate([
+            self._scores(query[None], self.list_indptr[l], self.list_indptr[l + 1])[:, 0] for l in probed
+        ])
+        return self._hits(rows, scores, limit)
+
+    # --- persistence -----------------------------------------------------
+    # Layout of an index directory:
+    #   header.json                 format version, sizes, dtype, IVF lists
+    #   vectors.npy                 (n, d) normalized rows, memory-mapped
+    #   centroids/list_indptr.npy   IVF only: list centroids and row ranges
+    #   ids.bin + payloads.bin      one JSON value per row (+ _offsets.npy)
+    def save(self, directory: str):
+        """Writes to a fresh directory and swaps it in, readers never see a partial index."""
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), np.asarray(self.vectors))
+        if self.centroids is not None:
+            np.save(os.path.join(tmp_dir, "centroids.npy"), self.centroids)
+            np.save(os.path.join(tmp_dir, "list_indptr.npy"), self.list_indptr)
+        _write_blob(os.path.join(tmp_dir, "ids"), list(self.ids), _encode_json)
+        _write_blob(os.path.join(tmp_dir, "payloads"), list(self.payloads), _encode_json)
+        header = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "n_vectors": len(self),
+            "dim": self.dim,
+            "dtype": str(self.vectors.dtype),
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids)
+        }
+        with open(os.path.join(tmp_dir, "header.json"), "w") as f:
+            json.dump(header, f, indent=1)
+
+        old_dir = f"{directory}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str):
+        with open(os.path.join(directory, "header.json"), "r") as f:
+            header = json.load(f)
+        if header.get("format") != FORMAT_NAME or header.get("format_version") != FORMAT_VERSION:
+            raise IncompatibleIndexError(f"{directory}: not a {FORMAT_NAME} v{FORMAT_VERSION} index")
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        ids = _open_blob(os.path.join(directory, "ids"), _decode_json)
+        payloads = _open_blob(os.path.join(directory, "payloads"), _decode_json)
+        if not (len(vectors) == len(ids) == len(payloads) == header["n_vectors"]):
+            raise IncompatibleIndexError(f"{directory}: size mismatch with header ({header['n_vectors']})")
+        centroids = list_indptr = None
+        if header["ivf_lists"]:
+            centroids = np.load(os.path.join(directory, "centroids.npy"))
+            list_indptr = np.load(os.path.join(directory, "list_indptr.npy"))
+        return cls(vectors, ids, payloads, centroids, list_indptr)
+
+
+def _spherical_kmeans(matrix: np.ndarray, lists: int, iterations: int, seed: int):
+    """Lloyd iterations on the unit sphere (cosine); empty lists are re-seeded from random rows."""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, matrix)
+        counts = np.bincount(assignment, minlength=lists)
+        empty = counts == 0
+        sums[empty] = matrix[rng.choice(len(matrix), int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids, np.argmax(matrix @ centroids.T, axis=1)
+
+
+class NumpyVectorStore:
+    """
+    In-process vector search backend, one NumpyVectorIndex per collection under
+    NUMPY_INDEX_PATH. Same search/asearch(_batch) surface as VectorStore; no lock needed
+    (read-only arrays), and numpy releases the GIL inside the matrix products.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.NUMPY_INDEX_PATH
+        self.indexes = {}
+
+    def open(self):
+        if os.path.isdir(self.path):
+            for name in sorted(os.listdir(self.path)):
+                if os.path.isfile(os.path.join(self.path, name, "header.json")):
+                    self.indexes[name] = NumpyVectorIndex.load(os.path.join(self.path, name))
+        return self
+
+    def _index(self, collection_name: str) -> NumpyVectorIndex:
+        index = self.indexes.get(collection_name)
+        if index is None:
+            raise KeyError(f"No vector index for {collection_name} in {self.path} (run the ingestion with VECTOR_BACKEND=numpy)")
+        return index
+
+    def search(self, vector: list, collection_name: str = "medical_docs", limit: int = 10):
+        return self._index(collection_name).search(truncate_vector(vector), limit)
+
+    async def asearch(self, vector: list, collection_name: str = "medical_docs", limit: int = 10):
+        return await asyncio.to_thread(self.search, vector, collection_name, limit)
+
+    def search_batch(self, vectors: list, collection_name: str = "medical_docs", limit: int = 10):
+        return self._index(collection_name).search_batch([truncate_vector(v) for v in vectors], limit)
+
+    async def asearch_batch(self, vectors: list, collection_name: str = "medical_docs", limit: int = 10):
+        return await asyncio.to_thread(self.search_batch, vectors, collection_name, limit)
+
+    def write(self, collection_name: str, index: NumpyVectorIndex):
+        os.makedirs(self.path, exist_ok=True)
+        index.save(os.path.join(self.path, collection_name))
+
+    def close(self):
+        self.indexes = {}
+
+
+# Process-wide singleton (opened in the FastAPI lifespan when VECTOR_BACKEND=numpy)
+NUMPY_STORE = None
+
+
+def open_numpy_store() -> NumpyVectorStore:
+    global NUMPY_STORE
+    if NUMPY_STORE is None:
+        NUMPY_STORE = NumpyVectorStore().open()
+        logger.info("NumPy vector index opened", extra={"fields": {
+            "collections": {name: len(index) for name, index in NUMPY_STORE.indexes.items()}
+        }})
+    return NUMPY_STORE
+
+
+def get_numpy_store() -> NumpyVectorStore:
+    return NUMPY_STORE or open_numpy_store()
+
+
+def close_numpy_store():
+    global NUMPY_STORE
+    if NUMPY_STORE is not None:
+        NUMPY_STORE.close()
+        NUMPY_STORE = None
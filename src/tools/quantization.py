@@ -0,0 +1,89 @@
+import numpy as np
+from qdrant_client.http import models
+from src.config import Config
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+# Recorded in the ingestion manifest: vectors truncated another way must be re-embedded
+TRUNCATION = "layer_norm"
+_LAYER_NORM_EPS = 1e-5  # torch.nn.functional.layer_norm default
+
+
+def vector_dim(model_dim: int) -> int:
+    """Stored dimension: VECTOR_DIM when it truncates the model's output, else the full size."""
+    if Config.VECTOR_DIM and Config.VECTOR_DIM < model_dim:
+        return Config.VECTOR_DIM
+    return model_dim
+
+
+def truncate_vectors(vectors, dim: int = None) -> np.ndarray:
+    """
+    Matryoshka truncation as nomic-embed-text v1.5 specifies it: layer norm over the full
+    vector (no affine), keep the leading `dim` components, then L2-normalize.
+    MRL-trained models put the most information first, so 256-512 dims keep most of the
+    retrieval quality at a fraction of the size; slicing the raw output instead skews them.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    dim = dim or Config.VECTOR_DIM
+    if not dim or dim >= matrix.shape[-1]:
+        return matrix
+    mean = matrix.mean(axis=-1, keepdims=True)
+    variance = matrix.var(axis=-1, keepdims=True)
+    truncated = ((matrix - mean) / np.sqrt(variance + _LAYER_NORM_EPS))[..., :dim]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.maximum(norms, 1e-12)
+
+
+def truncate_vector(vector: list, dim: int = None) -> list:
+    """Query-side truncate_vectors (must match what ingestion stored)."""
+    dim = dim or Config.VECTOR_DIM
+    if not dim or dim >= len(vector):
+        return vector
+    return truncate_vectors(vector, dim).tolist()
+
+
+def quantization_config(mode: str = None):
+    """Collection-level quantization for Qdrant (server mode; embedded mode ignores it)."""
+    mode = (mode or Config.VECTOR_QUANTIZATION).lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"VECTOR_QUANTIZATION must be one of {QUANTIZATION_MODES}, got {mode!r}")
+    if mode == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=0.99,  # clip outliers so the int8 range covers the bulk of the values
+            always_ram=Config.QUANTIZATION_ALWAYS_RAM
+        ))
+    if mode == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(
+            always_ram=Config.QUANTIZATION_ALWAYS_RAM
+        ))
+    return None
+
+
+def hnsw_config() -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(m=Config.HNSW_M, ef_construct=Config.HNSW_EF_CONSTRUCT)
+
+
+def search_params(mode: str = None, oversampling: float = None) -> models.SearchParams:
+    """
+    Query-time settings: HNSW beam width, and for quantized collections how many
+    candidates (limit x oversampling) are re-scored with the original vectors.
+    """
+    mode = (mode or Config.VECTOR_QUANTIZATION).lower()
+    quantization = None
+    if mode != "none":
+        quantization = models.QuantizationSearchParams(
+            rescore=Config.QUANTIZATION_RESCORE,
+            oversampling=oversampling or Config.QUANTIZATION_OVERSAMPLING
+        )
+    return models.SearchParams(hnsw_ef=Config.HNSW_EF_SEARCH, quantization=quantization)
+
+
+def vectors_config(dim: int) -> models.VectorParams:
+    """Collection vectors: originals on disk when a quantized copy serves the first pass."""
+    quantized = Config.VECTOR_QUANTIZATION.lower() != "none"
+    return models.VectorParams(
+        size=dim,
+        distance=models.Distance.COSINE,
+        on_disk=quantized and Config.VECTORS_ON_DISK
+    )
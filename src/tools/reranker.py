@@ -0,0 +1,152 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from src.config import Config
+from src.log import get_logger
+
+logger = get_logger("reranker")
+
+# Process-wide singleton (started in the FastAPI lifespan, see main.py)
+RERANK_SERVICE = None
+
+
+class RerankService:
+    """
+    Owns the CrossEncoder.
+    - Loaded once at startup, not on the first query.
+    - Inference runs on a dedicated single-thread executor, never on the event loop.
+    - Pairs from concurrent requests are micro-batched into one forward pass: the first
+      request opens a window of RERANK_MAX_WAIT_MS, everything queued until then (up to
+      RERANK_MAX_BATCH_PAIRS pairs) is scored together.
+    """
+
+    def __init__(self, model_name: str, max_batch_pairs: int, max_wait_ms: float):
+        self.model_name = model_name
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000
+        self.model = None
+        self.load_failed = False
+        self.batches = 0
+        self.pairs_scored = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._queue = None
+        self._worker = None
+
+    def _load(self):
+        from sentence_transformers import CrossEncoder
+        # TinyBERT is super fast (10-20ms per doc)
+        return CrossEncoder(self.model_name)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.model is None:
+            if self.load_failed:
+                return # Don't retry a failed load on every query
+            try:
+                self.model = await loop.run_in_executor(self._executor, self._load)
+                logger.info("CrossEncoder loaded", extra={"fields": {"model": self.model_name}})
+            except Exception as e:
+                logger.error("Failed to load CrossEncoder, reranking disabled", extra={"fields": {"model": self.model_name, "error": str(e)}})
+                self.load_failed = True
+                return
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None and self._worker is not None and not self._worker.done()
+
+    async def score(self, pairs: list) -> list:
+        """Scores [query, passage] pairs; resolves once the batch containing them has run."""
+        if not pairs:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((pairs, future))
+        return await future
+
+    async def _collect_batch(self):
+        pairs, future = await self._queue.get()
+        batch = [(pairs, future)]
+        size = len(pairs)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_pairs:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                pairs, future = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append((pairs, future))
+            size += len(pairs)
+        return batch
+
+    def _predict(self, pairs: list):
+        # One call; large batch requests (/api/ask/batch) are chunked to bound activation memory
+        return self.model.predict(pairs, batch_size=min(len(pairs), self.max_batch_pairs), show_progress_bar=False)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Requests that gave up while waiting (client disconnect, timeout) are dropped
+            batch = [(pairs, future) for pairs, future in batch if not future.done()]
+            if not batch:
+                continue
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            try:
+                scores = await loop.run_in_executor(self._executor, self._predict, all_pairs)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.pairs_scored += len(all_pairs)
+            offset = 0
+            for pairs, future in batch:
+                if not future.done():
+                    future.set_result([float(s) for s in scores[offset:offset + len(pairs)]])
+                offset += len(pairs)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "pairs_scored": self.pairs_scored,
+            "avg_batch_pairs": self.pairs_scored / self.batches if self.batches else 0.0
+        }
+
+
+def get_rerank_service() -> RerankService:
+    global RERANK_SERVICE
+    if RERANK_SERVICE is None:
+        RERANK_SERVICE = RerankService(
+            model_name=Config.RERANKER_MODEL,
+            max_batch_pairs=Config.RERANK_MAX_BATCH_PAIRS,
+            max_wait_ms=Config.RERANK_MAX_WAIT_MS
+        )
+    return RERANK_SERVICE
+
+
+async def start_rerank_service() -> RerankService:
+    service = get_rerank_service()
+    await service.start()
+    return service
+
+
+async def stop_rerank_service():
+    global RERANK_SERVICE
+    if RERANK_SERVICE is not None:
+        await RERANK_SERVICE.stop()
+        RERANK_SERVICE = None
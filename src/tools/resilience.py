@@ -0,0 +1,264 @@
+import time
+import asyncio
+from collections import deque
+import httpx
+from src.log import get_logger
+
+logger = get_logger("resilience")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Every breaker / timeout by upstream name, rendered by render_prometheus()
+BREAKERS = {}
+TIMEOUTS = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when at least `min_calls` of the last `window` calls were made and
+    `failure_rate` of them failed. Open rejects every call for `cooldown` seconds, then
+    half-open lets a single probe through: success closes the breaker, failure re-opens it.
+    Event-loop only (no lock): every caller runs on the same loop.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 5,
+                 window: int = 20, cooldown: float = 10.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)  # True = failure
+        self.opened_at = 0.0
+        self._probing = False
+        self.counters = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+        BREAKERS[name] = self
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.counters["rejected"] += 1
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self.counters["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.counters["successes"] += 1
+        if self.state == HALF_OPEN:
+            self._probing = False
+            self.outcomes.clear()
+            self._transition(CLOSED)
+            return
+        self.outcomes.append(False)
+
+    def record_failure(self):
+        self.counters["failures"] += 1
+        if self.state == OPEN:
+            return  # A call that started before the breaker opened: already accounted for
+        if self.state == HALF_OPEN:
+            self._probing = False
+            self._open()
+            return
+        self.outcomes.append(True)
+        if len(self.outcomes) >= self.min_calls and \
+           sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+            self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.counters["opened"] += 1
+        self.outcomes.clear()
+        self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning("Circuit breaker state change", extra={"fields": {"upstream": self.name, "from": self.state, "to": state}})
+            self.state = state
+
+    def stats(self) -> dict:
+        return {"state": self.state, **self.counters}
+
+
+class AdaptiveTimeout:
+    """
+    Timeout derived from recent latencies: `multiplier` x the `percentile` latency,
+    clamped to [floor, ceiling]. Until `min_samples` latencies are in, the ceiling (the
+    old fixed timeout) applies. The hedge delay is the `hedge_percentile` latency: a
+    request slower than that is probably stuck in the tail.
+    A timed-out call is a sample too (its latency is at least the time waited), and each
+    timeout in a row doubles the timeout, so an upstream that got slower but still answers
+    under the ceiling is re-learned instead of timing out forever. The doubling is dropped
+    once a call succeeds within the learned timeout again.
+    """
+
+    def __init__(self, name: str, ceiling: float, floor: float = 0.1, percentile: float = 0.99,
+                 multiplier: float = 2.0, hedge_percentile: float = 0.95,
+                 window: int = 200, min_samples: int = 20):
+        self.name = name
+        self.ceiling = ceiling
+        self.floor = floor
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.backoff = 0  # timeouts in a row
+        self.counters = {"timeouts": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0}
+        TIMEOUTS[name] = self
+
+    def observe(self, seconds: float):
+        if self.backoff and seconds <= self._learned():
+            self.backoff = 0
+        self.samples.append(seconds)
+
+    def observe_timeout(self, seconds: float):
+        """A call given up after `seconds`: a lower bound on the upstream's latency."""
+        self.counters["timeouts"] += 1
+        self.backoff = min(self.backoff + 1, 16)
+        self.samples.append(seconds)
+
+    def _quantile(self, q: float):
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def _learned(self) -> float:
+        latency = self._quantile(self.percentile)
+        if latency is None:
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, latency * self.multiplier))
+
+    def current(self) -> float:
+        return min(self.ceiling, self._learned() * 2 ** self.backoff)
+
+    def hedge_delay(self):
+        """Seconds to wait before a hedged duplicate, None while there is no latency history."""
+        return self._quantile(self.hedge_percentile)
+
+    def stats(self) -> dict:
+        return {
+            "timeout_s": round(self.current(), 4),
+            "hedge_delay_s": None if self.hedge_delay() is None else round(self.hedge_delay(), 4),
+            "samples": len(self.samples),
+            "backoff": self.backoff,
+            **self.counters
+        }
+
+
+async def _limited(limit: asyncio.Semaphore, make_call, timeout: float):
+    async with limit:
+        return await make_call(timeout)
+
+
+async def _hedged(make_call, timeout: float, delay: float, latency: AdaptiveTimeout,
+                  limit: asyncio.Semaphore = None):
+    """
+    First successful result of the call and, if it is still running after `delay`, a duplicate.
+    The duplicate takes its own slot of `limit` and is skipped when none is free, so hedging
+    never pushes the upstream past its concurrency cap.
+    """
+    tasks = [asyncio.ensure_future(make_call(timeout))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and limit is not None and limit.locked():
+            latency.counters["hedges_skipped"] += 1
+        elif not done:
+            latency.counters["hedges"] += 1
+            duplicate = make_call(timeout - delay) if limit is None else _limited(limit, make_call, timeout - delay)
+            tasks.append(asyncio.ensure_future(duplicate))
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        latency.counters["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_upstream(breaker: CircuitBreaker, latency: AdaptiveTimeout, make_call,
+                        hedge: bool = False, is_failure=None, limit: asyncio.Semaphore = None):
+    """
+    Runs `make_call(timeout)` behind the breaker with the adaptive timeout, hedging it
+    when `hedge` is set (idempotent calls only). `limit` is the caller's concurrency cap
+    (the caller already holds one slot for the first call). Raises CircuitOpenError without calling
+    when the breaker is open. `is_failure(result)` marks results that count against the
+    upstream (e.g. 5xx responses); exceptions always do.
+    The half-open probe gets the ceiling timeout and no hedge: it decides whether the
+    breaker closes, so it must not fail only because the upstream got slower.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+
+    probe = breaker.state == HALF_OPEN
+    timeout = latency.ceiling if probe else latency.current()
+    delay = latency.hedge_delay() if hedge and not probe else None
+    start = time.perf_counter()
+    try:
+        if delay is not None and delay < timeout:
+            result = await asyncio.wait_for(_hedged(make_call, timeout, delay, latency, limit), timeout)
+        else:
+            result = await asyncio.wait_for(make_call(timeout), timeout)
+    except asyncio.CancelledError:
+        if breaker.state == HALF_OPEN:
+            breaker._probing = False  # Caller gave up on the probe: let the next call probe
+        raise
+    except Exception as e:
+        if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+            latency.observe_timeout(time.perf_counter() - start)
+        breaker.record_failure()
+        raise
+
+    if is_failure is not None and is_failure(result):
+        breaker.record_failure()
+    else:
+        latency.observe(time.perf_counter() - start)
+        breaker.record_success()
+    return result
+
+
+def render_prometheus() -> str:
+    """Breaker state and adaptive timeouts in Prometheus text format, appended to /metrics."""
+    lines = [
+        "# HELP healthcare_ai_circuit_state Circuit breaker state (0 closed, 1 half-open, 2 open).",
+        "# TYPE healthcare_ai_circuit_state gauge"
+    ]
+    for name, b in sorted(BREAKERS.items()):
+        lines.append(f'healthcare_ai_circuit_state{{upstream="{name}"}} {_STATE_VALUE[b.state]}')
+    for counter in ("opened", "rejected"):
+        lines += [
+            f"# HELP healthcare_ai_circuit_{counter}_total Circuit breaker {counter} count.",
+            f"# TYPE healthcare_ai_circuit_{counter}_total counter"
+        ]
+        for name, b in sorted(BREAKERS.items()):
+            lines.append(f'healthcare_ai_circuit_{counter}_total{{upstream="{name}"}} {b.counters[counter]}')
+    lines += [
+        "# HELP healthcare_ai_upstream_timeout_seconds Current adaptive timeout.",
+        "# TYPE healthcare_ai_upstream_timeout_seconds gauge"
+    ]
+    for name, t in sorted(TIMEOUTS.items()):
+        lines.append(f'healthcare_ai_upstream_timeout_seconds{{call="{name}"}} {t.current():.6f}')
+    for counter in ("timeouts", "hedges", "hedge_wins", "hedges_skipped"):
+        lines += [
+            f"# HELP healthcare_ai_upstream_{counter}_total Upstream calls: {counter.replace('_', ' ')}.",
+            f"# TYPE healthcare_ai_upstream_{counter}_total counter"
+        ]
+        for name, t in sorted(TIMEOUTS.items()):
+            lines.append(f'healthcare_ai_upstream_{counter}_total{{call="{name}"}} {t.counters[counter]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import duckdb
+from src.config import Config
+from src.tracing import bind_context
+from src.log import get_logger
+
+logger = get_logger("sql_store")
+
+# Process-wide singleton (opened in the FastAPI lifespan, see main.py); False = no database
+SQL_STORE = None
+
+
+class SQLStore:
+    """
+    Shared read-only handle on the DuckDB analytics file.
+    - One connection per process, opened read-only at startup (no per-query open, no write lock).
+    - One cursor per worker thread: DuckDB cursors are independent connections to the same
+      database, so queries from different threads run concurrently without a lock.
+    - Queries run on a dedicated pool, never on the event loop.
+    - Statements are parsed once per thread and reused (the Python API's prepared form);
+      parameters are bound at execution, never formatted into the SQL.
+    - Results are columnar and capped at SQL_MAX_ROWS: only max_rows + 1 rows are fetched.
+    """
+
+    def __init__(self, path: str = None, workers: int = None, statement_cache_size: int = None):
+        self.path = path or Config.SQL_DB_PATH
+        self.workers = workers or Config.SQL_WORKERS
+        self.statement_cache_size = statement_cache_size or Config.SQL_STATEMENT_CACHE_SIZE
+        self.conn = None
+        self.executor = None
+        self._local = threading.local()
+        self._cursors = []
+        self._cursors_lock = threading.Lock()
+        self.stats_counters = {"queries": 0, "statement_hits": 0, "statement_misses": 0, "truncated": 0}
+
+    def open(self):
+        self.conn = duckdb.connect(self.path, read_only=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sql")
+        return self
+
+    def _thread_state(self):
+        state = getattr(self._local, "state", None)
+        if state is None:
+            cursor = self.conn.cursor()
+            state = self._local.state = (cursor, OrderedDict())
+            with self._cursors_lock:
+                self._cursors.append(cursor)
+        return state
+
+    def _statement(self, cursor, statements: OrderedDict, sql: str):
+        """Parsed statement for this thread's cursor, LRU-cached by SQL text."""
+        statement = statements.get(sql)
+        if statement is not None:
+            statements.move_to_end(sql)
+            self.stats_counters["statement_hits"] += 1
+            return statement
+        self.stats_counters["statement_misses"] += 1
+        parsed = cursor.extract_statements(sql)
+        if len(parsed) != 1:
+            raise ValueError(f"Expected exactly one SQL statement, got {len(parsed)}")
+        statement = statements[sql] = parsed[0]
+        if len(statements) > self.statement_cache_size:
+            statements.popitem(last=False)
+        return statement
+
+    def query(self, sql: str, params=None, max_rows: int = None) -> dict:
+        """
+        Runs one read-only statement in the calling thread:
+        {"columns": [...], "data": {column: [values]}, "row_count": n, "truncated": bool}.
+        """
+        max_rows = max_rows or Config.SQL_MAX_ROWS
+        cursor, statements = self._thread_state()
+        self.stats_counters["queries"] += 1
+        cursor.execute(self._statement(cursor, statements, sql), params)
+        columns = [desc[0] for desc in cursor.description] if cursor.description else []
+        rows = cursor.fetchmany(max_rows + 1)
+        truncated = len(rows) > max_rows
+        if truncated:
+            rows = rows[:max_rows]
+            self.stats_counters["truncated"] += 1
+        values = list(zip(*rows)) if rows else [() for _ in columns]
+        return {
+            "columns": columns,
+            "data": {column: list(column_values) for column, column_values in zip(columns, values)},
+            "row_count": len(rows),
+            "truncated": truncated
+        }
+
+    async def aquery(self, sql: str, params=None, max_rows: int = None) -> dict:
+        """query() on the SQL pool so the event loop stays free."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, bind_context(self.query), sql, params, max_rows)
+
+    def stats(self) -> dict:
+        return {**self.stats_counters, "cursors": len(self._cursors), "workers": self.workers}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        with self._cursors_lock:
+            for cursor in self._cursors:
+                cursor.close()
+            self._cursors = []
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def open_sql_store():
+    """Opens the shared store (called at app startup); False when the database file is missing."""
+    global SQL_STORE
+    if SQL_STORE is None:
+        try:
+            SQL_STORE = SQLStore().open()
+            logger.info("SQL store opened", extra={"fields": {"path": SQL_STORE.path, "workers": SQL_STORE.workers}})
+        except duckdb.Error as e:
+            logger.warning("SQL database unavailable, SQL queries return no rows", extra={"fields": {"path": Config.SQL_DB_PATH, "error": str(e)}})
+            SQL_STORE = False # Don't retry on every query
+    return SQL_STORE
+
+
+def get_sql_store():
+    """Returns the shared store, opening it lazily for scripts that skip the app lifespan."""
+    return SQL_STORE if SQL_STORE is not None else open_sql_store()
+
+
+def close_sql_store():
+    global SQL_STORE
+    if SQL_STORE:
+        SQL_STORE.close()
+    SQL_STORE = None
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from contextlib import nullcontext
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from src.config import Config
+from src.tools.quantization import truncate_vector, search_params
+from src.log import get_logger
+
+logger = get_logger("vector_store")
+
+# Process-wide singleton (opened in the FastAPI lifespan, see main.py)
+VECTOR_STORE = None
+
+
+def connect_qdrant(path: str = None) -> QdrantClient:
+    """Client for the configured Qdrant: the server at QDRANT_URL, else the embedded store."""
+    if Config.QDRANT_URL:
+        return QdrantClient(url=Config.QDRANT_URL, api_key=Config.QDRANT_API_KEY)
+    return QdrantClient(path=path or Config.VECTOR_DB_PATH)
+
+
+class VectorStore:
+    """
+    Shared handle on the local Qdrant store (or a Qdrant server when QDRANT_URL is set).
+    Opening the on-disk store reloads every collection and takes the file lock,
+    so we do it once per process instead of once per query.
+    Query vectors are truncated to VECTOR_DIM like the stored ones (see quantization.py).
+    """
+
+    def __init__(self, path: str = None, in_memory: bool = False):
+        self.path = path or Config.VECTOR_DB_PATH
+        self.in_memory = in_memory
+        self.client = None
+        # Local mode is not safe for concurrent calls, searches go through this lock
+        # (a server handles concurrent requests itself)
+        self._lock = nullcontext() if Config.QDRANT_URL else threading.Lock()
+        # HNSW beam + quantization rescoring; embedded mode searches exactly and warns on them
+        self._params = search_params() if Config.QDRANT_URL else None
+
+    def open(self):
+        disk_client = connect_qdrant(self.path)
+        if not self.in_memory or Config.QDRANT_URL:
+            self.client = disk_client
+            return self
+
+        # RAM mode: copy every collection, then release the file lock so that
+        # offline ingestion can keep writing to the store while we serve.
+        self.client = QdrantClient(location=":memory:")
+        try:
+            for collection in disk_client.get_collections().collections:
+                self._copy_collection(disk_client, collection.name)
+        finally:
+            disk_client.close()
+        return self
+
+    def _copy_collection(self, source: QdrantClient, collection_name: str, batch_size: int = 256):
+        info = source.get_collection(collection_name)
+        self.client.create_collection(
+            collection_name=collection_name,
+            vectors_config=info.config.params.vectors
+        )
+        offset = None
+        while True:
+            records, offset = source.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            if records:
+                self.client.upsert(
+                    collection_name=collection_name,
+                    points=[models.PointStruct(id=r.id, vector=r.vector, payload=r.payload) for r in records]
+                )
+            if offset is None:
+                break
+        logger.info("Collection copied into RAM", extra={"fields": {"collection": collection_name, "points": self.client.count(collection_name).count}})
+
+    def search(self, vector: list, collection_name: str = "medical_docs", limit: int = 10):
+        with self._lock:
+            return self.client.query_points(
+                collection_name=collection_name,
+                query=truncate_vector(vector),
+                limit=limit,
+                search_params=self._params
+            ).points
+
+    async def asearch(self, vector: list, collection_name: str = "medical_docs", limit: int = 10):
+        """Runs the search in a worker thread so the event loop stays free."""
+        return await asyncio.to_thread(self.search, vector, collection_name, limit)
+
+    def search_batch(self, vectors: list, collection_name: str = "medical_docs", limit: int = 10):
+        """One query_batch_points call for many queries; returns one hit list per vector."""
+        requests = [
+            models.QueryRequest(query=truncate_vector(vector), limit=limit, with_payload=True, params=self._params)
+            for vector in vectors
+        ]
+        with self._lock:
+            responses = self.client.query_batch_points(collection_name=collection_name, requests=requests)
+        return [response.points for response in responses]
+
+    async def asearch_batch(self, vectors: list, collection_name: str = "medical_docs", limit: int = 10):
+        return await asyncio.to_thread(self.search_batch, vectors, collection_name, limit)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+def open_vector_store(in_memory: bool = None) -> VectorStore:
+    """Opens the shared store (called at app startup)."""
+    global VECTOR_STORE
+    if VECTOR_STORE is None:
+        if in_memory is None:
+            in_memory = Config.VECTOR_DB_IN_MEMORY
+        VECTOR_STORE = VectorStore(in_memory=in_memory).open()
+        mode = "server" if Config.QDRANT_URL else "RAM copy" if in_memory else "on-disk"
+        logger.info("Vector store opened", extra={"fields": {"mode": mode}})
+    return VECTOR_STORE
+
+
+def get_vector_store() -> VectorStore:
+    """Returns the shared store, opening it lazily for scripts that skip the app lifespan (eval.py)."""
+    return VECTOR_STORE or open_vector_store()
+
+
+def close_vector_store():
+    global VECTOR_STORE
+    if VECTOR_STORE is not None:
+        VECTOR_STORE.close()
+        VECTOR_STORE = None
+        logger.info("Vector store closed")
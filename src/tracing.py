@@ -0,0 +1,180 @@
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from src.config import Config
+
+# Histogram bucket upper bounds (seconds), Prometheus style
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Spans of the current request when a trace was requested (list), else None
+_TRACE = contextvars.ContextVar("trace", default=None)
+# Name of the innermost open span, recorded as the parent of nested spans
+_PARENT = contextvars.ContextVar("trace_parent", default=None)
+
+
+class StageHistogram:
+    """Cumulative-bucket latency histogram for one stage."""
+
+    __slots__ = ("counts", "sum", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+
+class Metrics:
+    """Process-wide stage histograms. Spans finish on the event loop and in worker threads, hence the lock."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram()
+            histogram.observe(seconds, error)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        name = "healthcare_ai_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Latency of each pipeline stage.",
+            f"# TYPE {name} histogram"
+        ]
+        errors = [
+            "# HELP healthcare_ai_stage_errors_total Stage executions that raised.",
+            "# TYPE healthcare_ai_stage_errors_total counter"
+        ]
+        with self._lock:
+            for stage, h in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+                errors.append(f'healthcare_ai_stage_errors_total{{stage="{stage}"}} {h.errors}')
+        return "\n".join(lines + errors) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _Span:
+    __slots__ = ("name", "start", "token", "parent")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.parent = _PARENT.get()
+        self.token = _PARENT.set(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _PARENT.reset(self.token)
+        METRICS.observe(self.name, end - self.start, error=exc_type is not None)
+        spans = _TRACE.get()
+        if spans is not None:
+            spans.append({
+                "stage": self.name,
+                "parent": self.parent,
+                "start_ms": (self.start - spans.origin) * 1000,
+                "duration_ms": (end - self.start) * 1000,
+                "error": exc_type.__name__ if exc_type is not None else None
+            })
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """
+    Times a pipeline stage: `with span("synthesis"): ...`.
+    Works in sync and async code; concurrent tasks each see their own parent span.
+    When TRACING_ENABLED is false this returns a shared no-op object (one attribute check).
+    """
+    if not Config.TRACING_ENABLED:
+        return _NOOP
+    return _Span(name)
+
+
+def traced(name: str):
+    """Decorator form of span() for coroutine functions."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not Config.TRACING_ENABLED:
+                return await fn(*args, **kwargs)
+            with _Span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _SpanList(list):
+    __slots__ = ("origin",)
+
+
+@contextmanager
+def collect_trace():
+    """
+    Records the spans of the enclosed request: `with collect_trace() as spans: ...`.
+    Spans from tasks started inside the block (asyncio.gather, to_thread) are included,
+    since they inherit the context.
+    """
+    spans = _SpanList()
+    spans.origin = time.perf_counter()
+    token = _TRACE.set(spans)
+    try:
+        yield spans
+    finally:
+        _TRACE.reset(token)
+
+
+def record(stage: str, seconds: float, error: bool = False):
+    """Adds a measurement taken by hand (for stages that span yields, e.g. streamed generation)."""
+    if Config.TRACING_ENABLED:
+        METRICS.observe(stage, seconds, error)
+
+
+def bind_context(fn):
+    """
+    Carries the current trace and request ID into loop.run_in_executor
+    (which, unlike to_thread, drops contextvars).
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
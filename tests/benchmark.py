@@ -0,0 +1,348 @@
+"""
+Load-testing benchmark for /api/ask.
+
+Closed loop: N concurrent clients, each sends its next question as soon as the previous answer arrives
+(measures latency at a given concurrency). Open loop: requests are fired on a fixed schedule at --rps
+whether or not earlier ones finished, and latency is measured from the *scheduled* send time, so a
+backed-up server shows up in the tail instead of silently lowering the offered load.
+
+    python tests/benchmark.py --mode closed --concurrency 8 --requests 200
+    python tests/benchmark.py --mode open --rps 20 --duration 30 --output runs/open20.json
+    python tests/benchmark.py --stub --mode closed --concurrency 16 --baseline runs/base.json
+
+--stub starts tests/stubs.py (fake Ollama + patient API) and launches the app against them,
+so the harness runs offline; accuracy is meaningless in that mode.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA_PATH = "data/raw/QA.csv"
+VALID_CHOICES = ["ก", "ข", "ค", "ง"]
+# Metrics compared against --baseline; True = higher is better
+DIFF_METRICS = {
+    "latency_ms.p50": False,
+    "latency_ms.p90": False,
+    "latency_ms.p99": False,
+    "latency_ms.max": False,
+    "throughput_rps": True,
+    "error_rate": False,
+    "accuracy": True,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Healthcare AI load benchmark")
+    parser.add_argument("--url", default="http://localhost:8000", help="App base URL")
+    parser.add_argument("--endpoint", default="/api/ask")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed loop: concurrent clients")
+    parser.add_argument("--rps", type=float, default=10.0, help="Open loop: offered requests per second")
+    parser.add_argument("--poisson", action="store_true", help="Open loop: exponential inter-arrival times")
+    parser.add_argument("--requests", type=int, default=None, help="Total requests (default: one pass over the questions)")
+    parser.add_argument("--duration", type=float, default=None, help="Stop issuing new requests after N seconds")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests sent first")
+    parser.add_argument("--max-questions", type=int, default=None, help="Use only the first N questions of QA.csv")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Client timeout per request (s)")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to diff against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit 1 if any diffed metric regresses by more than this percent")
+    parser.add_argument("--stub", action="store_true", help="Start stub upstreams and launch the app against them")
+    parser.add_argument("--app-port", type=int, default=8765, help="--stub: port for the launched app")
+    parser.add_argument("--embedding-dim", type=int, default=768, help="--stub: must match the Qdrant collection")
+    parser.add_argument("--stub-chat-latency-ms", type=float, default=None)
+    return parser.parse_args()
+
+
+def load_questions(path: str, limit: int = None):
+    """(question, expected) pairs from QA.csv; rows without an answer key are skipped."""
+    questions = []
+    with open(path, "r", encoding="utf-8-sig") as f:  # utf-8-sig handles the BOM
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Flexible key access (case-insensitive, stripped)
+            q_key = next((k for k in row if k and k.strip().lower() == "question"), None)
+            a_key = next((k for k in row if k and k.strip().lower() == "answer"), None)
+            if q_key and a_key and (row[a_key] or "").strip():
+                questions.append((row[q_key], row[a_key].strip()))
+    return questions[:limit] if limit else questions
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))  # ceil without floats drifting
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+        "min": values[0],
+    }
+
+
+async def send(client: httpx.AsyncClient, url: str, question: str, expected: str, scheduled: float = None):
+    """One request. Latency runs from `scheduled` (open loop) or from the actual send (closed loop)."""
+    sent = time.perf_counter()
+    start = scheduled if scheduled is not None else sent
+    record = {"expected": expected, "queued_ms": (sent - start) * 1000}
+    try:
+        response = await client.post(url, json={"question": question})
+        record["latency_ms"] = (time.perf_counter() - start) * 1000
+        record["status"] = response.status_code
+        if response.status_code == 200:
+            body = response.json()
+            answer = str(body.get("answer", "")).strip()
+            record["answer"] = answer
+            record["server_latency_ms"] = body.get("latency_ms")
+            record["cache"] = (body.get("timings") or {}).get("answer_cache")
+            record["correct"] = answer == expected
+        else:
+            record["error"] = f"HTTP {response.status_code}"
+    except httpx.HTTPError as e:
+        record["latency_ms"] = (time.perf_counter() - start) * 1000
+        record["status"] = None
+        record["error"] = type(e).__name__
+    return record
+
+
+def request_plan(questions: list, total: int, seed: int):
+    """Cycles through the questions (shuffled per pass); `total=None` never ends (use --duration)."""
+    rng = random.Random(seed)
+    issued = 0
+    while True:
+        batch = list(questions)
+        rng.shuffle(batch)
+        for item in batch:
+            if total is not None and issued >= total:
+                return
+            issued += 1
+            yield item
+
+
+async def run_closed_loop(client, url, plan, concurrency: int, duration: float = None):
+    records = []
+    cursor = iter(plan)
+    deadline = None if duration is None else time.perf_counter() + duration
+
+    async def worker():
+        for question, expected in cursor:  # Shared iterator: each item is taken by exactly one worker
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            records.append(await send(client, url, question, expected))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return records
+
+
+async def run_open_loop(client, url, plan, rps: float, poisson: bool, seed: int, duration: float = None):
+    rng = random.Random(seed)
+    tasks = []
+    start = time.perf_counter()
+    scheduled = start
+    for question, expected in plan:
+        if duration is not None and scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, url, question, expected, scheduled=scheduled)))
+        scheduled += rng.expovariate(rps) if poisson else 1.0 / rps
+    return await asyncio.gather(*tasks)
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    ok = [r for r in records if "error" not in r]
+    errors = [r for r in records if "error" in r]
+    error_kinds = {}
+    for r in errors:
+        error_kinds[r["error"]] = error_kinds.get(r["error"], 0) + 1
+    answered = [r for r in ok if r.get("answer") in VALID_CHOICES]
+    server = [r["server_latency_ms"] for r in ok if isinstance(r.get("server_latency_ms"), (int, float))]
+    return {
+        "requests": len(records),
+        "succeeded": len(ok),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(records) if records else 0.0,
+        "error_kinds": error_kinds,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": latency_summary([r["latency_ms"] for r in ok]),
+        "server_latency_ms": latency_summary(server),
+        "queued_ms": latency_summary([r["queued_ms"] for r in records]),
+        "accuracy": sum(r["correct"] for r in ok) / len(ok) if ok else 0.0,
+        "valid_choice_rate": len(answered) / len(ok) if ok else 0.0,
+        "cache_hits": sum(1 for r in ok if r.get("cache") == "hit"),
+    }
+
+
+def _lookup(report: dict, dotted: str):
+    value = report
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def diff_against_baseline(summary: dict, baseline: dict) -> dict:
+    """Per-metric {baseline, current, change_pct, regressed_pct}; regressed_pct > 0 means worse."""
+    diff = {}
+    for metric, higher_is_better in DIFF_METRICS.items():
+        before, after = _lookup(baseline, metric), _lookup(summary, metric)
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        change = ((after - before) / before * 100) if before else (0.0 if after == before else float("inf"))
+        diff[metric] = {
+            "baseline": before,
+            "current": after,
+            "change_pct": change,
+            "regressed_pct": -change if higher_is_better else change,
+        }
+    return diff
+
+
+def print_report(report: dict):
+    s = report["summary"]
+    lat = s["latency_ms"]
+    print("\n" + "=" * 44)
+    print(f" 📊 BENCHMARK REPORT ({report['config']['mode']} loop)")
+    print("=" * 44)
+    print(f"Requests:        {s['requests']} ({s['errors']} errors, {s['error_rate'] * 100:.2f}%)")
+    print(f"Throughput:      {s['throughput_rps']:.2f} req/s over {s['elapsed_s']:.1f}s")
+    if lat.get("count"):
+        print(f"Latency (ms):    p50 {lat['p50']:.0f} | p90 {lat['p90']:.0f} | p99 {lat['p99']:.0f} | max {lat['max']:.0f}")
+    print(f"Accuracy:        {s['accuracy'] * 100:.2f}% (valid choice {s['valid_choice_rate'] * 100:.1f}%)")
+    if s["error_kinds"]:
+        print(f"Errors:          {s['error_kinds']}")
+    for metric, d in report.get("baseline_diff", {}).items():
+        marker = "⚠️" if d["regressed_pct"] > 0 else "  "
+        print(f"{marker} {metric:<18} {d['baseline']:.4g} -> {d['current']:.4g} ({d['change_pct']:+.1f}%)")
+    print("=" * 44)
+
+
+def launch_app_with_stubs(args):
+    """Starts the stubs in-process and the app as a subprocess pointed at them."""
+    from tests.stubs import StubServers
+    stubs = StubServers(embedding_dim=args.embedding_dim, chat_latency_ms=args.stub_chat_latency_ms).start()
+    env = dict(os.environ, OLLAMA_BASE_URL=stubs.ollama_url, BAD_API_ENDPOINT=stubs.patient_url, PATIENT_API_HTTP2="false")
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    deadline = time.time() + 120  # Model loading (CrossEncoder) dominates startup
+    while time.time() < deadline:
+        if app.poll() is not None:
+            stubs.stop()
+            raise RuntimeError(f"App exited during startup (code {app.returncode})")
+        try:
+            if httpx.get(f"{base_url}/api/stats", timeout=1.0).status_code == 200:
+                return base_url, stubs, app
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    app.terminate()
+    stubs.stop()
+    raise RuntimeError("App did not become ready within 120s")
+
+
+async def run(args, base_url: str):
+    questions = load_questions(args.data, args.max_questions)
+    if not questions:
+        raise SystemExit(f"No questions with answers in {args.data}")
+    total = args.requests or (len(questions) if args.duration is None else None)
+    plan = request_plan(questions, total, args.seed)
+    url = base_url.rstrip("/") + args.endpoint
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for question, expected in questions[:args.warmup]:
+            await send(client, url, question, expected)
+
+        print(f"🚀 {args.mode} loop against {url} "
+              f"({'concurrency ' + str(args.concurrency) if args.mode == 'closed' else str(args.rps) + ' rps'})")
+        start = time.perf_counter()
+        if args.mode == "closed":
+            records = await run_closed_loop(client, url, plan, args.concurrency, args.duration)
+        else:
+            records = await run_open_loop(client, url, plan, args.rps, args.poisson, args.seed, args.duration)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "url": url,
+            "mode": args.mode,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "rps": args.rps if args.mode == "open" else None,
+            "poisson": args.poisson,
+            "requests": args.requests,
+            "duration": args.duration,
+            "questions": len(questions),
+            "stub": args.stub,
+            "python": platform.python_version(),
+        },
+        "summary": summarize(records, elapsed),
+    }
+
+
+def main():
+    args = parse_args()
+    base_url, stubs, app = args.url, None, None
+    if args.stub:
+        base_url, stubs, app = launch_app_with_stubs(args)
+    try:
+        report = asyncio.run(run(args, base_url))
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait(timeout=30)
+        if stubs is not None:
+            stubs.stop()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline_diff"] = diff_against_baseline(report["summary"], baseline.get("summary", baseline))
+        if args.max_regression is not None and any(
+            d["regressed_pct"] > args.max_regression for d in report["baseline_diff"].values()
+        ):
+            exit_code = 1
+    print_report(report)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +0,0 @@
-import csv
-import time
-import requests
-import statistics
-import argparse
-from concurrent.futures import ThreadPoolExecutor
-
-# Default local, but can be overridden
-API_URL = "http://localhost:8000/api/ask"
-DATA_PATH = "data/raw/QA.csv"
-MAX_QUESTIONS = 50  # Test first 50 for speed
-
-def parse_args():
-    parser = argparse.ArgumentParser(description="Healthcare AI Benchmark")
-    parser.add_argument("--url", type=str, default="http://localhost:8000/api/ask", help="API Endpoint URL")
-    return parser.parse_args()
-
-def test_question(row, url):
-    question = row['Question']
-    correct_answer = row['Answer'].strip()
-    
-    # Skip if no answer key provided
-    if not correct_answer:
-        return None
-
-    start_ts = time.time()
-    try:
-        response = requests.post(url, json={"question": question}, timeout=10)
-        latency = (time.time() - start_ts) * 1000
-        
-        if response.status_code == 200:
-            result = response.json()
-            model_answer = result.get('answer', '').strip()
-            server_latency = result.get('latency_ms', 0)
-            
-            # Check correctness (Exact match of ก,ข,ค,ง)
-            is_correct = model_answer == correct_answer
-            
-            return {
-                "question": question[:30] + "...",
-                "expected": correct_answer,
-                "got": model_answer,
-                "correct": is_correct,
-                "latency": latency,
-                "server_latency": server_latency
-            }
-        else:
-            return {"error": f"Status {response.status_code}"}
-    except Exception as e:
-        return {"error": str(e)}
-
-def run_benchmark():
-    args = parse_args()
-    target_url = args.url
-    print(f"🚀 Benchmarking against: {target_url}")
-    print(f"Loading data from {DATA_PATH}...")
-    questions = []
-    with open(DATA_PATH, 'r', encoding='utf-8-sig') as f: # Use utf-8-sig to handle BOM
-        reader = csv.DictReader(f)
-        # Verify keys
-        if reader.fieldnames:
-            print(f"DEBUG: CSV Headers: {reader.fieldnames}")
-            
-        for row in reader:
-            # Flexible key access (case-insensitive or strip whitespace)
-            q_key = next((k for k in row.keys() if k.strip().lower() == 'question'), None)
-            a_key = next((k for k in row.keys() if k.strip().lower() == 'answer'), None)
-            
-            if q_key and a_key and row[a_key].strip():
-                # Normalize row keys
-                clean_row = {'Question': row[q_key], 'Answer': row[a_key]}
-                questions.append(clean_row)
-    
-    print(f"Found {len(questions)} valid questions. Testing {MAX_QUESTIONS if MAX_QUESTIONS else 'all'}...")
-    
-    target_questions = questions[:MAX_QUESTIONS] if MAX_QUESTIONS else questions
-    results = []
-    
-    # Run sequentially to measure true latency (parallel would stress test throughput, not single-req latency)
-    for i, q in enumerate(target_questions):
-        res = test_question(q, target_url)
-        if res and "error" not in res:
-            results.append(res)
-            status = "✅" if res['correct'] else "❌"
-            print(f"[{i+1}/{len(target_questions)}] {status} Latency: {res['latency']:.0f}ms | Exp: {res['expected']} | Got: {res['got']}")
-        elif res:
-            print(f"[{i+1}/{len(target_questions)}] ⚠️ Error: {res['error']}")
-
-    if not results:
-        print("No results to analyze.")
-        return
-
-    # metrics
-    total = len(results)
-    correct = sum(1 for r in results if r['correct'])
-    accuracy = (correct / total) * 100
-    avg_latency = statistics.mean(r['latency'] for r in results)
-    
-    print("\n" + "="*30)
-    print(" 📊 BENCHMARK REPORT")
-    print("="*30)
-    print(f"Total Questions: {total}")
-    print(f"Accuracy:        {accuracy:.2f}%")
-    print(f"Avg Latency:     {avg_latency:.2f} ms")
-    print("="*30)
-
-if __name__ == "__main__":
-    run_benchmark()
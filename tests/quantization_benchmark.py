@@ -0,0 +1,251 @@
+"""
+Recall vs latency of compressed vectors against the exact float32 baseline.
+
+    python tests/quantization_benchmark.py
+    python tests/quantization_benchmark.py --dims 512 256 --oversampling 1 2 4 --output runs/quant.json
+    python tests/quantization_benchmark.py --qdrant-url http://localhost:6333   # real HNSW + quantization
+    python tests/quantization_benchmark.py --synthetic 20000                   # plumbing check, no Ollama
+
+Corpus vectors are read from the medical_docs collection (ingest with VECTOR_DIM=0 so they
+are full size); queries are QA.csv questions embedded like embed_query does. Ground truth is
+exact cosine top-k over the full vectors. Every setting (dimension x quantization x
+oversampling) reports recall@k against it, query latency and bytes per vector.
+
+The default engine emulates Qdrant's quantizers in NumPy (int8 with a 0.99 quantile range,
+1-bit sign codes; both rescored with the originals), which isolates the accuracy cost of
+compression. --qdrant-url builds each setting as a temporary collection on a server, which
+also measures HNSW; embedded Qdrant ignores quantization, so it cannot be benchmarked there.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import Config
+from src.tools.quantization import truncate_vectors, QUANTIZATION_MODES
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vector quantization benchmark")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--qa-path", default="data/raw/QA.csv")
+    parser.add_argument("--collection", default="medical_docs")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="*", default=[1024, 512, 256], help="Truncated sizes to try")
+    parser.add_argument("--modes", nargs="+", default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    parser.add_argument("--qdrant-url", default=None, help="Benchmark on a Qdrant server instead of the NumPy emulation")
+    parser.add_argument("--synthetic", type=int, default=0, help="Random corpus of this size (no store/Ollama needed)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    return parser.parse_args()
+
+
+def load_corpus(collection: str):
+    from src.tools.vector_store import connect_qdrant
+    client = connect_qdrant()
+    ids, vectors, offset = [], [], None
+    try:
+        while True:
+            records, offset = client.scroll(collection, limit=512, offset=offset, with_vectors=True, with_payload=False)
+            ids.extend(r.id for r in records)
+            vectors.extend(r.vector for r in records)
+            if offset is None:
+                break
+    finally:
+        client.close()
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def load_questions(path: str, limit: int) -> list:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return [row["Question"] for row in csv.DictReader(f) if row.get("Question")][:limit]
+
+
+async def embed_questions(questions: list) -> np.ndarray:
+    from src.tools.embeddings import embed_batch
+    from src.tools.http_client import close_http_clients
+    try:
+        return np.asarray(await embed_batch(questions, prefix="search_query: "), dtype=np.float32)
+    finally:
+        await close_http_clients()
+
+
+def synthetic(n: int, queries: int, dim: int, seed: int):
+    """Clustered random vectors: enough structure for top-k to be meaningful."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(64, dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, 64, n)] + 0.7 * rng.normal(size=(n, dim)).astype(np.float32)
+    query = corpus[rng.integers(0, n, queries)] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return list(range(n)), corpus, query
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class NumpyIndex:
+    """Brute-force emulation of Qdrant's quantized search with rescoring."""
+
+    def __init__(self, corpus: np.ndarray, mode: str):
+        self.corpus = corpus
+        self.mode = mode
+        if mode == "scalar":
+            low, high = np.quantile(corpus, [0.005, 0.995])  # quantile=0.99 keeps the middle 99%
+            self.offset, self.scale = low, (high - low) / 255.0
+            self.codes = np.clip(np.round((corpus - low) / self.scale), 0, 255).astype(np.uint8)
+            self.approx = self.codes.astype(np.float32)  # the first pass runs on the 1-byte codes
+        elif mode == "binary":
+            self.codes = np.packbits(corpus > 0, axis=1)
+
+    def bytes_per_vector(self) -> float:
+        dim = self.corpus.shape[1]
+        return {"none": dim * 4, "scalar": dim, "binary": dim / 8}[self.mode]
+
+    def search(self, query: np.ndarray, k: int, oversampling: float) -> np.ndarray:
+        if self.mode == "none":
+            return exact_top_k(self.corpus, query[None], k)[0]
+        if self.mode == "scalar":
+            # Dot product in code space: ranking-equivalent to the dequantized vectors
+            approx = self.approx @ query
+        else:
+            bits = np.packbits(query > 0)
+            approx = -_POPCOUNT[np.bitwise_xor(self.codes, bits)].sum(axis=1, dtype=np.int32)
+        candidates = min(len(approx), max(k, int(k * oversampling)))
+        top = np.argpartition(-approx, candidates - 1)[:candidates]
+        rescored = self.corpus[top] @ query
+        return top[np.argsort(-rescored)[:k]]
+
+
+def run_numpy(corpus, queries, truth, dim, mode, oversampling, k) -> dict:
+    index = NumpyIndex(corpus, mode)
+    latencies, recall = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = index.search(query, k, oversampling)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recall.append(len(set(found.tolist()) & set(expected.tolist())) / k)
+    return _row(dim, mode, oversampling, recall, latencies, index.bytes_per_vector())
+
+
+def run_qdrant(url, corpus, queries, truth, dim, mode, oversampling, k, build: bool) -> dict:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models
+    from src.tools.quantization import quantization_config, hnsw_config, search_params
+
+    client = QdrantClient(url=url, api_key=Config.QDRANT_API_KEY)
+    name = f"bench_{dim}_{mode}"
+    try:
+        if build:  # once per (dim, mode); oversampling is a query-time setting
+            if client.collection_exists(name):
+                client.delete_collection(name)
+            client.create_collection(
+                name,
+                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=mode != "none"),
+                hnsw_config=hnsw_config(),
+                quantization_config=quantization_config(mode)
+            )
+            for start in range(0, len(corpus), 512):
+                client.upsert(name, [
+                    models.PointStruct(id=i, vector=v.tolist())
+                    for i, v in zip(range(start, start + 512), corpus[start:start + 512])
+                ])
+            while client.get_collection(name).status != models.CollectionStatus.GREEN:
+                time.sleep(0.5)  # Wait for the HNSW graph and quantized copy to be built
+        params = search_params(mode, oversampling)
+        latencies, recall = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            hits = client.query_points(name, query=query.tolist(), limit=k, search_params=params).points
+            latencies.append((time.perf_counter() - start) * 1000)
+            recall.append(len({h.id for h in hits} & set(expected.tolist())) / k)
+    finally:
+        client.close()
+    bytes_per_vector = {"none": dim * 4, "scalar": dim, "binary": dim / 8}[mode]
+    return _row(dim, mode, oversampling, recall, latencies, bytes_per_vector)
+
+
+def drop_bench_collections(url: str):
+    from qdrant_client import QdrantClient
+    client = QdrantClient(url=url, api_key=Config.QDRANT_API_KEY)
+    try:
+        for collection in client.get_collections().collections:
+            if collection.name.startswith("bench_"):
+                client.delete_collection(collection.name)
+    finally:
+        client.close()
+
+
+def _row(dim, mode, oversampling, recall, latencies, bytes_per_vector) -> dict:
+    latencies.sort()
+    return {
+        "dim": dim,
+        "quantization": mode,
+        "oversampling": oversampling if mode != "none" else None,
+        "recall": float(np.mean(recall)),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "bytes_per_vector": bytes_per_vector,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.synthetic:
+        ids, corpus, queries = synthetic(args.synthetic, args.questions, 768, args.seed)
+        source = f"synthetic ({args.synthetic} x 768)"
+    else:
+        ids, corpus = load_corpus(args.collection)
+        if not ids:
+            sys.exit(f"Collection {args.collection} is empty: run the ingestion first (or use --synthetic)")
+        queries = asyncio.run(embed_questions(load_questions(args.qa_path, args.questions)))
+        source = f"{args.collection} ({len(ids)} x {corpus.shape[1]}), {len(queries)} QA.csv questions"
+
+    full_dim = corpus.shape[1]
+    corpus /= np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    truth = exact_top_k(corpus, queries, args.k)
+    print(f"Corpus: {source}; ground truth = exact top-{args.k} at {full_dim} dims")
+
+    rows = []
+    for dim in [full_dim] + sorted({d for d in args.dims if d < full_dim}, reverse=True):
+        dim_corpus, dim_queries = truncate_vectors(corpus, dim), truncate_vectors(queries, dim)
+        for mode in args.modes:
+            for oversampling in (args.oversampling if mode != "none" else [1.0]):
+                if args.qdrant_url:
+                    row = run_qdrant(args.qdrant_url, dim_corpus, dim_queries, truth, dim, mode, oversampling, args.k,
+                                     build=oversampling == args.oversampling[0] or mode == "none")
+                else:
+                    row = run_numpy(dim_corpus, dim_queries, truth, dim, mode, oversampling, args.k)
+                rows.append(row)
+                print(f"  dim {dim:>5} {mode:<7} x{row['oversampling'] or 1:<4g} recall@{args.k} {row['recall']:.3f} | "
+                      f"p50 {row['p50_ms']:.2f}ms | p99 {row['p99_ms']:.2f}ms | {row['bytes_per_vector']:g} B/vector")
+    if args.qdrant_url:
+        drop_bench_collections(args.qdrant_url)
+
+    report = {
+        "engine": "qdrant" if args.qdrant_url else "numpy",
+        "source": source,
+        "k": args.k,
+        "results": rows
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Patient API resilience against the flaky stub (tests/stubs.py): no real upstream needed.
+
+    python tests/resilience_benchmark.py
+    python tests/resilience_benchmark.py --requests 300 --rate 300 --slow-rate 0.05 --output runs/resilience.json
+
+Runs the PatientClient through five phases and reports latency, errors and breaker state:
+  healthy   - fast upstream, the adaptive timeout learns its latency
+  slow_tail - a fraction of calls hang; hedged GETs should keep p99 near the hedge delay
+  outage    - every call fails; the breaker must open and later calls short-circuit
+  recovery  - upstream back; after the cooldown a half-open probe closes the breaker
+  slowdown  - every call now takes --shift-latency-ms, far above the learned timeout but
+              under the ceiling; the timeout must grow to it. Arrivals slow down to what
+              PATIENT_API_MAX_CONCURRENCY can serve at that latency, so queueing in the
+              client doesn't hide the result.
+Lookups arrive open-loop at --rate per second, like real traffic (a closed loop would drain
+the whole phase through the breaker while the one half-open probe is in flight).
+Cache TTLs are set to zero so every lookup reaches the upstream (or the breaker).
+Exits non-zero when recovery or slowdown ends with the breaker not closed or with errors
+in the last quarter of its lookups.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import Config
+from src.log import setup_logging
+from tests.stubs import StubServers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Patient API resilience benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Lookups per phase")
+    parser.add_argument("--rate", type=float, default=200.0, help="Lookups per second")
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--shift-latency-ms", type=float, default=250.0, help="Upstream latency in the slowdown phase")
+    parser.add_argument("--cooldown", type=float, default=1.0, help="Breaker cooldown for the run (s)")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    return parser.parse_args()
+
+
+async def run_phase(client, requests: int, rate: float, offset: int) -> dict:
+    latencies, failed = [], [False] * requests
+
+    async def lookup(i: int):
+        start = time.perf_counter()
+        data = await client.get(str(offset + i))
+        latencies.append((time.perf_counter() - start) * 1000)
+        failed[i] = "error" in data
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(requests):
+        await asyncio.sleep(max(0.0, started + i / rate - time.perf_counter()))
+        tasks.append(asyncio.create_task(lookup(i)))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(failed),
+        "late_errors": sum(failed[requests * 3 // 4:]),  # by arrival: has the client settled?
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max_ms": latencies[-1],
+        "breaker": dict(client.breaker.stats()),
+        "timeout_s": client.get_timeout.current(),
+        "hedge_delay_s": client.get_timeout.hedge_delay(),
+    }
+
+
+async def main_async(args, servers) -> dict:
+    # Configure before the client is created: it reads Config once
+    Config.BAD_API_ENDPOINT = servers.patient_url
+    Config.PATIENT_CACHE_TTL = 0
+    Config.PATIENT_STALE_TTL = 0.001
+    Config.PATIENT_BREAKER_COOLDOWN = args.cooldown
+    from src.tools.api_wrapper import PatientClient
+    from src.tools.http_client import close_http_clients
+
+    handler = servers.patient.RequestHandlerClass
+    client = PatientClient()
+    report = {}
+    try:
+        report["healthy"] = await run_phase(client, args.requests, args.rate, 0)
+
+        handler.slow_rate = args.slow_rate
+        report["slow_tail"] = await run_phase(client, args.requests, args.rate, 10_000)
+        handler.slow_rate = 0.0
+
+        handler.down = True
+        report["outage"] = await run_phase(client, args.requests, args.rate, 20_000)
+
+        handler.down = False
+        await asyncio.sleep(args.cooldown)
+        report["recovery"] = await run_phase(client, args.requests, args.rate, 30_000)
+
+        handler.latency = args.shift_latency_ms / 1000
+        sustainable = 0.8 * Config.PATIENT_API_MAX_CONCURRENCY / handler.latency
+        report["slowdown"] = await run_phase(client, args.requests, min(args.rate, sustainable), 40_000)
+        report["client"] = client.stats()
+    finally:
+        await close_http_clients()
+    return report
+
+
+def main():
+    args = parse_args()
+    with StubServers(patient_latency_ms=args.latency_ms, patient_slow_latency_ms=args.slow_latency_ms) as servers:
+        report = asyncio.run(main_async(args, servers))
+
+    print("\n" + "=" * 60)
+    print(" 🛡️  PATIENT API RESILIENCE")
+    print("=" * 60)
+    for phase in ("healthy", "slow_tail", "outage", "recovery", "slowdown"):
+        r = report[phase]
+        print(f"{phase:<10} p50 {r['p50_ms']:7.1f}ms | p99 {r['p99_ms']:7.1f}ms | "
+              f"errors {r['errors']:>4}/{r['requests']} (last quarter {r['late_errors']:>3}) | "
+              f"breaker {r['breaker']['state']:<9} | timeout {r['timeout_s'] * 1000:.0f}ms")
+    timeouts = report["client"]["timeouts"]["get"]
+    print(f"Hedges: {timeouts['hedges']} sent, {timeouts['hedge_wins']} won, {timeouts['hedges_skipped']} skipped (no free slot) | "
+          f"short-circuited: {report['client']['short_circuited']} | breaker opened {report['client']['breaker']['opened']}x")
+    print("=" * 60)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+
+    stuck = [
+        phase for phase in ("recovery", "slowdown")
+        if report[phase]["breaker"]["state"] != "closed" or report[phase]["late_errors"]
+    ]
+    if stuck:
+        sys.exit(f"Patient client did not recover in: {', '.join(stuck)}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
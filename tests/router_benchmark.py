@@ -0,0 +1,209 @@
+"""
+Routing accuracy and latency of the local intent classifier (src/agent/intent.py).
+
+    python tests/router_benchmark.py
+    python tests/router_benchmark.py --folds 10 --thresholds 0.5 0.6 0.7 0.8 --output runs/router.json
+    python tests/router_benchmark.py --llm   # also time escalations through the Ollama router
+
+Accuracy is k-fold cross-validated on the labeled queries (every query is scored by a model
+that never saw it). For each threshold it reports coverage (answered locally, no LLM call)
+and the accuracy of those local answers. The legacy regex + any() rules are scored as a baseline.
+ROUTING_CASES must be answered locally (confidence >= INTENT_CONFIDENCE_THRESHOLD) with the
+expected intent by the model trained on the full data; the run exits non-zero otherwise.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import Config
+from src.log import setup_logging
+from src.agent.intent import INTENTS, INTENT_KEYWORDS, IntentClassifier, KeywordMatcher, load_labeled_queries
+
+
+# Queries the legacy ID rule answered without the LLM, and must still be: bare IDs go to the
+# patient API, an ID with a clinical question stays hybrid
+ROUTING_CASES = [
+    ("id 42", "api_lookup"),
+    ("รหัส 123", "api_lookup"),
+    ("ขอข้อมูลผู้ป่วย id: 123", "api_lookup"),
+    ("HN 5521", "api_lookup"),
+    ("คนไข้รหัส 12 มีไข้ ควรให้ยาลดไข้ขนาดเท่าไร", "hybrid"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Intent router benchmark")
+    parser.add_argument("--data", default=Config.INTENT_TRAINING_PATH)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--repeat", type=int, default=20, help="Latency: passes over the queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm", action="store_true", help="Also time the LLM router on escalated queries")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    return parser.parse_args()
+
+
+def legacy_route(query: str):
+    """The rules classify_intent used before the local classifier; None = went to the LLM."""
+    if re.search(r'\b(id|รหัส|number)\s*:?\s*\d+', query, re.IGNORECASE):
+        return "api_lookup"
+    if any(keyword in query for keyword in ["avg", "average", "count", "total", "กี่คน", "เฉลี่ย"]):
+        return "sql_query"
+    return None
+
+
+def cross_validate(texts: list, intents: list, folds: int, seed: int):
+    """[(expected, predicted, confidence)] with every query predicted by a model trained without it."""
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    results = [None] * len(texts)
+    for fold in range(folds):
+        held_out = set(order[fold::folds])
+        train = [i for i in order if i not in held_out]
+        model = IntentClassifier().fit([texts[i] for i in train], [intents[i] for i in train])
+        for i in held_out:
+            predicted, confidence = model.predict(texts[i])
+            results[i] = (intents[i], predicted, confidence)
+    return results
+
+
+def confusion(results: list) -> dict:
+    matrix = {expected: {predicted: 0 for predicted in INTENTS} for expected in INTENTS}
+    for expected, predicted, _ in results:
+        matrix[expected][predicted] += 1
+    return matrix
+
+
+def threshold_sweep(results: list, thresholds: list) -> list:
+    rows = []
+    for threshold in thresholds:
+        local = [(e, p) for e, p, c in results if c >= threshold]
+        rows.append({
+            "threshold": threshold,
+            "coverage": len(local) / len(results),
+            "local_accuracy": sum(e == p for e, p in local) / len(local) if local else 0.0,
+            "llm_calls": len(results) - len(local),
+        })
+    return rows
+
+
+def check_cases(model, threshold: float) -> list:
+    """[{query, expected, predicted, confidence, ok}] for ROUTING_CASES."""
+    rows = []
+    for query, expected in ROUTING_CASES:
+        predicted, confidence = model.predict(query)
+        ok = predicted == expected and confidence >= threshold
+        rows.append({"query": query, "expected": expected, "predicted": predicted, "confidence": confidence, "ok": ok})
+    return rows
+
+
+def time_us(fn, queries: list, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "p50": samples[len(samples) // 2],
+        "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "mean": statistics.fmean(samples),
+    }
+
+
+async def time_llm(queries: list) -> dict:
+    from src.agent.router import _ask_llm
+    samples, failures = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        if await _ask_llm(query) is None:
+            failures += 1
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "failures": failures,
+        "p50_ms": samples[len(samples) // 2] if samples else 0.0,
+        "max_ms": samples[-1] if samples else 0.0,
+    }
+
+
+def main():
+    args = parse_args()
+    texts, intents = load_labeled_queries(args.data)
+    print(f"Loaded {len(texts)} labeled queries from {args.data}")
+
+    results = cross_validate(texts, intents, args.folds, args.seed)
+    accuracy = sum(e == p for e, p, _ in results) / len(results)
+    legacy = [(intent, legacy_route(text)) for text, intent in zip(texts, intents)]
+    legacy_local = [(e, p) for e, p in legacy if p is not None]
+
+    start = time.perf_counter()
+    model = IntentClassifier().fit(texts, intents)
+    train_ms = (time.perf_counter() - start) * 1000
+    matcher = KeywordMatcher(INTENT_KEYWORDS)
+
+    report = {
+        "queries": len(texts),
+        "folds": args.folds,
+        "accuracy": accuracy,
+        "confusion": confusion(results),
+        "thresholds": threshold_sweep(results, args.thresholds),
+        "legacy_rules": {
+            "coverage": len(legacy_local) / len(legacy),
+            "local_accuracy": sum(e == p for e, p in legacy_local) / len(legacy_local) if legacy_local else 0.0,
+        },
+        "train_ms": train_ms,
+        "cases": check_cases(model, Config.INTENT_CONFIDENCE_THRESHOLD),
+        "latency_us": {
+            "keyword_matcher": time_us(matcher.matches, texts, args.repeat),
+            "classifier": time_us(model.predict, texts, args.repeat),
+            "legacy_rules": time_us(legacy_route, texts, args.repeat),
+        },
+    }
+    if args.llm:
+        escalated = [t for t, (_, _, c) in zip(texts, results) if c < Config.INTENT_CONFIDENCE_THRESHOLD] or texts[:10]
+        report["llm_router"] = asyncio.run(time_llm(escalated))
+
+    print("\n" + "=" * 52)
+    print(" 🧭 ROUTER BENCHMARK")
+    print("=" * 52)
+    print(f"Cross-validated accuracy: {accuracy * 100:.1f}% ({args.folds} folds)")
+    print(f"Legacy rules:             {report['legacy_rules']['coverage'] * 100:.0f}% answered locally, "
+          f"{report['legacy_rules']['local_accuracy'] * 100:.1f}% of those correct")
+    for row in report["thresholds"]:
+        print(f"  threshold {row['threshold']:.2f}: {row['coverage'] * 100:5.1f}% local "
+              f"({row['local_accuracy'] * 100:.1f}% correct), {row['llm_calls']} LLM calls")
+    for name, lat in report["latency_us"].items():
+        print(f"Latency {name:<16} p50 {lat['p50']:.0f}us | p99 {lat['p99']:.0f}us")
+    print(f"Training:                 {train_ms:.0f}ms")
+    for case in report["cases"]:
+        print(f"  {'ok  ' if case['ok'] else 'FAIL'} {case['query']!r}: {case['predicted']} "
+              f"{case['confidence']:.2f} (expected {case['expected']})")
+    if "llm_router" in report:
+        llm = report["llm_router"]
+        print(f"LLM router:               p50 {llm['p50_ms']:.0f}ms | max {llm['max_ms']:.0f}ms ({llm['failures']} failures)")
+    print("=" * 52)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+    failed = [case["query"] for case in report["cases"] if not case["ok"]]
+    if failed:
+        sys.exit(f"Routing cases not answered locally as expected: {failed}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
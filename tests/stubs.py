@@ -0,0 +1,297 @@
+"""
+Stub upstreams for offline benchmarking: a fake Ollama and a fake patient API.
+Standard library only (ThreadingHTTPServer), so they run anywhere the benchmark runs.
+
+    python tests/stubs.py --ollama-port 11435 --patient-port 8081
+
+Answers are deterministic but meaningless: accuracy measured against the stubs only
+checks the plumbing. Latency knobs let you model a slow model server; the patient API
+can also be made flaky (random 503s, a slow tail, or fully down) to exercise the
+circuit breaker and hedging in src/tools/resilience.py.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CHOICES = ["ก", "ข", "ค", "ง"]
+
+
+def fake_embedding(text: str, dim: int):
+    """Deterministic unit-ish vector derived from the text (same text -> same vector)."""
+    rng = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+def fake_choice(text: str) -> str:
+    return CHOICES[hashlib.sha1(text.encode("utf-8")).digest()[0] % len(CHOICES)]
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real servers
+    disable_nagle_algorithm = True  # headers and body go out in separate writes: avoid the 40ms delayed-ACK stall
+
+    def log_message(self, format, *args):
+        pass  # Quiet: the benchmark prints its own report
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client gave up (timeout, or the losing copy of a hedged request)
+
+    def _delay(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class OllamaStubHandler(_JSONHandler):
+    """/api/embed, /api/chat (plain and streamed), /api/generate (router), /api/tags."""
+
+    embedding_dim = 768
+    embed_latency = 0.005
+    chat_latency = 0.05
+    generate_latency = 0.02
+    token_latency = 0.01
+    prefill_latency = 0.0002  # per prompt token not covered by the cached prefix
+    _cached_prompt = ""  # last rendered prompt, like the KV cache of Ollama's single slot
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self._send_json({"models": []})
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/api/embed":
+            inputs = payload.get("input") or []
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._delay(self.embed_latency)
+            return self._send_json({
+                "model": payload.get("model"),
+                "embeddings": [fake_embedding(text, self.embedding_dim) for text in inputs]
+            })
+        if self.path == "/api/generate":
+            self._delay(self.generate_latency)
+            digit = str(1 + hashlib.sha1(payload.get("prompt", "").encode("utf-8")).digest()[0] % 4)
+            return self._send_json({"model": payload.get("model"), "response": digit, "done": True})
+        if self.path == "/api/chat":
+            question = (payload.get("messages") or [{}])[-1].get("content", "")
+            if payload.get("stream", True):
+                return self._stream_chat(payload, question)
+            prefill = self._prefill(payload)
+            self._delay(self.chat_latency)
+            return self._send_json({
+                "model": payload.get("model"),
+                "message": {"role": "assistant", "content": fake_choice(question)},
+                "done": True,
+                **prefill,
+                "eval_count": 1
+            })
+        self._send_json({"error": "not found"}, status=404)
+
+    def _stream_chat(self, payload: dict, question: str):
+        """NDJSON chunks over chunked transfer encoding, like Ollama's streaming mode."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = f"คำตอบคือ {fake_choice(question)} (stub)".split()
+        prefill = self._prefill(payload)
+        self._delay(self.chat_latency)
+        try:
+            for word in words:
+                self._write_chunk({"model": payload.get("model"), "message": {"role": "assistant", "content": word + " "}, "done": False})
+                self._delay(self.token_latency)
+            self._write_chunk({"model": payload.get("model"), "message": {"role": "assistant", "content": ""}, "done": True, **prefill})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client cancelled the generation
+
+    def _prefill(self, payload: dict) -> dict:
+        """
+        Emulated prompt processing: ~3 characters per token, and only the part after the
+        prefix shared with the previous prompt is evaluated (and paid for).
+        """
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in payload.get("messages") or [])
+        shared = len(os.path.commonprefix([prompt, OllamaStubHandler._cached_prompt]))
+        OllamaStubHandler._cached_prompt = prompt
+        tokens = max(1, (len(prompt) - shared) // 3)
+        self._delay(tokens * self.prefill_latency)
+        return {"prompt_eval_count": tokens, "prompt_eval_duration": int(tokens * self.prefill_latency * 1e9)}
+
+    def _write_chunk(self, obj: dict):
+        data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def fake_patient(patient_id: str) -> dict:
+    return {
+        "patient_id": patient_id,
+        "name": f"Patient {patient_id}",
+        "vitals": {"heart_rate": 72, "blood_pressure": "120/80"},
+        "updated_at": time.time()
+    }
+
+
+class PatientStubHandler(_JSONHandler):
+    """
+    GET .../patients/{id} and POST .../patients/batch {"ids": [...]} under any base path
+    (BAD_API_ENDPOINT includes /api/v1). batch_endpoint=False answers the batch route with
+    `no_batch_status` (404, or 405/501 like other servers do).
+    Flaky mode: `failure_rate` of requests get a 503, `slow_rate` take `slow_latency`
+    instead of `latency`, and `down` fails everything. Flip them at runtime on the
+    handler class to script an outage.
+    """
+
+    latency = 0.01
+    batch_endpoint = True
+    no_batch_status = 404
+    failure_rate = 0.0
+    slow_rate = 0.0
+    slow_latency = 1.0
+    down = False
+    _patient_path = re.compile(r"/patients/([^/?]+)$")
+
+    def _flaky(self) -> bool:
+        """Applies the latency (normal or tail); True when this request was answered with a 503."""
+        self._delay(self.slow_latency if random.random() < self.slow_rate else self.latency)
+        if self.down or random.random() < self.failure_rate:
+            self._send_json({"error": "service unavailable"}, status=503)
+            return True
+        return False
+
+    def do_GET(self):
+        match = self._patient_path.search(self.path.split("?")[0])
+        if not match or match.group(1) == "batch":
+            return self._send_json({"error": "not found"}, status=404)
+        if self._flaky():
+            return
+        self._send_json(fake_patient(match.group(1)))
+
+    def do_POST(self):
+        payload = self._read_json()
+        if not self.path.split("?")[0].endswith("/patients/batch"):
+            return self._send_json({"error": "not found"}, status=404)
+        if not self.batch_endpoint:
+            return self._send_json({"error": "no batch endpoint"}, status=self.no_batch_status)
+        if self._flaky():
+            return
+        self._send_json({"patients": [fake_patient(str(pid)) for pid in payload.get("ids", [])]})
+
+
+def _configured(handler, **attrs):
+    """Subclass with per-server settings, so two stubs in one process don't share knobs."""
+    return type(handler.__name__, (handler,), {k: v for k, v in attrs.items() if v is not None})
+
+
+class StubServers:
+    """Starts both stubs on background threads; use as a context manager."""
+
+    def __init__(self, host: str = "127.0.0.1", ollama_port: int = 0, patient_port: int = 0,
+                 embedding_dim: int = 768, chat_latency_ms: float = None, embed_latency_ms: float = None,
+                 patient_latency_ms: float = None, patient_failure_rate: float = None,
+                 patient_slow_rate: float = None, patient_slow_latency_ms: float = None):
+        def seconds(ms):
+            return None if ms is None else ms / 1000
+
+        self.ollama = ThreadingHTTPServer((host, ollama_port), _configured(
+            OllamaStubHandler,
+            embedding_dim=embedding_dim,
+            chat_latency=seconds(chat_latency_ms),
+            embed_latency=seconds(embed_latency_ms)
+        ))
+        self.patient = ThreadingHTTPServer((host, patient_port), _configured(
+            PatientStubHandler,
+            latency=seconds(patient_latency_ms),
+            failure_rate=patient_failure_rate,
+            slow_rate=patient_slow_rate,
+            slow_latency=seconds(patient_slow_latency_ms)
+        ))
+        self.ollama.daemon_threads = True
+        self.patient.daemon_threads = True
+        self._threads = []
+
+    @property
+    def ollama_url(self) -> str:
+        host, port = self.ollama.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def patient_url(self) -> str:
+        host, port = self.patient.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def start(self):
+        for server in (self.ollama, self.patient):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.ollama, self.patient):
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stub Ollama + patient API for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--patient-port", type=int, default=8081)
+    parser.add_argument("--embedding-dim", type=int, default=768, help="Must match the Qdrant collection")
+    parser.add_argument("--chat-latency-ms", type=float, default=None)
+    parser.add_argument("--embed-latency-ms", type=float, default=None)
+    parser.add_argument("--patient-latency-ms", type=float, default=None)
+    parser.add_argument("--patient-failure-rate", type=float, default=None, help="Fraction of patient calls answered 503")
+    parser.add_argument("--patient-slow-rate", type=float, default=None, help="Fraction of patient calls in the slow tail")
+    parser.add_argument("--patient-slow-latency-ms", type=float, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    servers = StubServers(
+        host=args.host,
+        ollama_port=args.ollama_port,
+        patient_port=args.patient_port,
+        embedding_dim=args.embedding_dim,
+        chat_latency_ms=args.chat_latency_ms,
+        embed_latency_ms=args.embed_latency_ms,
+        patient_latency_ms=args.patient_latency_ms,
+        patient_failure_rate=args.patient_failure_rate,
+        patient_slow_rate=args.patient_slow_rate,
+        patient_slow_latency_ms=args.patient_slow_latency_ms
+    ).start()
+    print(f"Stub Ollama:      OLLAMA_BASE_URL={servers.ollama_url}")
+    print(f"Stub patient API: BAD_API_ENDPOINT={servers.patient_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servers.stop()
+        sys.exit(0)
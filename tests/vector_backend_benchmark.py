@@ -0,0 +1,237 @@
+"""
+Parity and latency of the vector search backends (VECTOR_BACKEND=qdrant vs numpy).
+
+    python tests/vector_backend_benchmark.py --synthetic 20000          # no store/Ollama needed
+    python tests/vector_backend_benchmark.py                            # medical_docs collection
+    python tests/vector_backend_benchmark.py --ivf-lists 64 --nprobe 4 8 16 --output runs/backends.json
+
+Both backends get the same corpus and the same queries, and go through the same
+search / search_batch calls that database.py makes. Exact NumPy search (float32 and
+float16) must return Qdrant's top-k (ids and order, scores within float16 precision);
+the run exits non-zero otherwise. IVF settings are approximate and report recall@k
+against the exact result instead. Latency is per query for search() and per query
+amortized over one search_batch() call.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.tools.numpy_store import NumpyVectorIndex, NumpyVectorStore
+from src.log import setup_logging
+
+COLLECTION = "medical_docs"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Qdrant vs NumPy vector backend benchmark")
+    parser.add_argument("--synthetic", type=int, default=0, help="Random corpus of this size (no store needed)")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic vector size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="Queries per search_batch call")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="Also benchmark an IVF index with this many lists")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    return parser.parse_args()
+
+
+def synthetic(n: int, queries: int, dim: int, seed: int):
+    """Clustered random vectors (as in quantization_benchmark.py), queries near corpus points."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(64, dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, 64, n)] + 0.7 * rng.normal(size=(n, dim)).astype(np.float32)
+    query = corpus[rng.integers(0, n, queries)] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32)
+    ids = [f"00000000-0000-0000-0000-{i:012d}" for i in range(n)]
+    payloads = [{"content": f"chunk {i}", "source": "synthetic.pdf", "chunk": i} for i in range(n)]
+    return ids, corpus, payloads, query
+
+
+def load_collection(queries: int, seed: int):
+    """
+    Corpus from the ingested collection; queries are perturbed corpus vectors (no Ollama needed).
+    Point ids keep their type: Qdrant only accepts unsigned ints and UUIDs, hits are compared as str.
+    """
+    from src.tools.vector_store import connect_qdrant
+    client = connect_qdrant()
+    ids, vectors, payloads, offset = [], [], [], None
+    try:
+        while True:
+            records, offset = client.scroll(COLLECTION, limit=512, offset=offset, with_vectors=True, with_payload=True)
+            for record in records:
+                ids.append(record.id)  # int or UUID string, as the collection has them
+                vectors.append(record.vector)
+                payloads.append(record.payload)
+            if offset is None:
+                break
+    finally:
+        client.close()
+    if not ids:
+        sys.exit(f"Collection {COLLECTION} is empty: run the ingestion first (or use --synthetic)")
+    corpus = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    scale = np.abs(corpus).mean()
+    query = corpus[rng.integers(0, len(corpus), queries)] + scale * rng.normal(size=(queries, corpus.shape[1])).astype(np.float32)
+    return ids, corpus, payloads, query
+
+
+def qdrant_backend(ids, corpus, payloads):
+    """The qdrant backend as served (VectorStore) over an in-memory copy of the corpus."""
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models
+    from src.tools.vector_store import VectorStore
+
+    store = VectorStore()
+    store.client = QdrantClient(location=":memory:")
+    store.client.create_collection(
+        COLLECTION, vectors_config=models.VectorParams(size=corpus.shape[1], distance=models.Distance.COSINE)
+    )
+    for start in range(0, len(ids), 512):
+        store.client.upsert(COLLECTION, [
+            models.PointStruct(id=point_id, vector=vector.tolist(), payload=payload)
+            for point_id, vector, payload in zip(ids[start:start + 512], corpus[start:start + 512], payloads[start:start + 512])
+        ])
+    return store
+
+
+def numpy_backend(directory, ids, corpus, payloads, dtype, ivf_lists=0):
+    """The numpy backend as served: built, saved, then re-opened memory-mapped from disk."""
+    store = NumpyVectorStore(os.path.join(directory, f"{dtype}_{ivf_lists}"))
+    start = time.perf_counter()
+    store.write(COLLECTION, NumpyVectorIndex.build(ids, corpus, payloads, dtype=dtype, ivf_lists=ivf_lists))
+    build_s = time.perf_counter() - start
+    return store.open(), build_s
+
+
+def measure(store, queries, k, batch) -> tuple:
+    """(hits per query, single-query latencies ms, amortized batch latency ms per query)."""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(store.search(query.tolist(), COLLECTION, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    batched = []
+    for offset in range(0, len(queries), batch):
+        batched.extend(store.search_batch([q.tolist() for q in queries[offset:offset + batch]], COLLECTION, k))
+    per_query = (time.perf_counter() - start) * 1000 / len(queries)
+    for single, many in zip(results, batched):
+        assert [str(h.id) for h in single] == [str(h.id) for h in many], "search and search_batch disagree"
+    return results, latencies, per_query
+
+
+def compare(results, reference, tolerance) -> dict:
+    """Recall@k, exact id/order agreement and max score difference against the reference hits."""
+    recall, same_order, score_diff = [], 0, 0.0
+    for hits, expected in zip(results, reference):
+        found, wanted = [str(h.id) for h in hits], [str(h.id) for h in expected]
+        recall.append(len(set(found) & set(wanted)) / max(1, len(wanted)))
+        if found == wanted:
+            same_order += 1
+            score_diff = max(score_diff, max((abs(a.score - b.score) for a, b in zip(hits, expected)), default=0.0))
+        elif _tied(hits, expected, tolerance):
+            same_order += 1  # Only near-equal scores swapped places
+    return {"recall": float(np.mean(recall)), "same_order": same_order / len(results), "max_score_diff": score_diff}
+
+
+def _tied(hits, expected, tolerance) -> bool:
+    if len(hits) != len(expected):
+        return False
+    return all(abs(a.score - b.score) <= tolerance for a, b in zip(hits, expected))
+
+
+def _row(name, latencies, batch_ms, extra) -> dict:
+    latencies.sort()
+    return {
+        "backend": name,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "batch_ms_per_query": batch_ms,
+        **extra
+    }
+
+
+def _print(row, k):
+    quality = ""
+    if "recall" in row:
+        quality = f" | recall@{k} {row['recall']:.3f} | same order {row['same_order']:.1%} | max |Δscore| {row['max_score_diff']:.2e}"
+    print(f"  {row['backend']:<22} p50 {row['p50_ms']:.2f}ms | p99 {row['p99_ms']:.2f}ms | "
+          f"batch {row['batch_ms_per_query']:.3f}ms/query{quality}")
+
+
+def main():
+    args = parse_args()
+    if args.synthetic:
+        ids, corpus, payloads, queries = synthetic(args.synthetic, args.queries, args.dim, args.seed)
+        source = f"synthetic ({len(ids)} x {corpus.shape[1]})"
+    else:
+        ids, corpus, payloads, queries = load_collection(args.queries, args.seed)
+        source = f"{COLLECTION} ({len(ids)} x {corpus.shape[1]})"
+    print(f"Corpus: {source}, {len(queries)} queries, top-{args.k}")
+
+    rows, failures = [], []
+    qdrant = qdrant_backend(ids, corpus, payloads)
+    try:
+        reference, latencies, batch_ms = measure(qdrant, queries, args.k, args.batch)
+    finally:
+        qdrant.close()
+    rows.append(_row("qdrant (embedded)", latencies, batch_ms, {}))
+    _print(rows[-1], args.k)
+
+    directory = tempfile.mkdtemp(prefix="vector_backends_")
+    try:
+        for dtype, tolerance in (("float32", 1e-5), ("float16", 2e-3)):
+            store, build_s = numpy_backend(directory, ids, corpus, payloads, dtype)
+            results, latencies, batch_ms = measure(store, queries, args.k, args.batch)
+            row = _row(f"numpy {dtype}", latencies, batch_ms, {"build_s": build_s, **compare(results, reference, tolerance)})
+            rows.append(row)
+            _print(row, args.k)
+            if row["same_order"] < 1.0 or row["max_score_diff"] > tolerance:
+                failures.append(row["backend"])
+
+        if args.ivf_lists:
+            store, build_s = numpy_backend(directory, ids, corpus, payloads, "float32", args.ivf_lists)
+            for nprobe in args.nprobe:
+                index = store.indexes[COLLECTION]
+                results, latencies, batch_ms = measure(_Probed(index, nprobe), queries, args.k, args.batch)
+                row = _row(f"numpy ivf{args.ivf_lists} nprobe={nprobe}", latencies, batch_ms,
+                           {"build_s": build_s, **compare(results, reference, 2e-3)})
+                rows.append(row)
+                _print(row, args.k)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "k": args.k, "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+    if failures:
+        sys.exit(f"Exact NumPy search diverged from Qdrant: {', '.join(failures)}")
+    print("Exact NumPy search matches Qdrant.")
+
+
+class _Probed:
+    """NumpyVectorStore-shaped view of one IVF index with a fixed nprobe."""
+
+    def __init__(self, index: NumpyVectorIndex, nprobe: int):
+        self.index = index
+        self.nprobe = nprobe
+
+    def search(self, vector, collection_name, limit):
+        return self.index.search(vector, limit, self.nprobe)
+
+    def search_batch(self, vectors, collection_name, limit):
+        return self.index.search_batch(vectors, limit, self.nprobe)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()